@@ -0,0 +1,273 @@
+"""
+Capa asíncrona de proveedores de IA para Codestorm Assistant.
+Permite lanzar las llamadas a OpenAI, Anthropic y Gemini con asyncio y, opcionalmente,
+en modo "hedged": si el proveedor principal no responde dentro de un presupuesto de
+latencia, se lanza el siguiente en paralelo y se usa la primera respuesta válida.
+"""
+import os
+import json
+import asyncio
+import logging
+import threading
+import time
+import google.generativeai as genai
+import ai_clients
+import provider_health
+
+logger = logging.getLogger(__name__)
+
+# Bucle de eventos dedicado en un hilo de fondo. Los clientes asíncronos quedan
+# ligados a este bucle, así que todas las llamadas deben pasar por él.
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_hedge_after():
+    """
+    Obtiene el presupuesto de latencia para el modo hedged desde el entorno.
+
+    Returns:
+        float o None: Segundos a esperar antes de lanzar el proveedor alternativo,
+        o None si el modo hedged está desactivado
+    """
+    value = os.environ.get("AI_HEDGE_AFTER_SECONDS", "").strip()
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        return seconds if seconds > 0 else None
+    except ValueError:
+        logger.warning(f"Valor inválido para AI_HEDGE_AFTER_SECONDS: {value}")
+        return None
+
+
+def _get_loop():
+    """Devuelve el bucle de eventos de fondo, arrancándolo si es necesario."""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="ai-async-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def run_sync(coro, timeout=None):
+    """
+    Ejecuta una corrutina en el bucle de fondo y espera su resultado.
+
+    Args:
+        coro: Corrutina a ejecutar
+        timeout: Tiempo máximo de espera en segundos (opcional)
+
+    Returns:
+        El resultado de la corrutina
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    return future.result(timeout=timeout)
+
+
+def get_available_providers():
+    """Devuelve los proveedores con cliente asíncrono disponible, en orden de preferencia."""
+    available = []
+    for provider in ai_clients.get_available_providers():
+        if provider == "openai" and not ai_clients.get_async_openai_client():
+            continue
+        if provider == "anthropic" and not ai_clients.get_async_anthropic_client():
+            continue
+        available.append(provider)
+    return available
+
+
+async def _with_retries(provider_name, call, use_json):
+    """
+    Ejecuta una llamada con 3 intentos y backoff exponencial (1s, 2s),
+    validando el JSON si se solicitó.
+    """
+    for attempt in range(3):
+        try:
+            content = (await call()).strip()
+            if use_json:
+                try:
+                    json.loads(content)
+                except json.JSONDecodeError:
+                    logger.warning(f"{provider_name} devolvió un JSON inválido en el intento {attempt+1}, reintentando...")
+                    if attempt == 2:
+                        raise ValueError("La respuesta no es un JSON válido después de múltiples intentos")
+                    continue
+            return content
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt < 2:
+                wait_time = 2 ** attempt
+                logger.warning(f"Error de {provider_name} (intento {attempt+1}/3): {str(e)}. Reintentando en {wait_time}s...")
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error(f"Error persistente de {provider_name} después de 3 intentos: {str(e)}")
+                raise
+
+
+async def generate_with_openai_async(prompt, system_prompt, temperature=0.7, use_json=False):
+    """Versión asíncrona de generate_with_openai."""
+    async_openai_client = ai_clients.get_async_openai_client()
+    if not async_openai_client:
+        raise ValueError("Cliente de OpenAI no configurado. Verifica la clave API.")
+
+    request_params = {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": 4000
+    }
+    if use_json:
+        request_params["response_format"] = {"type": "json_object"}
+
+    async def call():
+        completion = await async_openai_client.chat.completions.create(**request_params)
+        return completion.choices[0].message.content
+
+    return await _with_retries("OpenAI", call, use_json)
+
+
+async def generate_with_anthropic_async(prompt, system_prompt, temperature=0.7, use_json=False):
+    """Versión asíncrona de generate_with_anthropic."""
+    async_anthropic_client = ai_clients.get_async_anthropic_client()
+    if not async_anthropic_client:
+        raise ValueError("Cliente de Anthropic no configurado. Verifica la clave API.")
+
+    actual_prompt = prompt
+    if use_json:
+        actual_prompt = prompt + "\n\nIMPORTANTE: Tu respuesta debe estar en formato JSON válido sin explicaciones adicionales."
+
+    async def call():
+        message = await async_anthropic_client.messages.create(
+            model="claude-3-5-sonnet-20241022",
+            system=system_prompt,
+            messages=[{"role": "user", "content": actual_prompt}],
+            temperature=temperature,
+            max_tokens=4000
+        )
+        return message.content[0].text
+
+    return await _with_retries("Anthropic", call, use_json)
+
+
+async def generate_with_gemini_async(prompt, system_prompt, temperature=0.7, use_json=False):
+    """Versión asíncrona de generate_with_gemini."""
+    if not ai_clients.ensure_gemini_configured():
+        raise ValueError("Google Gemini no configurado. Verifica la clave API.")
+
+    # Importación diferida para evitar dependencias circulares con agents_utils
+    from agents_utils import GEMINI_SAFETY_SETTINGS, _gemini_generation_config
+
+    combined_prompt = f"{system_prompt}\n\n{prompt}"
+    if use_json:
+        combined_prompt += "\n\nIMPORTANTE: Responde ÚNICAMENTE con un objeto JSON válido, sin explicaciones adicionales ni texto fuera del JSON."
+
+    model = genai.GenerativeModel(
+        model_name="gemini-1.5-pro",
+        generation_config=_gemini_generation_config(temperature),
+        safety_settings=GEMINI_SAFETY_SETTINGS
+    )
+
+    async def call():
+        response = await model.generate_content_async(combined_prompt)
+        return response.text
+
+    return await _with_retries("Gemini", call, use_json)
+
+
+ASYNC_PROVIDERS = {
+    "openai": generate_with_openai_async,
+    "anthropic": generate_with_anthropic_async,
+    "gemini": generate_with_gemini_async
+}
+
+
+async def generate_content_async(prompt, system_prompt, providers, temperature=0.7, use_json=False, hedge_after=None):
+    """
+    Genera contenido probando los proveedores indicados, en paralelo si se activa el modo hedged.
+
+    Sin hedge_after, el siguiente proveedor solo se lanza cuando el anterior falla.
+    Con hedge_after, además se lanza el siguiente proveedor cada vez que pasan
+    hedge_after segundos sin respuesta, y se devuelve la primera respuesta válida.
+
+    Args:
+        prompt: Prompt para generar contenido
+        system_prompt: Prompt de sistema para establecer el rol
+        providers: Lista ordenada de proveedores a probar
+        temperature: Temperatura para la generación (0.0 - 1.0)
+        use_json: Si es True, solicita respuesta en formato JSON
+        hedge_after: Segundos antes de lanzar el siguiente proveedor (opcional)
+
+    Returns:
+        tuple: (proveedor usado, contenido generado)
+    """
+    if not providers:
+        raise ValueError("No hay modelos de IA configurados. Verifica las claves API en las variables de entorno.")
+
+    pending = {}
+    error_messages = []
+    next_index = 0
+
+    async def timed_call(provider):
+        start_time = time.monotonic()
+        try:
+            result = await ASYNC_PROVIDERS[provider](prompt, system_prompt, temperature, use_json)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            provider_health.record_failure(provider, e, time.monotonic() - start_time)
+            raise
+        provider_health.record_success(provider, time.monotonic() - start_time)
+        return result
+
+    def launch_next():
+        """Lanza el siguiente proveedor cuyo circuito permita peticiones."""
+        nonlocal next_index
+        while next_index < len(providers):
+            provider = providers[next_index]
+            next_index += 1
+            if not provider_health.allow_request(provider):
+                error_messages.append(f"Error con {provider}: circuito abierto, proveedor omitido")
+                continue
+            if next_index > 1:
+                logger.info(f"Intentando con {provider} como alternativa")
+            task = asyncio.ensure_future(timed_call(provider))
+            pending[task] = provider
+            return
+
+    launch_next()
+    try:
+        while pending:
+            can_hedge = hedge_after is not None and next_index < len(providers)
+            done, _ = await asyncio.wait(
+                pending.keys(),
+                timeout=hedge_after if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                logger.info(f"Sin respuesta tras {hedge_after}s, lanzando proveedor alternativo en paralelo")
+                launch_next()
+                continue
+
+            for task in done:
+                provider = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    return provider, task.result()
+                error_messages.append(f"Error con {provider}: {str(error)}")
+                logger.error(f"Error en generate_content_async con modelo {provider}: {str(error)}")
+
+            if not pending and next_index < len(providers):
+                launch_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    error_summary = "\n".join(error_messages)
+    raise ValueError(f"No se pudo generar contenido con ningún modelo disponible:\n{error_summary}")
@@ -13,6 +13,12 @@ import anthropic
 import google.generativeai as genai
 from dotenv import load_dotenv
 import file_explorer
+import ai_clients
+import provider_health
+import context_window
+import document_retrieval
+import agents_async
+from response_cache import get_response_cache, get_max_cacheable_temperature, make_cache_key
 
 # Cargar variables de entorno
 load_dotenv()
@@ -22,74 +28,16 @@ logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Configurar clientes de API
-openai_client = None
-anthropic_client = None
-genai_configured = False
-
 def setup_ai_clients():
-    """Configura los clientes de las APIs de IA con parámetros mejorados."""
-    global openai_client, anthropic_client, genai_configured
-    
-    # Configurar OpenAI
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key and openai_api_key.strip():
-        try:
-            # Configuración mejorada con reintentos y timeout
-            openai_client = openai.OpenAI(
-                api_key=openai_api_key.strip(),
-                max_retries=3,
-                timeout=30.0
-            )
-            
-            # Verificar la conexión
-            models = openai_client.models.list()
-            if models:
-                logger.info(f"OpenAI API key configurada: {openai_api_key[:5]}...{openai_api_key[-5:]}")
-            else:
-                logger.warning("Clave de OpenAI configurada, pero no se pudieron listar los modelos")
-        except Exception as e:
-            logger.error(f"Error al configurar OpenAI: {str(e)}")
-            openai_client = None
-    else:
-        logger.warning("No se encontró la clave de API de OpenAI en las variables de entorno o está vacía")
-    
-    # Configurar Anthropic
-    anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if anthropic_api_key and anthropic_api_key.strip():
-        try:
-            # Configuración con timeout
-            anthropic_client = anthropic.Anthropic(
-                api_key=anthropic_api_key.strip(),
-                timeout=30.0
-            )
-            logger.info("Anthropic API key configured successfully.")
-        except Exception as e:
-            logger.error(f"Error al configurar Anthropic: {str(e)}")
-            anthropic_client = None
-    else:
-        logger.warning("No se encontró la clave de API de Anthropic en las variables de entorno o está vacía")
+    """
+    Prepara los clientes de las APIs de IA.
     
-    # Configurar Google Gemini
-    gemini_api_key = os.environ.get("GEMINI_API_KEY")
-    if gemini_api_key and gemini_api_key.strip():
-        try:
-            genai.configure(api_key=gemini_api_key.strip())
-            
-            # Verificar la configuración intentando obtener modelos
-            model = genai.GenerativeModel(model_name="gemini-1.5-pro")
-            if model:
-                genai_configured = True
-                logger.info("Gemini API key configured successfully.")
-            else:
-                logger.warning("Clave de Gemini configurada, pero no se pudo crear un modelo")
-        except Exception as e:
-            logger.error(f"Error al configurar Gemini: {str(e)}")
-            genai_configured = False
-    else:
-        logger.warning("No se encontró la clave de API de Google Gemini en las variables de entorno o está vacía")
+    Los clientes se crean de forma perezosa en ai_clients; aquí solo se lanza la
+    verificación de las claves en segundo plano, sin bloquear el arranque.
+    """
+    ai_clients.start_background_verification()
 
-# Configurar los clientes al importar el módulo
+# Verificar los clientes en segundo plano al importar el módulo
 setup_ai_clients()
 
 def get_agent_system_prompt(agent_id):
@@ -229,6 +177,7 @@ def generate_with_openai(prompt, system_prompt, temperature=0.7, use_json=False)
     Returns:
         str: Contenido generado
     """
+    openai_client = ai_clients.get_openai_client()
     if not openai_client:
         raise ValueError("Cliente de OpenAI no configurado. Verifica la clave API.")
     
@@ -305,6 +254,7 @@ def generate_with_anthropic(prompt, system_prompt, temperature=0.7, use_json=Fal
     Returns:
         str: Contenido generado
     """
+    anthropic_client = ai_clients.get_anthropic_client()
     if not anthropic_client:
         raise ValueError("Cliente de Anthropic no configurado. Verifica la clave API.")
     
@@ -367,6 +317,35 @@ def generate_with_anthropic(prompt, system_prompt, temperature=0.7, use_json=Fal
         logger.error(f"Error inesperado en generate_with_anthropic: {str(e)}")
         raise ValueError(f"Error inesperado al generar contenido con Anthropic: {str(e)}")
 
+# Configuración de seguridad compartida por las llamadas a Gemini
+GEMINI_SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+def _gemini_generation_config(temperature):
+    """Devuelve la configuración de generación usada con Gemini."""
+    return {
+        "temperature": temperature,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 4000,
+    }
+
 def generate_with_gemini(prompt, system_prompt, temperature=0.7, use_json=False):
     """
     Genera contenido utilizando la API de Google Gemini con manejo mejorado de errores.
@@ -380,7 +359,7 @@ def generate_with_gemini(prompt, system_prompt, temperature=0.7, use_json=False)
     Returns:
         str: Contenido generado
     """
-    if not genai_configured:
+    if not ai_clients.ensure_gemini_configured():
         raise ValueError("Google Gemini no configurado. Verifica la clave API.")
     
     try:
@@ -390,31 +369,8 @@ def generate_with_gemini(prompt, system_prompt, temperature=0.7, use_json=False)
             combined_prompt += "\n\nIMPORTANTE: Responde ÚNICAMENTE con un objeto JSON válido, sin explicaciones adicionales ni texto fuera del JSON."
             
         # Configuración del modelo con safety settings y temperatura
-        generation_config = {
-            "temperature": temperature,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 4000,
-        }
-        
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
+        generation_config = _gemini_generation_config(temperature)
+        safety_settings = GEMINI_SAFETY_SETTINGS
         
         # Realizar la solicitud con reintentos
         for attempt in range(3):  # 3 intentos máximo
@@ -466,10 +422,20 @@ def generate_with_gemini(prompt, system_prompt, temperature=0.7, use_json=False)
             logger.error(f"Error inesperado en generate_with_gemini: {error_message}")
             raise ValueError(f"Error inesperado al generar contenido con Gemini: {error_message}")
 
-def generate_content(prompt, system_prompt, model="openai", temperature=0.7, use_json=False, display_provider=False):
+# Nombre del modelo usado por cada proveedor (forma parte de la clave de caché)
+PROVIDER_MODEL_NAMES = {
+    "openai": "gpt-4o",
+    "anthropic": "claude-3-5-sonnet-20241022",
+    "gemini": "gemini-1.5-pro"
+}
+
+def generate_content(prompt, system_prompt, model="openai", temperature=0.7, use_json=False, display_provider=False, hedge_after=None, use_cache=None):
     """
     Genera contenido utilizando el modelo especificado con manejo mejorado de errores.
     
+    Las llamadas deterministas (temperatura menor o igual a AI_CACHE_MAX_TEMPERATURE)
+    se sirven desde la caché de respuestas cuando el mismo prompt ya se ha resuelto.
+    
     Args:
         prompt: Prompt para generar contenido
         system_prompt: Prompt de sistema para establecer el rol
@@ -477,87 +443,285 @@ def generate_content(prompt, system_prompt, model="openai", temperature=0.7, use
         temperature: Temperatura para la generación (0.0 - 1.0)
         use_json: Si es True, solicita respuesta en formato JSON
         display_provider: Si es True, añade información sobre el proveedor de AI usado
+        hedge_after: Segundos de espera antes de lanzar un proveedor alternativo en paralelo.
+            Si es None se usa AI_HEDGE_AFTER_SECONDS; sin valor, el fallback es secuencial.
+        use_cache: Fuerza (True) o desactiva (False) la caché; None decide según la temperatura
         
     Returns:
         str: Contenido generado
     """
-    # Determinar los modelos disponibles y ordenarlos
-    available_models = []
-    if openai_client:
-        available_models.append("openai")
-    if anthropic_client:
-        available_models.append("anthropic")
-    if genai_configured:
-        available_models.append("gemini")
+    if use_cache is None:
+        use_cache = not display_provider and temperature <= get_max_cacheable_temperature()
+    
+    if not use_cache:
+        return _generate_content(prompt, system_prompt, model, temperature, use_json, display_provider, hedge_after)[1]
+    
+    cache = get_response_cache()
+    cache_key = make_cache_key(model, PROVIDER_MODEL_NAMES.get(model, model), system_prompt, prompt, temperature, use_json)
+    cached_content = cache.get(cache_key)
+    if cached_content is not None:
+        logger.info(f"Respuesta servida desde la caché ({model}, temperatura {temperature})")
+        return cached_content
+    
+    provider_used, response_content = _generate_content(prompt, system_prompt, model, temperature, use_json, display_provider, hedge_after)
+    if response_content:
+        # La respuesta se guarda con la clave del proveedor que contestó: si fue una
+        # alternativa, no debe servirse a quien pida el modelo solicitado
+        if provider_used != model:
+            cache_key = make_cache_key(provider_used, PROVIDER_MODEL_NAMES.get(provider_used, provider_used),
+                                       system_prompt, prompt, temperature, use_json)
+        cache.set(cache_key, response_content)
+    return response_content
+
+GENERATE_PROVIDERS = {
+    "openai": generate_with_openai,
+    "anthropic": generate_with_anthropic,
+    "gemini": generate_with_gemini
+}
+
+PROVIDER_NOTES = {
+    "openai": "🤖 *Generado por OpenAI*",
+    "anthropic": "🤖 *Generado por Anthropic Claude*",
+    "gemini": "🤖 *Generado por Google Gemini*"
+}
+
+FALLBACK_PROVIDER_NOTES = {
+    "openai": "🤖 *Generado por OpenAI (proveedor alternativo)*",
+    "anthropic": "🤖 *Generado por Anthropic Claude (proveedor alternativo)*",
+    "gemini": "🤖 *Generado por Google Gemini (proveedor alternativo)*"
+}
+
+def get_routed_providers(model):
+    """
+    Devuelve los proveedores a probar para una petición, ordenados según su salud.
+    
+    Args:
+        model: Proveedor solicitado (openai, anthropic, gemini)
+        
+    Returns:
+        list: Proveedores disponibles con el circuito cerrado o semiabierto
+    """
+    # Determinar los modelos disponibles
+    available_models = ai_clients.get_available_providers()
     
     # Si no hay modelos configurados, lanzar error
     if not available_models:
         raise ValueError("No hay modelos de IA configurados. Verifica las claves API en las variables de entorno.")
     
-    # Si el modelo solicitado no está disponible, usar el primero disponible
-    model_to_use = model
-    if model not in available_models and available_models:
-        model_to_use = available_models[0]
-        logger.warning(f"Modelo {model} no disponible, usando {model_to_use} en su lugar")
+    if model not in available_models:
+        logger.warning(f"Modelo {model} no disponible, usando un proveedor alternativo")
     
-    # Generar respuesta con manejo de errores
+    candidates = provider_health.rank_providers(model, available_models)
+    if not candidates:
+        raise ValueError("Todos los proveedores de IA están temporalmente deshabilitados por errores recientes. Intenta de nuevo en unos segundos.")
+    return candidates
+
+def _generate_content(prompt, system_prompt, model, temperature, use_json, display_provider, hedge_after):
+    """
+    Implementación de generate_content sin caché.
+    
+    Returns:
+        tuple: (proveedor que respondió, contenido generado)
+    """
+    candidates = get_routed_providers(model)
+    
+    # Modo hedged: delegar en la capa asíncrona, que lanza las alternativas en paralelo
+    if hedge_after is None:
+        hedge_after = agents_async.get_hedge_after()
+    if hedge_after is not None:
+        async_available = agents_async.get_available_providers()
+        ordered_models = [m for m in candidates if m in async_available]
+        if ordered_models:
+            provider_used, response_content = agents_async.run_sync(
+                agents_async.generate_content_async(
+                    prompt, system_prompt, ordered_models, temperature, use_json, hedge_after
+                )
+            )
+            if response_content and display_provider:
+                response_content += f"\n\n{PROVIDER_NOTES.get(provider_used, '')}"
+            return provider_used, response_content
+    
+    # Generar respuesta con manejo de errores, probando los proveedores en orden
     error_messages = []
-    response_content = None
     
-    try:
-        # Intentar con el modelo principal
-        if model_to_use == "openai":
-            response_content = generate_with_openai(prompt, system_prompt, temperature, use_json)
-        elif model_to_use == "anthropic":
-            response_content = generate_with_anthropic(prompt, system_prompt, temperature, use_json)
-        elif model_to_use == "gemini":
-            response_content = generate_with_gemini(prompt, system_prompt, temperature, use_json)
+    for provider in candidates:
+        if provider != candidates[0]:
+            logger.info(f"Intentando con {provider} como alternativa")
         
-        # Si se obtuvo contenido y se solicita mostrar el proveedor, añadir la información
-        if response_content and display_provider:
-            provider_note = {
-                "openai": "🤖 *Generado por OpenAI*",
-                "anthropic": "🤖 *Generado por Anthropic Claude*",
-                "gemini": "🤖 *Generado por Google Gemini*"
-            }
-            response_content += f"\n\n{provider_note.get(model_to_use, '')}"
+        # En estado semiabierto solo se permite una petición de prueba a la vez
+        if not provider_health.allow_request(provider):
+            error_messages.append(f"Error con {provider}: circuito abierto, proveedor omitido")
+            continue
         
-        return response_content
-    except Exception as primary_error:
-        error_messages.append(f"Error con {model_to_use}: {str(primary_error)}")
-        logger.error(f"Error en generate_content con modelo {model_to_use}: {str(primary_error)}")
+        start_time = time.monotonic()
+        try:
+            response_content = GENERATE_PROVIDERS[provider](prompt, system_prompt, temperature, use_json)
+        except Exception as e:
+            provider_health.record_failure(provider, e, time.monotonic() - start_time)
+            error_messages.append(f"Error con {provider}: {str(e)}")
+            logger.error(f"Error en generate_content con modelo {provider}: {str(e)}")
+            continue
+        provider_health.record_success(provider, time.monotonic() - start_time)
         
-        # Intentar con modelos alternativos
-        fallback_models = [m for m in available_models if m != model_to_use]
-        for fallback_model in fallback_models:
-            try:
-                logger.info(f"Intentando con {fallback_model} como alternativa")
-                
-                if fallback_model == "openai":
-                    response_content = generate_with_openai(prompt, system_prompt, temperature, use_json)
-                elif fallback_model == "anthropic":
-                    response_content = generate_with_anthropic(prompt, system_prompt, temperature, use_json)
-                elif fallback_model == "gemini":
-                    response_content = generate_with_gemini(prompt, system_prompt, temperature, use_json)
-                
-                # Si se obtuvo contenido y se solicita mostrar el proveedor, añadir la información
-                if response_content and display_provider:
-                    provider_note = {
-                        "openai": "🤖 *Generado por OpenAI (proveedor alternativo)*",
-                        "anthropic": "🤖 *Generado por Anthropic Claude (proveedor alternativo)*",
-                        "gemini": "🤖 *Generado por Google Gemini (proveedor alternativo)*"
-                    }
-                    response_content += f"\n\n{provider_note.get(fallback_model, '')}"
-                
-                return response_content
-            except Exception as fallback_error:
-                error_messages.append(f"Error con {fallback_model}: {str(fallback_error)}")
-                logger.error(f"Error en generate_content con modelo de fallback {fallback_model}: {str(fallback_error)}")
-                continue
+        # Si se obtuvo contenido y se solicita mostrar el proveedor, añadir la información
+        if response_content and display_provider:
+            notes = PROVIDER_NOTES if provider == model else FALLBACK_PROVIDER_NOTES
+            response_content += f"\n\n{notes.get(provider, '')}"
         
-        # Si todos los modelos fallan, generar un mensaje de error detallado
-        error_summary = "\n".join(error_messages)
-        raise ValueError(f"No se pudo generar contenido con ningún modelo disponible:\n{error_summary}")
+        return provider, response_content
+    
+    # Si todos los modelos fallan, generar un mensaje de error detallado
+    error_summary = "\n".join(error_messages)
+    raise ValueError(f"No se pudo generar contenido con ningún modelo disponible:\n{error_summary}")
+
+def stream_with_openai(prompt, system_prompt, temperature=0.7):
+    """
+    Genera contenido con OpenAI devolviendo los fragmentos a medida que llegan.
+
+    Args:
+        prompt: Prompt para generar contenido
+        system_prompt: Prompt de sistema para establecer el rol
+        temperature: Temperatura para la generación (0.0 - 1.0)
+
+    Yields:
+        str: Fragmentos de texto generados por el modelo
+    """
+    openai_client = ai_clients.get_openai_client()
+    if not openai_client:
+        raise ValueError("Cliente de OpenAI no configurado. Verifica la clave API.")
+
+    stream = openai_client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_tokens=4000,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def stream_with_anthropic(prompt, system_prompt, temperature=0.7):
+    """
+    Genera contenido con Anthropic devolviendo los fragmentos a medida que llegan.
+
+    Args:
+        prompt: Prompt para generar contenido
+        system_prompt: Prompt de sistema para establecer el rol
+        temperature: Temperatura para la generación (0.0 - 1.0)
+
+    Yields:
+        str: Fragmentos de texto generados por el modelo
+    """
+    anthropic_client = ai_clients.get_anthropic_client()
+    if not anthropic_client:
+        raise ValueError("Cliente de Anthropic no configurado. Verifica la clave API.")
+
+    with anthropic_client.messages.stream(
+        model="claude-3-5-sonnet-20241022",
+        system=system_prompt,
+        messages=[
+            {"role": "user", "content": prompt}
+        ],
+        temperature=temperature,
+        max_tokens=4000
+    ) as stream:
+        for text in stream.text_stream:
+            if text:
+                yield text
+
+def stream_with_gemini(prompt, system_prompt, temperature=0.7):
+    """
+    Genera contenido con Google Gemini devolviendo los fragmentos a medida que llegan.
+
+    Args:
+        prompt: Prompt para generar contenido
+        system_prompt: Prompt de sistema para establecer el rol
+        temperature: Temperatura para la generación (0.0 - 1.0)
+
+    Yields:
+        str: Fragmentos de texto generados por el modelo
+    """
+    if not ai_clients.ensure_gemini_configured():
+        raise ValueError("Google Gemini no configurado. Verifica la clave API.")
+
+    model = genai.GenerativeModel(
+        model_name="gemini-1.5-pro",
+        generation_config=_gemini_generation_config(temperature),
+        safety_settings=GEMINI_SAFETY_SETTINGS
+    )
+    response = model.generate_content(f"{system_prompt}\n\n{prompt}", stream=True)
+    for chunk in response:
+        text = getattr(chunk, 'text', '')
+        if text:
+            yield text
+
+STREAM_PROVIDERS = {
+    "openai": stream_with_openai,
+    "anthropic": stream_with_anthropic,
+    "gemini": stream_with_gemini
+}
+
+def generate_content_stream(prompt, system_prompt, model="openai", temperature=0.7):
+    """
+    Variante en streaming de generate_content.
+
+    Usa el mismo enrutado por salud que generate_content. Solo se recurre a un
+    proveedor alternativo si el anterior falla antes de emitir el primer fragmento;
+    una vez enviado texto al cliente, un error se propaga tal cual.
+
+    Args:
+        prompt: Prompt para generar contenido
+        system_prompt: Prompt de sistema para establecer el rol
+        model: Modelo a utilizar (openai, anthropic, gemini)
+        temperature: Temperatura para la generación (0.0 - 1.0)
+
+    Yields:
+        str: Fragmentos de texto a medida que los devuelve el proveedor
+    """
+    candidates = get_routed_providers(model)
+    error_messages = []
+
+    for candidate in candidates:
+        if not provider_health.allow_request(candidate):
+            error_messages.append(f"Error con {candidate}: circuito abierto, proveedor omitido")
+            continue
+
+        emitted = False
+        start_time = time.monotonic()
+        first_chunk_latency = None
+        try:
+            for delta in STREAM_PROVIDERS[candidate](prompt, system_prompt, temperature):
+                if not emitted:
+                    # En streaming la latencia relevante es la del primer fragmento
+                    first_chunk_latency = time.monotonic() - start_time
+                    emitted = True
+                yield delta
+        except Exception as e:
+            provider_health.record_failure(candidate, e, time.monotonic() - start_time)
+            if emitted:
+                logger.error(f"Error en el streaming con {candidate} tras emitir contenido: {str(e)}")
+                raise
+            error_messages.append(f"Error con {candidate}: {str(e)}")
+            logger.error(f"Error iniciando streaming con {candidate}: {str(e)}")
+            continue
+        except BaseException:
+            # El cliente se desconectó (GeneratorExit): si el proveedor ya respondía la
+            # llamada cuenta como correcta; si no, no hay resultado y se libera la prueba
+            # en semiabierto para no bloquear la recuperación hasta probe_timeout
+            if emitted:
+                provider_health.record_success(candidate, first_chunk_latency)
+            else:
+                provider_health.release_probe(candidate)
+            raise
+        provider_health.record_success(candidate, first_chunk_latency or (time.monotonic() - start_time))
+        return
+
+    error_summary = "\n".join(error_messages)
+    raise ValueError(f"No se pudo generar contenido con ningún modelo disponible:\n{error_summary}")
 
 def create_file_with_agent(description, file_type, filename, agent_id, workspace_path, model="openai"):
     """
@@ -681,75 +845,107 @@ def create_file_with_agent(description, file_type, filename, agent_id, workspace
             'error': f'Error generando contenido del archivo: {str(e)}'
         }
 
-def generate_response(user_message, agent_id="general", context=None, model="openai", document_context=None):
+def build_response_prompt(user_message, agent_id="general", context=None, document_context=None, model="openai", conversation_id=None):
     """
-    Genera una respuesta utilizando un agente especializado.
+    Construye el prompt y el prompt de sistema para responder a un mensaje del usuario.
+    
+    El historial se ajusta al presupuesto de tokens con context_window: los turnos
+    recientes se envían literalmente y los antiguos como resumen de la conversación.
     
     Args:
         user_message: Mensaje del usuario
         agent_id: ID del agente especializado
         context: Contexto de la conversación (opcional)
-        model: Modelo de IA a utilizar (openai, anthropic, gemini)
         document_context: Contexto extraído de un documento (opcional)
+        model: Modelo de IA que recibirá el prompt (para contar tokens)
+        conversation_id: ID de la conversación para mantener su resumen (opcional)
         
     Returns:
-        dict: Resultado de la operación con claves success y response
+        tuple: (prompt, system_prompt)
     """
-    try:
-        # Detectar si es un saludo simple
-        simple_greeting_pattern = r'^(hola|hello|hi|hey|buenas|saludos|qué tal|que tal|ey|hey)[\s!.\?]*$'
-        is_simple_greeting = re.match(simple_greeting_pattern, user_message.lower().strip())
+    # Detectar si es un saludo simple
+    simple_greeting_pattern = r'^(hola|hello|hi|hey|buenas|saludos|qué tal|que tal|ey|hey)[\s!.\?]*$'
+    is_simple_greeting = re.match(simple_greeting_pattern, user_message.lower().strip())
+    
+    # Para saludos simples, también usar el modelo de IA para responder
+    logger.info(f"Tipo de mensaje: {'Simple (saludo)' if is_simple_greeting else 'Complejo'}")
+    system_prompt = get_agent_system_prompt(agent_id)
+    agent_name = get_agent_name(agent_id)
+    
+    # Construir el prompt basado en el contexto disponible
+    prompt_parts = []
+    
+    # Añadir contexto de documento si está disponible
+    if document_context and 'content' in document_context:
+        # Enviar solo los fragmentos del documento relevantes para la pregunta
+        document_context = document_retrieval.select_document_context(document_context, user_message, model)
+        doc_content = document_context['content']
+        if document_context.get('retrieved_chunks'):
+            content_label = (f"Fragmentos relevantes ({document_context['retrieved_chunks']} de "
+                             f"{document_context['total_chunks']}, separados por [...]):")
+        else:
+            content_label = "Contenido:"
         
-        # Para saludos simples, también usar el modelo de IA para responder
-        logger.info(f"Tipo de mensaje: {'Simple (saludo)' if is_simple_greeting else 'Complejo'}")
-        system_prompt = get_agent_system_prompt(agent_id)
-        agent_name = get_agent_name(agent_id)
+        prompt_parts.append(f"""CONTEXTO DEL DOCUMENTO:
+        Fuente: {document_context.get('source', 'documento')}
+        Tipo: {document_context.get('type', 'texto')}
         
-        # Construir el prompt basado en el contexto disponible
-        prompt_parts = []
+        {content_label}
+        {doc_content}
         
-        # Añadir contexto de documento si está disponible
-        if document_context and 'content' in document_context:
-            # Truncar el contenido del documento si es muy largo
-            max_context_length = 6000  # Ajustar según necesidad
-            doc_content = document_context['content']
-            if len(doc_content) > max_context_length:
-                doc_content = doc_content[:max_context_length] + "... [Contenido truncado]"
-            
-            prompt_parts.append(f"""CONTEXTO DEL DOCUMENTO:
-            Fuente: {document_context.get('source', 'documento')}
-            Tipo: {document_context.get('type', 'texto')}
-            
-            Contenido:
-            {doc_content}
-            
-            FIN DEL CONTEXTO DEL DOCUMENTO
-            """)
-            
-            # Ajustar el system prompt para incluir instrucciones sobre el documento
-            document_instructions = """
-            INSTRUCCIONES ADICIONALES PARA CONTEXTO DE DOCUMENTO:
-            1. Utiliza la información del documento proporcionado para responder a la consulta del usuario
-            2. Si el documento no contiene información relevante, indícalo claramente
-            3. Asegúrate de no inventar información que no esté en el documento
-            4. Cita o haz referencia al documento cuando sea apropiado
-            """
-            system_prompt = system_prompt + document_instructions
+        FIN DEL CONTEXTO DEL DOCUMENTO
+        """)
         
-        # Añadir historial de conversación si está disponible
-        if context:
-            context_str = "\n".join([f"{'Usuario' if msg['role'] == 'user' else agent_name}: {msg['content']}" for msg in context])
-            prompt_parts.append(f"""Historial de conversación:
-            {context_str}
-            """)
+        # Ajustar el system prompt para incluir instrucciones sobre el documento
+        document_instructions = """
+        INSTRUCCIONES ADICIONALES PARA CONTEXTO DE DOCUMENTO:
+        1. Utiliza la información del documento proporcionado para responder a la consulta del usuario
+        2. Si el documento no contiene información relevante, indícalo claramente
+        3. Asegúrate de no inventar información que no esté en el documento
+        4. Cita o haz referencia al documento cuando sea apropiado
+        """
+        system_prompt = system_prompt + document_instructions
+    
+    # Añadir historial de conversación si está disponible
+    if context:
+        window = context_window.prepare_context(context, model, conversation_id, agent_name)
         
-        # Añadir el mensaje actual del usuario
-        prompt_parts.append(f"""Usuario: {user_message}
+        if window['summary']:
+            prompt_parts.append(f"""Resumen de la conversación anterior:
+        {window['summary']}
+        """)
         
-        Como {agent_name}, responde al mensaje del usuario de manera útil, clara y precisa. Utiliza tu conocimiento y habilidades para proporcionar la mejor respuesta posible en español.""")
+        if window['messages']:
+            context_str = "\n".join([f"{'Usuario' if msg['role'] == 'user' else agent_name}: {msg['content']}" for msg in window['messages']])
+            prompt_parts.append(f"""Historial de conversación:
+        {context_str}
+        """)
+    
+    # Añadir el mensaje actual del usuario
+    prompt_parts.append(f"""Usuario: {user_message}
+    
+    Como {agent_name}, responde al mensaje del usuario de manera útil, clara y precisa. Utiliza tu conocimiento y habilidades para proporcionar la mejor respuesta posible en español.""")
+    
+    # Combinar todas las partes del prompt
+    return "\n\n".join(prompt_parts), system_prompt
+
+def generate_response(user_message, agent_id="general", context=None, model="openai", document_context=None, conversation_id=None):
+    """
+    Genera una respuesta utilizando un agente especializado.
+    
+    Args:
+        user_message: Mensaje del usuario
+        agent_id: ID del agente especializado
+        context: Contexto de la conversación (opcional)
+        model: Modelo de IA a utilizar (openai, anthropic, gemini)
+        document_context: Contexto extraído de un documento (opcional)
+        conversation_id: ID de la conversación para mantener su resumen (opcional)
         
-        # Combinar todas las partes del prompt
-        prompt = "\n\n".join(prompt_parts)
+    Returns:
+        dict: Resultado de la operación con claves success y response
+    """
+    try:
+        prompt, system_prompt = build_response_prompt(user_message, agent_id, context, document_context, model, conversation_id)
         
         # Generar la respuesta (mostrar el proveedor para debug)
         response_content = generate_content(prompt, system_prompt, model, display_provider=False)
@@ -766,6 +962,24 @@ def generate_response(user_message, agent_id="general", context=None, model="ope
             'error': f'Error generando respuesta: {str(e)}'
         }
 
+def generate_response_stream(user_message, agent_id="general", context=None, model="openai", document_context=None, conversation_id=None):
+    """
+    Variante en streaming de generate_response.
+    
+    Args:
+        user_message: Mensaje del usuario
+        agent_id: ID del agente especializado
+        context: Contexto de la conversación (opcional)
+        model: Modelo de IA a utilizar (openai, anthropic, gemini)
+        document_context: Contexto extraído de un documento (opcional)
+        conversation_id: ID de la conversación para mantener su resumen (opcional)
+        
+    Yields:
+        str: Fragmentos de la respuesta a medida que se generan
+    """
+    prompt, system_prompt = build_response_prompt(user_message, agent_id, context, document_context, model, conversation_id)
+    yield from generate_content_stream(prompt, system_prompt, model)
+
 def analyze_code(code, language="python", instructions="Mejorar el código", model="openai"):
     """
     Analiza y mejora código existente.
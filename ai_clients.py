@@ -0,0 +1,220 @@
+"""
+Registro compartido de clientes de IA para Codestorm Assistant.
+Los clientes de OpenAI, Anthropic y Gemini se crean de forma perezosa en el primer uso
+y se reutilizan en todo el proceso (y con ellos sus pools de conexiones HTTP).
+La verificación de las claves se hace en segundo plano, sin bloquear el arranque; un
+proveedor que no la supera se vuelve a verificar con espera exponencial.
+"""
+import os
+import time
+import logging
+import threading
+import openai
+import anthropic
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ["openai", "anthropic", "gemini"]
+
+# Espera antes de volver a verificar un proveedor que falló (se duplica con cada fallo)
+VERIFY_RETRY_BASE = 30
+VERIFY_RETRY_MAX = 1800
+
+_clients = {}
+_lock = threading.Lock()
+_gemini_configured = False
+_verification_thread = None
+# Proveedores con una nueva verificación en curso
+_reverifying = set()
+
+# Estado de la verificación en segundo plano de cada proveedor
+_status = {
+    provider: {'verified': None, 'error': None, 'checked_at': None, 'failures': 0, 'retry_at': None}
+    for provider in PROVIDERS
+}
+
+
+def _get_api_key(provider):
+    """Devuelve la clave de API del proveedor, o None si no está configurada."""
+    env_var = {
+        "openai": "OPENAI_API_KEY",
+        "anthropic": "ANTHROPIC_API_KEY",
+        "gemini": "GEMINI_API_KEY"
+    }[provider]
+    api_key = os.environ.get(env_var, "").strip()
+    return api_key or None
+
+
+def _get_or_create(name, factory):
+    """Devuelve el cliente guardado con ese nombre, creándolo si todavía no existe."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            try:
+                client = factory()
+            except Exception as e:
+                logger.error(f"Error al crear el cliente {name}: {str(e)}")
+                return None
+            _clients[name] = client
+        return client
+
+
+def get_openai_client():
+    """Obtiene el cliente síncrono de OpenAI, o None si no hay clave configurada."""
+    api_key = _get_api_key("openai")
+    if not api_key:
+        return None
+    return _get_or_create("openai", lambda: openai.OpenAI(api_key=api_key, max_retries=3, timeout=30.0))
+
+
+def get_anthropic_client():
+    """Obtiene el cliente síncrono de Anthropic, o None si no hay clave configurada."""
+    api_key = _get_api_key("anthropic")
+    if not api_key:
+        return None
+    return _get_or_create("anthropic", lambda: anthropic.Anthropic(api_key=api_key, timeout=30.0))
+
+
+def get_async_openai_client():
+    """Obtiene el cliente asíncrono de OpenAI, o None si no hay clave configurada."""
+    api_key = _get_api_key("openai")
+    if not api_key:
+        return None
+    return _get_or_create("openai_async", lambda: openai.AsyncOpenAI(api_key=api_key, max_retries=0, timeout=30.0))
+
+
+def get_async_anthropic_client():
+    """Obtiene el cliente asíncrono de Anthropic, o None si no hay clave configurada."""
+    api_key = _get_api_key("anthropic")
+    if not api_key:
+        return None
+    return _get_or_create("anthropic_async", lambda: anthropic.AsyncAnthropic(api_key=api_key, max_retries=0, timeout=30.0))
+
+
+def ensure_gemini_configured():
+    """
+    Configura la librería de Gemini una sola vez por proceso.
+
+    Returns:
+        bool: True si Gemini está configurado
+    """
+    global _gemini_configured
+    if _gemini_configured:
+        return True
+    api_key = _get_api_key("gemini")
+    if not api_key:
+        return False
+    with _lock:
+        if not _gemini_configured:
+            try:
+                genai.configure(api_key=api_key)
+                _gemini_configured = True
+            except Exception as e:
+                logger.error(f"Error al configurar Gemini: {str(e)}")
+        return _gemini_configured
+
+
+def is_provider_available(provider):
+    """
+    Indica si un proveedor puede usarse: tiene clave y no ha fallado la verificación.
+
+    No realiza llamadas de red; si la verificación en segundo plano aún no ha
+    terminado, el proveedor se considera disponible. Si falló, el proveedor queda
+    deshabilitado hasta que una nueva verificación (lanzada en segundo plano cuando
+    vence la espera) tenga éxito.
+    """
+    if not _get_api_key(provider):
+        return False
+    status = _status[provider]
+    if status['verified'] is False:
+        if time.time() >= status['retry_at']:
+            _start_reverification(provider)
+        return False
+    if provider == "openai":
+        return get_openai_client() is not None
+    if provider == "anthropic":
+        return get_anthropic_client() is not None
+    return ensure_gemini_configured()
+
+
+def get_available_providers():
+    """Devuelve los proveedores disponibles en orden de preferencia."""
+    return [provider for provider in PROVIDERS if is_provider_available(provider)]
+
+
+def _verify_provider(provider):
+    """Comprueba la clave de un proveedor con una llamada ligera (sin generar tokens)."""
+    if provider == "openai":
+        get_openai_client().models.list()
+    elif provider == "anthropic":
+        get_anthropic_client().models.list(limit=1)
+    elif provider == "gemini":
+        ensure_gemini_configured()
+        next(iter(genai.list_models()), None)
+
+
+def _check_provider(provider):
+    """Verifica un proveedor y registra el resultado, programando el siguiente intento si falla."""
+    status = _status[provider]
+    try:
+        _verify_provider(provider)
+        status.update({'verified': True, 'error': None, 'checked_at': time.time(),
+                       'failures': 0, 'retry_at': None})
+        logger.info(f"Proveedor {provider} verificado correctamente")
+    except Exception as e:
+        now = time.time()
+        failures = status['failures'] + 1
+        delay = min(VERIFY_RETRY_MAX, VERIFY_RETRY_BASE * 2 ** (failures - 1))
+        status.update({'verified': False, 'error': str(e), 'checked_at': now,
+                       'failures': failures, 'retry_at': now + delay})
+        logger.error(f"Error al verificar el proveedor {provider} (nuevo intento en {delay}s): {str(e)}")
+
+
+def verify_clients():
+    """Verifica todos los proveedores configurados y registra su estado."""
+    for provider in PROVIDERS:
+        if not _get_api_key(provider):
+            continue
+        _check_provider(provider)
+
+
+def _start_reverification(provider):
+    """Vuelve a verificar un proveedor en un hilo de fondo (uno como máximo por proveedor)."""
+    with _lock:
+        if provider in _reverifying:
+            return
+        _reverifying.add(provider)
+
+    def run():
+        try:
+            _check_provider(provider)
+        finally:
+            with _lock:
+                _reverifying.discard(provider)
+
+    threading.Thread(target=run, name=f"ai-clients-verify-{provider}", daemon=True).start()
+
+
+def start_background_verification():
+    """Lanza la verificación de proveedores en un hilo de fondo (una sola vez por proceso)."""
+    global _verification_thread
+    with _lock:
+        if _verification_thread is not None:
+            return
+        _verification_thread = threading.Thread(target=verify_clients, name="ai-clients-verify", daemon=True)
+        _verification_thread.start()
+
+
+def get_client_status():
+    """Devuelve el estado de configuración y verificación de cada proveedor."""
+    return {
+        provider: {
+            'configured': _get_api_key(provider) is not None,
+            **_status[provider]
+        }
+        for provider in PROVIDERS
+    }
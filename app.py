@@ -9,12 +9,13 @@ import re
 import zipfile
 import io
 from pathlib import Path
+from collections import deque
 from threading import Thread
 from datetime import datetime
 from flask import Flask, request, jsonify, render_template, session, send_file, url_for
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from dotenv import load_dotenv
 import openai
 import anthropic
@@ -44,10 +45,13 @@ logging.info(f"Anthropic API key: {'Configured' if anthropic_api_key else 'Missi
 logging.info(f"Gemini API key: {'Configured' if gemini_api_key else 'Missing'}")
 
 # Import utilities for agents with improved prompts with emojis
-from agents_utils import get_agent_system_prompt, get_agent_name, generate_content, explore_repository_files
+import ai_clients
+from agents_utils import get_agent_system_prompt, get_agent_name, generate_content, generate_content_stream, explore_repository_files
 
 # Import diagnostic routes
 from diagnostic_routes import register_diagnostic_routes
+import command_runner
+from command_routes import register_command_routes, job_response_fields
 
 # Comment out the monkey patch to avoid conflicts with OpenAI and other libraries
 # eventlet.monkey_patch(os=True, select=True, socket=True, thread=True, time=True)
@@ -91,79 +95,9 @@ with app.app_context():
 WORKSPACE_ROOT = os.path.abspath("./user_workspaces")
 os.makedirs(WORKSPACE_ROOT, exist_ok=True)
 
-# Initialize AI clients
-logging.info("=== Initializing AI Clients ===")
-
-# Initialize OpenAI client
-openai_client = None
-if openai_api_key:
-    try:
-        openai.api_key = openai_api_key
-        openai_client = openai.OpenAI(api_key=openai_api_key)
-        logging.info(f"OpenAI client initialized successfully. Key: {openai_api_key[:5]}...{openai_api_key[-5:]}")
-
-        # Test OpenAI client with a simple request
-        try:
-            test_response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": "test"}],
-                max_tokens=5
-            )
-            logging.info(f"OpenAI test successful: {test_response.model}")
-        except Exception as test_error:
-            logging.error(f"OpenAI test error: {str(test_error)}")
-    except Exception as e:
-        logging.error(f"Error initializing OpenAI client: {str(e)}")
-        openai_client = None
-else:
-    logging.warning("OPENAI_API_KEY not found. OpenAI functions will not be available.")
-
-# Initialize Anthropic client
-anthropic_client = None
-if anthropic_api_key:
-    try:
-        anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
-        logging.info(f"Anthropic client initialized successfully. Key: {anthropic_api_key[:5]}...{anthropic_api_key[-5:]}")
-
-        # Test Anthropic client with a simple request
-        try:
-            test_response = anthropic_client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=5,
-                messages=[
-                    {"role": "user", "content": "test"}
-                ],
-                system="test"
-            )
-            logging.info(f"Anthropic test successful: {test_response.model}")
-        except Exception as test_error:
-            logging.error(f"Anthropic test error: {str(test_error)}")
-    except Exception as e:
-        logging.error(f"Error initializing Anthropic client: {str(e)}")
-        anthropic_client = None
-else:
-    logging.warning("ANTHROPIC_API_KEY not found. Anthropic functions will not be available.")
-
-# Initialize Google Gemini client
-genai_configured = False
-if gemini_api_key:
-    try:
-        genai.configure(api_key=gemini_api_key)
-        genai_configured = True
-        logging.info(f"Google Gemini API configured successfully. Key: {gemini_api_key[:5]}...{gemini_api_key[-5:]}")
-
-        # Test Gemini client with a simple request
-        try:
-            model = genai.GenerativeModel('gemini-1.5-pro')
-            test_response = model.generate_content("Respond with one word")
-            logging.info(f"Gemini test successful: {test_response.text[:20]}")
-        except Exception as test_error:
-            logging.error(f"Gemini test error: {str(test_error)}")
-    except Exception as e:
-        logging.error(f"Error configuring Google Gemini: {str(e)}")
-        genai_configured = False
-else:
-    logging.warning("GEMINI_API_KEY not found. Google Gemini functions will not be available.")
+# AI clients are created lazily by the shared registry in ai_clients;
+# key verification runs in the background so startup never waits on the network.
+ai_clients.start_background_verification()
 
 def get_user_workspace(user_id="default"):
     """Get or create a workspace directory for the user."""
@@ -217,6 +151,9 @@ def get_user_workspace(user_id="default"):
 
     return workspace_path
 
+# Register background command routes (job status, SSE output stream, cancellation)
+register_command_routes(app, get_user_workspace)
+
 @app.route('/api/test_direct')
 def api_test_direct():
     """Direct test route for diagnostics."""
@@ -242,9 +179,9 @@ def chat():
     """Render the chat page with specialized agents."""
     # Verificar disponibilidad de APIs
     apis_disponibles = {
-        'openai': openai_client is not None,
-        'anthropic': anthropic_client is not None,
-        'gemini': genai_configured
+        'openai': ai_clients.is_provider_available('openai'),
+        'anthropic': ai_clients.is_provider_available('anthropic'),
+        'gemini': ai_clients.is_provider_available('gemini')
     }
     
     # Al menos una API debe estar disponible para el chat
@@ -376,7 +313,7 @@ def process_code():
 
         if model_choice == 'anthropic' and os.environ.get('ANTHROPIC_API_KEY'):
             # Use Anthropic Claude
-            client = Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
+            client = ai_clients.get_anthropic_client()
             completion = client.messages.create(
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=4000,
@@ -396,7 +333,7 @@ def process_code():
 
         elif model_choice == 'gemini' and os.environ.get('GEMINI_API_KEY'):
             # Use Google Gemini
-            genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+            ai_clients.ensure_gemini_configured()
             model = genai.GenerativeModel('gemini-1.5-pro')
             gemini_response = model.generate_content(prompt)
 
@@ -412,7 +349,7 @@ def process_code():
 
         else:
             # Use OpenAI as the default
-            openai_client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+            openai_client = ai_clients.get_openai_client()
             completion = openai_client.chat.completions.create(
                 model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
                 response_format={"type": "json_object"},
@@ -525,6 +462,7 @@ def process_instructions():
             # Call the API only if no local command is found
             if not terminal_command:
                 try:
+                    openai_client = ai_clients.get_openai_client()
                     if not openai_client:
                         raise Exception("OpenAI API key not configured")
 
@@ -551,6 +489,7 @@ def process_instructions():
                         terminal_command = "echo 'Could not process the instruction'"
 
         elif model_choice == 'anthropic':
+            anthropic_client = ai_clients.get_anthropic_client()
             if not anthropic_client:
                 return jsonify({'error': 'Anthropic API key not configured'}), 500
 
@@ -583,7 +522,7 @@ def process_instructions():
                     return jsonify({'command': terminal_command})
 
                 try:
-                    genai.configure(api_key=gemini_api_key)
+                    ai_clients.ensure_gemini_configured()
                     # Updated to use gemini-1.5-pro which is available
                     model = genai.GenerativeModel('gemini-1.5-pro')
 
@@ -890,9 +829,49 @@ def validate_html():
         logging.error(f"Error validating HTML: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def store_command_history(instruction, command, output, status, model_used):
+    """Store an executed command in the database history."""
+    try:
+        from models import User, Command
+
+        # Verify if the default user exists, create if not
+        default_user = db.session.query(User).filter_by(username="default_user").first()
+
+        # Create default user if not exists
+        if not default_user:
+            default_user = User(
+                username="default_user",
+                email="default@example.com"
+            )
+            default_user.set_password("defaultpassword")
+            db.session.add(default_user)
+            db.session.commit()
+            logging.info("Created default user")
+
+        # Create command history entry
+        cmd = Command(
+            instruction=instruction,
+            generated_command=command,
+            output=output,
+            status=status,
+            model_used=model_used,
+            user_id=default_user.id
+        )
+        db.session.add(cmd)
+        db.session.commit()
+    except Exception as e:
+        logging.error(f"Error storing command in database: {str(e)}")
+        # Continue execution even if database save fails
+
 @app.route('/api/execute_command', methods=['POST'])
 def execute_command():
-    """Execute a terminal command and return the output."""
+    """
+    Execute a terminal command and return the output.
+
+    The command runs as a background job. If it does not finish within
+    COMMAND_WAIT_SECONDS the response is a 202 with the job id; its output can be
+    followed at /api/commands/<job_id> or through the 'command_output' Socket.IO event.
+    """
     try:
         data = request.json
         command = data.get('command', '')
@@ -906,59 +885,35 @@ def execute_command():
         user_id = session.get('user_id', 'default')
         workspace_path = get_user_workspace(user_id)
 
-        # Execute the command in the user's workspace
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            cwd=str(workspace_path),  # Set working directory to user workspace
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        stdout, stderr = process.communicate()
-
-        # Store command in database with error handling
-        try:
-            from models import User, Command
-
-            # Verify if the default user exists, create if not
-            default_user = db.session.query(User).filter_by(username="default_user").first()
-
-            # Create default user if not exists
-            if not default_user:
-                default_user = User(
-                    username="default_user",
-                    email="default@example.com"
-                )
-                default_user.set_password("defaultpassword")
-                db.session.add(default_user)
-                db.session.commit()
-                logging.info("Created default user")
-
-            # Create command history entry
-            cmd = Command(
-                instruction=instruction,
-                generated_command=command,
-                output=stdout + ("\n" + stderr if stderr else ""),
-                status=process.returncode,
-                model_used=model_used,
-                user_id=default_user.id
-            )
-            db.session.add(cmd)
-            db.session.commit()
-        except Exception as e:
-            logging.error(f"Error storing command in database: {str(e)}")
-            # Continue execution even if database save fails
+        def on_finish(job):
+            stdout, stderr = command_runner.collect_output(job['job_id'])
+            with app.app_context():
+                store_command_history(instruction, command, stdout + ("\n" + stderr if stderr else ""),
+                                      job['exit_code'], model_used)
+
+        # Execute the command in the user's workspace. The job is launched without
+        # waiting and polled with socketio.sleep: a real Condition.wait would block the
+        # whole eventlet hub, not just this request
+        job = command_runner.execute(command, workspace_path, timeout=data.get('timeout'),
+                                     wait_seconds=0, on_finish=on_finish)
+        deadline = time.time() + command_runner.get_wait_seconds()
+        while job['status'] not in command_runner.FINISHED_STATUSES and time.time() < deadline:
+            socketio.sleep(0.1)
+            job = command_runner.get_job(job['job_id'])
+        if job['status'] in command_runner.FINISHED_STATUSES:
+            job['stdout'], job['stderr'] = command_runner.collect_output(job['job_id'])
 
         result = {
-            'stdout': stdout,
-            'stderr': stderr,
-            'exitCode': process.returncode,
-            'workspace': str(workspace_path.relative_to(WORKSPACE_ROOT.parent))
+            'stdout': job.get('stdout', ''),
+            'stderr': job.get('stderr', '') or job['error'] or '',
+            'exitCode': job['exit_code'],
+            'usage': job['usage'],
+            'workspace': os.path.relpath(str(workspace_path), os.path.dirname(WORKSPACE_ROOT)),
+            **job_response_fields(job)
         }
 
         logging.debug(f"Command execution result: {result}")
-        return jsonify(result)
+        return jsonify(result), 202 if result['running'] else 200
     except Exception as e:
         logging.error(f"Error executing command: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -993,17 +948,17 @@ def handle_chat():
             return jsonify({'error': 'No message provided'}), 400
             
         # Verificar que el modelo seleccionado esté disponible
-        if model_choice == 'openai' and not openai_client:
+        if model_choice == 'openai' and not ai_clients.is_provider_available('openai'):
             return jsonify({
                 'error': 'OpenAI API no disponible', 
                 'message': 'La API de OpenAI no está configurada correctamente o no está disponible en este momento. Por favor, selecciona otro modelo o verifica la configuración.'
             }), 503
-        elif model_choice == 'anthropic' and not anthropic_client:
+        elif model_choice == 'anthropic' and not ai_clients.is_provider_available('anthropic'):
             return jsonify({
                 'error': 'Anthropic API no disponible', 
                 'message': 'La API de Anthropic no está configurada correctamente o no está disponible en este momento. Por favor, selecciona otro modelo o verifica la configuración.'
             }), 503
-        elif model_choice == 'gemini' and not genai_configured:
+        elif model_choice == 'gemini' and not ai_clients.is_provider_available('gemini'):
             return jsonify({
                 'error': 'Gemini API no disponible', 
                 'message': 'La API de Google Gemini no está configurada correctamente o no está disponible en este momento. Por favor, selecciona otro modelo o verifica la configuración.'
@@ -1204,6 +1159,40 @@ def get_file_type(filename):
     else:
         return 'text'
 
+# Reenviar la salida de los comandos en segundo plano a quien los siga por Socket.IO.
+# Los eventos llegan desde los hilos del sistema que leen las tuberías, donde emitir con
+# eventlet sin monkey_patch no es seguro: se encolan y una tarea del hub los emite
+command_events = deque()
+
+def forward_command_event(event, data):
+    command_events.append(('command_output' if event == 'output' else 'command_status', data))
+
+def drain_command_events():
+    while True:
+        while command_events:
+            name, data = command_events.popleft()
+            socketio.emit(name, data, room=f"command:{data['job_id']}")
+        socketio.sleep(0.05)
+
+command_runner.add_listener(forward_command_event)
+socketio.start_background_task(drain_command_events)
+
+@socketio.on('follow_command')
+def handle_follow_command(data):
+    """Suscribe al cliente a la salida de un comando y le envía la ya producida."""
+    job_id = data.get('job_id', '')
+    # Primero la sala y después la salida ya producida: las líneas repetidas se
+    # distinguen por su número de secuencia, pero ninguna se pierde
+    join_room(f"command:{job_id}")
+    job = command_runner.get_job(job_id, since=data.get('since', 0))
+    if job is None:
+        emit('command_status', {'job_id': job_id, 'status': 'error', 'error': 'Comando no encontrado'})
+        return
+    for line in job.pop('output'):
+        emit('command_output', line)
+    if job['status'] in command_runner.FINISHED_STATUSES:
+        emit('command_status', job)
+
 # Manejar mensajes del usuario a través de Socket.IO
 @socketio.on('user_message')
 def handle_user_message(data):
@@ -1220,24 +1209,28 @@ def handle_user_message(data):
         agent_system_prompt = get_agent_system_prompt(agent_id)
         agent_name = get_agent_name(agent_id)
 
-        # Procesar el mensaje con el modelo seleccionado
-        response_content = generate_content(
-            message,
-            [],  # Sin contexto inicial
-            agent_system_prompt,
-            model,
-            True,  # collaborative_mode
-            "normal"  # chat_mode
-        )
+        agent_info = {
+            'id': agent_id,
+            'name': agent_name,
+            'icon': 'bi-robot'
+        }
 
-        # Enviar respuesta al cliente
+        # Procesar el mensaje con el modelo seleccionado, enviando cada fragmento al cliente
+        chunks = []
+        for delta in generate_content_stream(message, agent_system_prompt, model):
+            chunks.append(delta)
+            emit('assistant_message_chunk', {
+                'delta': delta,
+                'index': len(chunks) - 1,
+                'agent': agent_info
+            })
+            socketio.sleep(0)
+        response_content = ''.join(chunks)
+
+        # Enviar respuesta completa al cliente
         emit('assistant_message', {
             'message': response_content,
-            'agent': {
-                'id': agent_id,
-                'name': agent_name,
-                'icon': 'bi-robot'
-            }
+            'agent': agent_info
         })
     except Exception as e:
         print(f"Error al procesar mensaje: {str(e)}")
@@ -0,0 +1,832 @@
+"""
+Utilidades de archivos comprimidos para Codestorm Assistant.
+Genera archivos ZIP por fragmentos mientras se recorre el árbol de directorios, de modo
+que las descargas empiezan enseguida y la memoria usada no depende del tamaño del archivo,
+crea archivos ZIP, tar.gz y tar.zst comprimiendo en paralelo con todos los núcleos y
+extrae archivos ZIP, tar y RAR por fragmentos con límites de tamaño y de entradas.
+"""
+import io
+import os
+import sys
+import gzip
+import time
+import zlib
+import shutil
+import logging
+import datetime
+import tarfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import rarfile
+except ImportError:
+    rarfile = None
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de lectura de cada archivo y, por tanto, del mayor fragmento emitido
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Modos de compresión de los miembros del ZIP
+COMPRESSION_AUTO = 'auto'
+COMPRESSION_DEFLATED = 'deflated'
+COMPRESSION_STORED = 'stored'
+ZIP_COMPRESSION_MODES = (COMPRESSION_AUTO, COMPRESSION_DEFLATED, COMPRESSION_STORED)
+
+# Formatos ya comprimidos: volver a comprimirlos gasta CPU sin reducir el tamaño
+ALREADY_COMPRESSED_EXTENSIONS = frozenset([
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.war', '.whl', '.apk',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.heic', '.ico',
+    '.mp3', '.mp4', '.m4a', '.aac', '.ogg', '.opus', '.webm', '.mkv', '.mov', '.avi',
+    '.woff', '.woff2', '.pdf', '.docx', '.xlsx', '.pptx', '.epub', '.odt'
+])
+
+
+# Formatos de archivo que se pueden crear
+FORMAT_ZIP = 'zip'
+FORMAT_TAR_GZ = 'tar.gz'
+FORMAT_TAR_ZST = 'tar.zst'
+ARCHIVE_FORMATS = (FORMAT_ZIP, FORMAT_TAR_GZ, FORMAT_TAR_ZST)
+
+# Los miembros del ZIP hasta este tamaño se comprimen en paralelo en memoria; los mayores
+# se comprimen por fragmentos en el hilo que escribe el archivo
+PARALLEL_MEMBER_MAX_SIZE = 32 * 1024 * 1024
+
+# Límite de bytes leídos y pendientes de escribir en el archivo
+MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+
+# Versiones de CPython (inclusive) cuyos detalles internos de zipfile se usan para añadir
+# miembros ya comprimidos; fuera de ellas los miembros se comprimen al escribirlos
+PRECOMPRESSED_ZIP_VERSIONS = ((3, 8), (3, 13))
+
+# Tamaño de los bloques tar que se comprimen como miembros gzip independientes
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+# Límites de extracción (configurables con EXTRACT_MAX_BYTES, EXTRACT_MAX_ENTRIES y
+# EXTRACT_MAX_RATIO): bytes descomprimidos, entradas y relación de compresión por miembro
+DEFAULT_EXTRACT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_EXTRACT_MAX_ENTRIES = 20000
+DEFAULT_EXTRACT_MAX_RATIO = 200
+
+# Los miembros pequeños no se comprueban por relación de compresión
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+# Cada cuántos bytes de un mismo miembro se informa del progreso
+PROGRESS_INTERVAL_BYTES = 16 * 1024 * 1024
+
+# Extensiones de los archivos que se pueden extraer
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar.zst')
+RAR_EXTENSIONS = ('.rar',)
+
+
+class ExtractionError(Exception):
+    """La extracción se ha detenido: archivo no válido, formato no soportado o límite superado."""
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _get_worker_count() -> int:
+    try:
+        return max(1, int(os.environ.get('ARCHIVE_WORKERS', os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def is_already_compressed(path: str) -> bool:
+    """Indica si un archivo tiene un formato que ya está comprimido."""
+    return os.path.splitext(path)[1].lower() in ALREADY_COMPRESSED_EXTENSIONS
+
+
+def _zip_compress_type(path: str, compression: str) -> int:
+    if compression == COMPRESSION_STORED:
+        return zipfile.ZIP_STORED
+    if compression == COMPRESSION_AUTO and is_already_compressed(path):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_archive_members(source_path: str, include_root: bool = True,
+                         exclude: Optional[Set[str]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Recorre un directorio (o un archivo) devolviendo los miembros que tendría su archivo.
+
+    Args:
+        source_path: Directorio o archivo a comprimir
+        include_root: Si es True, los nombres incluyen el directorio raíz
+        exclude: Rutas absolutas que no se incluyen (p. ej. el propio archivo de salida)
+
+    Returns:
+        iterador: (ruta en disco, nombre dentro del archivo); los directorios primero
+        que su contenido
+    """
+    source_path = source_path.rstrip(os.sep) or os.sep
+    if not os.path.isdir(source_path):
+        yield source_path, os.path.basename(source_path)
+        return
+
+    base_path = os.path.dirname(source_path) if include_root else source_path
+    for root, dirs, files in os.walk(source_path):
+        dirs.sort()
+        rel_dir = os.path.relpath(root, base_path)
+        if rel_dir != os.curdir:
+            yield root, rel_dir
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            if exclude and os.path.abspath(file_path) in exclude:
+                continue
+            yield file_path, os.path.relpath(file_path, base_path)
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Destino no posicionable que acumula los bytes del ZIP hasta que se consumen."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_zip(source_path: str, include_root: bool = True, compression: str = COMPRESSION_AUTO,
+               chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Genera un archivo ZIP por fragmentos a medida que se leen los archivos.
+
+    Como la salida no es posicionable, los tamaños y CRC de cada miembro se escriben en un
+    descriptor de datos tras su contenido; la memoria usada se limita a un fragmento.
+
+    Args:
+        source_path: Directorio o archivo a comprimir
+        include_root: Si es True, incluye el directorio raíz en el archivo
+        compression: 'auto' (no recomprime formatos ya comprimidos), 'deflated' o 'stored'
+        chunk_size: Bytes leídos de cada archivo en cada paso
+
+    Returns:
+        iterador de bytes: Contenido del archivo ZIP
+    """
+    if compression not in ZIP_COMPRESSION_MODES:
+        raise ValueError(f"Modo de compresión no válido: {compression}")
+
+    buffer = _ZipStreamBuffer()
+    members = 0
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+        for path, arcname in iter_archive_members(source_path, include_root):
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                if zinfo.is_dir():
+                    zipf.writestr(zinfo, b'')
+                else:
+                    zinfo.compress_type = _zip_compress_type(path, compression)
+                    with open(path, 'rb') as source, zipf.open(zinfo, 'w') as destination:
+                        while True:
+                            chunk = source.read(chunk_size)
+                            if not chunk:
+                                break
+                            destination.write(chunk)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+                members += 1
+            except OSError as e:
+                # Archivo eliminado o ilegible durante el recorrido: se omite
+                logger.warning(f"Se omite {path} del ZIP: {str(e)}")
+                continue
+
+            data = buffer.drain()
+            if data:
+                yield data
+
+    # Directorio central, escrito al cerrar el archivo
+    yield buffer.drain()
+    logger.info(f"ZIP de {source_path} generado con {members} entradas")
+
+
+def _compress_member(path: str, compress_type: int) -> Tuple[int, int, bytes, int]:
+    """
+    Lee y comprime un miembro del ZIP en un hilo del pool (zlib libera el GIL).
+
+    Returns:
+        tuple: (CRC, tamaño original, datos comprimidos, tipo de compresión final)
+    """
+    with open(path, 'rb') as source:
+        data = source.read()
+    crc = zlib.crc32(data)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        if len(payload) < len(data):
+            return crc, len(data), payload, zipfile.ZIP_DEFLATED
+    return crc, len(data), data, zipfile.ZIP_STORED
+
+
+def _read_member(path: str, compress_type: int) -> Tuple[bytes, int]:
+    """Lee un miembro del ZIP en un hilo del pool (sin comprimir)."""
+    with open(path, 'rb') as source:
+        return source.read(), compress_type
+
+
+def _write_compressed_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes):
+    """
+    Escribe en el ZIP un miembro ya comprimido (CRC y tamaños deben estar en zinfo).
+
+    zipfile no tiene una API pública para esto: se usan sus detalles internos, así que
+    solo se llama si _can_write_precompressed() lo ha comprobado en esta versión.
+    """
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(payload)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+_precompressed_supported = None
+
+
+def _can_write_precompressed() -> bool:
+    """
+    Indica si _write_compressed_member produce archivos válidos en este intérprete.
+
+    Exige una versión de CPython conocida y, la primera vez, escribe un ZIP de prueba en
+    memoria y lo verifica con la API pública de zipfile.
+    """
+    global _precompressed_supported
+    if _precompressed_supported is not None:
+        return _precompressed_supported
+    low, high = PRECOMPRESSED_ZIP_VERSIONS
+    supported = sys.implementation.name == 'cpython' and low <= sys.version_info[:2] <= high
+    if supported:
+        try:
+            samples = {'deflated.txt': b'codestorm ' * 1000, 'stored.bin': os.urandom(64)}
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+                for name, data in samples.items():
+                    compress_type = zipfile.ZIP_DEFLATED if name.endswith('.txt') else zipfile.ZIP_STORED
+                    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                    payload = compressor.compress(data) + compressor.flush() \
+                        if compress_type == zipfile.ZIP_DEFLATED else data
+                    zinfo = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+                    zinfo.compress_type = compress_type
+                    zinfo.CRC, zinfo.file_size, zinfo.compress_size = zlib.crc32(data), len(data), len(payload)
+                    _write_compressed_member(zipf, zinfo, payload)
+                zipf.writestr('after.txt', b'ok')
+            with zipfile.ZipFile(io.BytesIO(buffer.getvalue())) as zipf:
+                supported = (zipf.testzip() is None
+                             and all(zipf.read(name) == data for name, data in samples.items())
+                             and zipf.read('after.txt') == b'ok')
+        except Exception as e:
+            logger.warning(f"No se pueden añadir miembros ya comprimidos al ZIP: {str(e)}")
+            supported = False
+    if not supported:
+        logger.info("Los miembros del ZIP se comprimirán al escribirlos (sin compresión en paralelo)")
+    _precompressed_supported = supported
+    return supported
+
+
+def _write_zip(members, output_path: str, compression: str, workers: int) -> int:
+    """
+    Crea un ZIP comprimiendo los miembros en paralelo.
+
+    Los miembros pueden quedar en un orden distinto al del recorrido: los grandes se
+    escriben en cuanto se encuentran y los pequeños cuando su compresión termina. Si
+    _can_write_precompressed() falla, los hilos solo leen los miembros y zipf.writestr
+    los comprime en el hilo que escribe.
+    """
+    precompressed = _can_write_precompressed()
+    pending = deque()
+    in_flight = 0
+    count = 0
+
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archive") as executor:
+
+        def write_next():
+            nonlocal in_flight, count
+            zinfo, future = pending.popleft()
+            in_flight -= zinfo.file_size
+            try:
+                if precompressed:
+                    zinfo.CRC, zinfo.file_size, payload, zinfo.compress_type = future.result()
+                else:
+                    data, zinfo.compress_type = future.result()
+            except OSError as e:
+                logger.warning(f"Se omite {zinfo.filename} del ZIP: {str(e)}")
+                return
+            if precompressed:
+                zinfo.compress_size = len(payload)
+                _write_compressed_member(zipf, zinfo, payload)
+            else:
+                zipf.writestr(zinfo, data)
+            count += 1
+
+        for path, arcname in members:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                if zinfo.is_dir():
+                    zipf.writestr(zinfo, b'')
+                    count += 1
+                    continue
+                compress_type = _zip_compress_type(path, compression)
+                if zinfo.file_size > PARALLEL_MEMBER_MAX_SIZE:
+                    zinfo.compress_type = compress_type
+                    with open(path, 'rb') as source, zipf.open(zinfo, 'w') as destination:
+                        shutil.copyfileobj(source, destination, STREAM_CHUNK_SIZE)
+                    count += 1
+                    continue
+            except OSError as e:
+                logger.warning(f"Se omite {path} del ZIP: {str(e)}")
+                continue
+
+            task = _compress_member if precompressed else _read_member
+            pending.append((zinfo, executor.submit(task, path, compress_type)))
+            in_flight += zinfo.file_size
+            while pending and (in_flight > MAX_IN_FLIGHT_BYTES or pending[0][1].done()):
+                write_next()
+
+        while pending:
+            write_next()
+    return count
+
+
+class _ParallelGzipWriter(io.RawIOBase):
+    """
+    Comprime un flujo en bloques independientes en paralelo y los escribe como miembros
+    gzip concatenados, que gzip, tar y Python leen como un único flujo.
+    """
+
+    def __init__(self, fileobj, executor, workers: int):
+        super().__init__()
+        self._fileobj = fileobj
+        self._executor = executor
+        self._max_pending = workers * 2
+        self._buffer = bytearray()
+        self._pending = deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= GZIP_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:GZIP_BLOCK_SIZE]))
+            del self._buffer[:GZIP_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self._pending.append(self._executor.submit(gzip.compress, block, GZIP_LEVEL, mtime=0))
+        while self._pending and (len(self._pending) > self._max_pending or self._pending[0].done()):
+            self._fileobj.write(self._pending.popleft().result())
+
+    def finish(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+
+def _write_tar(members, output_path: str, archive_format: str, workers: int) -> int:
+    """Crea un tar.gz (gzip por bloques en paralelo) o tar.zst (zstd multihilo)."""
+    count = 0
+
+    def add_members(tar):
+        nonlocal count
+        for path, arcname in members:
+            try:
+                tar.add(path, arcname, recursive=False)
+                count += 1
+            except OSError as e:
+                logger.warning(f"Se omite {path} del archivo: {str(e)}")
+
+    with open(output_path, 'wb') as output:
+        if archive_format == FORMAT_TAR_ZST:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=workers if workers > 1 else 0)
+            with compressor.stream_writer(output, closefd=False) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    add_members(tar)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archive") as executor:
+                writer = _ParallelGzipWriter(output, executor, workers)
+                with tarfile.open(fileobj=writer, mode='w|') as tar:
+                    add_members(tar)
+                writer.finish()
+    return count
+
+
+def create_archive(source_path: str, output_path: str, include_root: bool = True,
+                   archive_format: str = FORMAT_ZIP, compression: str = COMPRESSION_AUTO,
+                   workers: Optional[int] = None) -> Dict:
+    """
+    Crea un archivo comprimido de un directorio o archivo usando varios núcleos.
+
+    El archivo se escribe con un nombre temporal y se renombra al terminar, de modo que
+    nunca queda a medias en la ruta de salida.
+
+    Args:
+        source_path: Directorio o archivo a comprimir
+        output_path: Ruta del archivo a crear
+        include_root: Si es True, incluye el directorio raíz en el archivo
+        archive_format: 'zip', 'tar.gz' o 'tar.zst'
+        compression: Para ZIP, 'auto' (no recomprime formatos ya comprimidos),
+            'deflated' o 'stored'
+        workers: Hilos de compresión (por defecto ARCHIVE_WORKERS o el número de núcleos)
+
+    Returns:
+        dict: Estadísticas ('format', 'members', 'output_size', 'seconds')
+
+    Raises:
+        ValueError: Si el formato o el modo de compresión no son válidos o no están disponibles
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Formato de archivo no válido: {archive_format}")
+    if compression not in ZIP_COMPRESSION_MODES:
+        raise ValueError(f"Modo de compresión no válido: {compression}")
+    if archive_format == FORMAT_TAR_ZST and zstandard is None:
+        raise ValueError("El formato tar.zst requiere el paquete zstandard")
+
+    workers = workers or _get_worker_count()
+    start = time.time()
+    temp_path = f"{output_path}.{os.getpid()}.partial"
+    exclude = {os.path.abspath(output_path), os.path.abspath(temp_path)}
+    members = iter_archive_members(source_path, include_root, exclude)
+    try:
+        if archive_format == FORMAT_ZIP:
+            count = _write_zip(members, temp_path, compression, workers)
+        else:
+            count = _write_tar(members, temp_path, archive_format, workers)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    stats = {
+        'format': archive_format,
+        'members': count,
+        'output_size': os.path.getsize(output_path),
+        'seconds': round(time.time() - start, 3)
+    }
+    logger.info(f"Archivo {output_path} creado con {workers} hilos: {stats}")
+    return stats
+
+
+def archive_kind(path: str) -> Optional[str]:
+    """Devuelve 'zip', 'tar' o 'rar' según la extensión del archivo, o None si no se puede extraer."""
+    name = path.lower()
+    if name.endswith(ZIP_EXTENSIONS):
+        return 'zip'
+    if name.endswith(TAR_EXTENSIONS):
+        return 'tar'
+    if name.endswith(RAR_EXTENSIONS):
+        return 'rar'
+    return None
+
+
+def safe_member_path(extract_root: str, name: str) -> Optional[str]:
+    """
+    Calcula la ruta de destino de un miembro sin permitir que salga del directorio.
+
+    Se normalizan las barras invertidas, se quitan las barras iniciales y las letras de
+    unidad, y se rechazan los nombres con '..' o que resuelven (por enlaces simbólicos ya
+    existentes) fuera del directorio de extracción.
+
+    Returns:
+        str o None: Ruta absoluta de destino, o None si el nombre no es seguro
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if parts and len(parts[0]) == 2 and parts[0][1] == ':':
+        parts = parts[1:]
+    if not parts or any(part == '..' or '\0' in part for part in parts):
+        return None
+    target = os.path.join(extract_root, *parts)
+    real_root = os.path.realpath(extract_root)
+    real_parent = os.path.realpath(os.path.dirname(target))
+    if real_parent != real_root and not real_parent.startswith(real_root + os.sep):
+        return None
+    return target
+
+
+class _ExtractionBudget:
+    """Cuenta los bytes y entradas extraídos, aplica los límites e informa del progreso."""
+
+    def __init__(self, max_bytes: int, max_entries: int, entries_total: Optional[int],
+                 bytes_total: Optional[int], progress_callback: Optional[Callable[[Dict], None]]):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries_total = entries_total
+        self.bytes_total = bytes_total
+        self.entries_done = 0
+        self.bytes_done = 0
+        self.cancelled = threading.Event()
+        self._progress_callback = progress_callback
+        self._lock = threading.Lock()
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.bytes_done += count
+            exceeded = self.bytes_done > self.max_bytes
+        if exceeded:
+            self.cancelled.set()
+            raise ExtractionError(f"El contenido descomprimido supera el límite de {self.max_bytes} bytes")
+        if self.cancelled.is_set():
+            raise ExtractionError("Extracción cancelada")
+
+    def add_entry(self, name: str):
+        with self._lock:
+            self.entries_done += 1
+            exceeded = self.entries_done > self.max_entries
+        if exceeded:
+            self.cancelled.set()
+            raise ExtractionError(f"El archivo supera el límite de {self.max_entries} entradas")
+        self.report(name)
+
+    def report(self, current: str):
+        if self._progress_callback is None:
+            return
+        with self._lock:
+            progress = {
+                'entries_done': self.entries_done,
+                'entries_total': self.entries_total,
+                'bytes_done': self.bytes_done,
+                'bytes_total': self.bytes_total,
+                'current': current
+            }
+        try:
+            self._progress_callback(progress)
+        except Exception as e:
+            logger.warning(f"Error al informar del progreso de extracción: {str(e)}")
+
+
+class _CreatedPaths:
+    """Registro de los archivos y directorios creados, para deshacer una extracción fallida."""
+
+    def __init__(self, extract_root: str):
+        self.extract_root = extract_root
+        self.files = []
+        self.directories = []
+        self._lock = threading.Lock()
+
+    def make_dirs(self, path: str):
+        missing = []
+        current = path
+        while current != self.extract_root and not os.path.isdir(current):
+            missing.append(current)
+            current = os.path.dirname(current)
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self.directories.extend(reversed(missing))
+
+    def add_file(self, path: str):
+        with self._lock:
+            self.files.append(path)
+
+    def rollback(self):
+        for path in self.files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for path in sorted(self.directories, key=len, reverse=True):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+
+def _copy_member(source, target: str, budget: _ExtractionBudget, created: _CreatedPaths, name: str):
+    """Copia un miembro por fragmentos a su destino, contando los bytes en el presupuesto."""
+    created.make_dirs(os.path.dirname(target))
+    existed = os.path.exists(target)
+    with open(target, 'wb') as destination:
+        if not existed:
+            created.add_file(target)
+        since_report = 0
+        while True:
+            chunk = source.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            budget.add_bytes(len(chunk))
+            destination.write(chunk)
+            since_report += len(chunk)
+            if since_report >= PROGRESS_INTERVAL_BYTES:
+                since_report = 0
+                budget.report(name)
+
+
+def _listing_entry(name: str, size: int, date_time, is_dir: bool) -> Dict:
+    try:
+        date_str = datetime.datetime(*date_time[:6]).strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        date_str = None
+    return {'name': name, 'size': size, 'date': date_str, 'is_dir': is_dir}
+
+
+def _check_declared(infos, max_bytes: int, max_entries: int, max_ratio: int):
+    """Rechaza antes de extraer los archivos cuyo índice ya supera los límites."""
+    if len(infos) > max_entries:
+        raise ExtractionError(f"El archivo tiene {len(infos)} entradas (límite: {max_entries})")
+    total = sum(info.file_size for info in infos)
+    if total > max_bytes:
+        raise ExtractionError(f"El contenido descomprimido ocupa {total} bytes (límite: {max_bytes})")
+    for info in infos:
+        compressed = getattr(info, 'compress_size', 0) or 0
+        if info.file_size > RATIO_CHECK_MIN_SIZE and info.file_size > compressed * max_ratio:
+            raise ExtractionError(f"Relación de compresión sospechosa en {info.filename}: "
+                                  "posible bomba de descompresión")
+    return total
+
+
+def _extract_indexed(archive, infos, extract_root: str, budget: _ExtractionBudget,
+                     created: _CreatedPaths, workers: int, listing: List[Dict], skipped: List[str]):
+    """Extrae un ZIP o RAR (índice disponible al principio), con los miembros en paralelo."""
+    members = []
+    for info in infos:
+        is_dir = info.is_dir()
+        target = safe_member_path(extract_root, info.filename)
+        if target is None:
+            skipped.append(info.filename)
+            continue
+        listing.append(_listing_entry(info.filename, info.file_size, info.date_time, is_dir))
+        if is_dir:
+            created.make_dirs(target)
+            budget.add_entry(info.filename)
+        else:
+            members.append((info, target))
+
+    def extract_one(info, target):
+        if budget.cancelled.is_set():
+            raise ExtractionError("Extracción cancelada")
+        with archive.open(info) as source:
+            _copy_member(source, target, budget, created, info.filename)
+        budget.add_entry(info.filename)
+
+    if workers <= 1 or len(members) <= 1:
+        for info, target in members:
+            extract_one(info, target)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+        futures = [executor.submit(extract_one, info, target) for info, target in members]
+        error = None
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                budget.cancelled.set()
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def _open_tar_stream(file_path: str, raw_file):
+    if file_path.lower().endswith('.tar.zst'):
+        if zstandard is None:
+            raise ExtractionError("Los archivos tar.zst requieren el paquete zstandard")
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(raw_file), mode='r|')
+    return tarfile.open(fileobj=raw_file, mode='r|*')
+
+
+def _extract_tar(file_path: str, extract_root: str, budget: _ExtractionBudget, created: _CreatedPaths,
+                 listing: List[Dict], skipped: List[str]):
+    """Extrae un tar (comprimido o no) en una sola pasada sobre el flujo."""
+    with open(file_path, 'rb') as raw_file, _open_tar_stream(file_path, raw_file) as tar:
+        for member in tar:
+            target = safe_member_path(extract_root, member.name)
+            if target is None or not (member.isdir() or member.isfile()):
+                # Nombres inseguros, enlaces y dispositivos no se extraen
+                skipped.append(member.name)
+                continue
+            date_time = time.localtime(member.mtime)
+            listing.append(_listing_entry(member.name, member.size, date_time, member.isdir()))
+            if member.isdir():
+                created.make_dirs(target)
+            else:
+                _copy_member(tar.extractfile(member), target, budget, created, member.name)
+            budget.add_entry(member.name)
+
+
+def extract_archive(file_path: str, extract_dir: str,
+                    progress_callback: Optional[Callable[[Dict], None]] = None,
+                    workers: Optional[int] = None, max_bytes: Optional[int] = None,
+                    max_entries: Optional[int] = None) -> Dict:
+    """
+    Extrae un archivo ZIP, tar (.tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst) o RAR por fragmentos.
+
+    El tamaño descomprimido y el número de entradas están limitados; se comprueban primero
+    con el índice del archivo (ZIP y RAR) y después con los bytes realmente escritos. Si se
+    supera un límite o falla la extracción, se eliminan los archivos y directorios creados.
+
+    Args:
+        file_path: Ruta al archivo comprimido
+        extract_dir: Directorio donde extraer el contenido
+        progress_callback: Función que recibe el progreso ('entries_done', 'entries_total',
+            'bytes_done', 'bytes_total', 'current')
+        workers: Hilos para descomprimir miembros de ZIP en paralelo (por defecto ARCHIVE_WORKERS)
+        max_bytes: Límite de bytes descomprimidos (por defecto EXTRACT_MAX_BYTES)
+        max_entries: Límite de entradas (por defecto EXTRACT_MAX_ENTRIES)
+
+    Returns:
+        dict: 'files' (listado de entradas), 'skipped' (entradas no extraídas por seguridad),
+        'entries' y 'bytes'
+
+    Raises:
+        ExtractionError: Si el formato no se admite, el archivo no es válido o se supera un límite
+    """
+    kind = archive_kind(file_path)
+    if kind is None:
+        raise ExtractionError(f"Formato de archivo no soportado: {os.path.basename(file_path)}. "
+                              "Se admiten .zip, .tar (.gz, .bz2, .xz, .zst) y .rar")
+
+    max_bytes = max_bytes or _env_int('EXTRACT_MAX_BYTES', DEFAULT_EXTRACT_MAX_BYTES)
+    max_entries = max_entries or _env_int('EXTRACT_MAX_ENTRIES', DEFAULT_EXTRACT_MAX_ENTRIES)
+    max_ratio = _env_int('EXTRACT_MAX_RATIO', DEFAULT_EXTRACT_MAX_RATIO)
+    workers = workers or _get_worker_count()
+
+    extract_root = os.path.abspath(extract_dir)
+    created = _CreatedPaths(extract_root)
+    if not os.path.isdir(extract_root):
+        created.make_dirs(extract_root)
+        created.directories.append(extract_root)
+    listing = []
+    skipped = []
+    start = time.time()
+
+    try:
+        if kind == 'tar':
+            budget = _ExtractionBudget(max_bytes, max_entries, None, None, progress_callback)
+            _extract_tar(file_path, extract_root, budget, created, listing, skipped)
+        else:
+            if kind == 'zip':
+                archive = zipfile.ZipFile(file_path, 'r')
+            elif rarfile is None:
+                raise ExtractionError("Los archivos RAR requieren el paquete rarfile")
+            else:
+                archive = rarfile.RarFile(file_path, 'r')
+            with archive:
+                infos = archive.infolist()
+                bytes_total = _check_declared(infos, max_bytes, max_entries, max_ratio)
+                budget = _ExtractionBudget(max_bytes, max_entries, len(infos), bytes_total, progress_callback)
+                # Los RAR se extraen de uno en uno: cada miembro lanza un proceso de unrar
+                _extract_indexed(archive, infos, extract_root, budget, created,
+                                 workers if kind == 'zip' else 1, listing, skipped)
+    except ExtractionError:
+        created.rollback()
+        raise
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as e:
+        created.rollback()
+        raise ExtractionError(f"El archivo no es válido o está corrupto: {str(e)}")
+    except Exception as e:
+        created.rollback()
+        if rarfile is not None and isinstance(e, rarfile.Error):
+            raise ExtractionError(f"No se pudo extraer el archivo RAR: {str(e)}")
+        raise
+
+    if skipped:
+        logger.warning(f"Entradas no extraídas de {file_path} por seguridad: {skipped[:20]}")
+    logger.info(f"Archivo {file_path} extraído en {extract_root}: {budget.entries_done} entradas, "
+                f"{budget.bytes_done} bytes en {time.time() - start:.1f}s")
+    return {
+        'files': listing,
+        'skipped': skipped,
+        'entries': budget.entries_done,
+        'bytes': budget.bytes_done
+    }
+
+
+def attachment_headers(filename: str) -> dict:
+    """Cabeceras para descargar una respuesta como archivo adjunto con ese nombre."""
+    ascii_name = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return {
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+    }
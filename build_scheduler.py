@@ -0,0 +1,500 @@
+"""
+Planificador de construcciones del Constructor de Tareas para Codestorm Assistant.
+Las construcciones no se lanzan en un hilo propio por petición: se encolan en una cola
+persistente (un archivo JSON por trabajo) y un pool acotado de hilos las ejecuta por
+prioridad, respetando un máximo de construcciones simultáneas por usuario. Los
+trabajos pendientes o interrumpidos se recuperan al reiniciar el proceso.
+
+Si varios procesos comparten la cola (trabajadores de gunicorn, el recargador de
+Werkzeug), cada trabajo se reclama con un flock exclusivo sobre su archivo .lock antes
+de ejecutarlo, de modo que solo un proceso lo ejecuta.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from job_registry import JobRegistry, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_ERROR, JOB_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = (JOB_DONE, JOB_ERROR, JOB_CANCELLED)
+
+# Prioridades admitidas: las más altas se ejecutan antes; a igual prioridad, por orden de llegada
+MIN_PRIORITY = 0
+MAX_PRIORITY = 10
+DEFAULT_PRIORITY = 5
+
+# Reintentos de un trabajo interrumpido por un reinicio antes de darlo por fallido
+MAX_ATTEMPTS = 3
+
+# Esperas recientes en cola usadas para las métricas
+WAIT_SAMPLES = 500
+
+
+class BuildQueueFullError(Exception):
+    """La cola de construcciones (global o del usuario) no admite más trabajos."""
+
+
+_registry = JobRegistry()
+_jobs = _registry.jobs
+_jobs_changed = _registry.changed
+# Construcciones en curso y no pausadas por usuario: son las que ocupan plaza en el pool
+_running_by_user = {}
+# Construcciones pausadas: conservan su hilo, pero no cuentan para los límites
+_paused = set()
+_runner = None
+_workers = []
+# Trabajos reclamados por este proceso: job_id -> descriptor de su archivo .lock bloqueado
+_claims = {}
+_wait_times = deque(maxlen=WAIT_SAMPLES)
+_stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+_sequence = 0
+
+
+def _env_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def get_worker_count() -> int:
+    return _env_int('CONSTRUCTOR_BUILD_WORKERS', 2, minimum=1)
+
+
+def get_max_per_user() -> int:
+    return _env_int('CONSTRUCTOR_BUILD_MAX_PER_USER', 1, minimum=1)
+
+
+def get_max_queued() -> int:
+    return _env_int('CONSTRUCTOR_BUILD_MAX_QUEUED', 100, minimum=1)
+
+
+def get_max_queued_per_user() -> int:
+    return _env_int('CONSTRUCTOR_BUILD_MAX_QUEUED_PER_USER', 10, minimum=1)
+
+
+def _get_queue_dir() -> str:
+    return os.environ.get('CONSTRUCTOR_BUILD_QUEUE_DIR', os.path.join('user_workspaces', '.build_queue'))
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(_get_queue_dir(), f"{job_id}.json")
+
+
+def _lock_path(job_id: str) -> str:
+    return os.path.join(_get_queue_dir(), f"{job_id}.lock")
+
+
+def _claim(job_id: str) -> bool:
+    """
+    Reclama un trabajo para este proceso bloqueando su archivo .lock.
+
+    El bloqueo se mantiene mientras el trabajo se ejecuta y el sistema lo libera si el
+    proceso muere, así que un trabajo reclamable no lo está ejecutando ningún otro proceso.
+
+    Returns:
+        bool: False si otro proceso tiene el trabajo reclamado
+    """
+    if fcntl is None:
+        return True
+    try:
+        os.makedirs(_get_queue_dir(), exist_ok=True)
+        fd = os.open(_lock_path(job_id), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError as e:
+        logger.warning(f"No se pudo reclamar el trabajo de construcción {job_id}: {str(e)}")
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _claims[job_id] = fd
+    return True
+
+
+def _release_claim(job_id: str, remove: bool = False):
+    """Libera el bloqueo de un trabajo (y borra su archivo .lock si ya ha terminado)."""
+    fd = _claims.pop(job_id, None)
+    if fd is None:
+        return
+    if remove:
+        try:
+            os.remove(_lock_path(job_id))
+        except OSError:
+            pass
+    os.close(fd)
+
+
+def _persist(job: Dict):
+    """Guarda el trabajo en la cola persistente (escritura atómica)."""
+    path = _job_path(job['job_id'])
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(_get_queue_dir(), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(job, file)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.error(f"No se pudo guardar el trabajo de construcción {job['job_id']}: {str(e)}")
+
+
+def _forget(job_id: str):
+    try:
+        os.remove(_job_path(job_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"No se pudo eliminar el trabajo de construcción {job_id}: {str(e)}")
+
+
+def _queued_jobs() -> List[Dict]:
+    """Trabajos en cola en el orden en que se ejecutarían (sin tener en cuenta los límites)."""
+    queued = [job for job in _jobs.values() if job['status'] == JOB_QUEUED]
+    queued.sort(key=lambda job: (-job['priority'], job['sequence']))
+    return queued
+
+
+def _next_job() -> Optional[Dict]:
+    """Primer trabajo en cola cuyo usuario no ha alcanzado su límite de construcciones."""
+    if sum(_running_by_user.values()) >= get_worker_count():
+        return None
+    max_per_user = get_max_per_user()
+    for job in _queued_jobs():
+        if _running_by_user.get(job['user_id'], 0) < max_per_user:
+            return job
+    return None
+
+
+def _finish(job: Dict, status: str, error: Optional[str] = None):
+    job['status'] = status
+    job['error'] = error
+    job['finished_at'] = time.time()
+    key = {JOB_DONE: 'completed', JOB_ERROR: 'failed', JOB_CANCELLED: 'cancelled'}[status]
+    _stats[key] += 1
+    _forget(job['job_id'])
+
+
+def _surplus_worker() -> bool:
+    """Indica si sobran hilos: hay uno por plaza del pool más uno por construcción pausada."""
+    return len(_workers) > get_worker_count() + len(_paused)
+
+
+def _spawn_worker():
+    worker = threading.Thread(target=_worker_loop, name=f"build-worker-{len(_workers)}", daemon=True)
+    _workers.append(worker)
+    worker.start()
+
+
+def _worker_loop():
+    while True:
+        with _jobs_changed:
+            job = None
+            while job is None:
+                if _surplus_worker():
+                    # Se reanudó una construcción pausada: el hilo extra ya no hace falta
+                    _workers.remove(threading.current_thread())
+                    return
+                job = _next_job()
+                if job is None:
+                    _jobs_changed.wait()
+                elif not _claim(job['job_id']) or not os.path.exists(_job_path(job['job_id'])):
+                    # Otro proceso lo está ejecutando o ya lo terminó (lo recuperó de la cola)
+                    logger.info(f"Construcción {job['job_id']} atendida por otro proceso; se descarta")
+                    _release_claim(job['job_id'], remove=True)
+                    _jobs.pop(job['job_id'], None)
+                    job = None
+            now = time.time()
+            job['status'] = JOB_RUNNING
+            job['started_at'] = now
+            job['attempts'] += 1
+            _wait_times.append(now - job['queued_at'])
+            _running_by_user[job['user_id']] = _running_by_user.get(job['user_id'], 0) + 1
+            _persist(job)
+            payload = dict(job)
+
+        logger.info(f"Iniciando construcción {payload['job_id']} del usuario {payload['user_id']} "
+                     f"(esperó {payload['started_at'] - payload['queued_at']:.1f}s en cola)")
+        try:
+            _runner(payload)
+            status, error = JOB_DONE, None
+        except Exception as e:
+            logger.error(f"Error en la construcción {payload['job_id']}: {str(e)}")
+            status, error = JOB_ERROR, str(e)
+
+        with _jobs_changed:
+            if job['job_id'] in _paused:
+                _paused.discard(job['job_id'])
+            else:
+                _release_slot(job['user_id'])
+            job['paused'] = False
+            _finish(job, status, error)
+            _release_claim(job['job_id'], remove=True)
+            _jobs_changed.notify_all()
+
+
+def _release_slot(user_id: str):
+    remaining = _running_by_user.get(user_id, 1) - 1
+    if remaining > 0:
+        _running_by_user[user_id] = remaining
+    else:
+        _running_by_user.pop(user_id, None)
+
+
+def suspend(job_id: str) -> bool:
+    """
+    Libera la plaza de una construcción en curso que se ha pausado.
+
+    El hilo de la construcción sigue bloqueado esperando a que se reanude, así que se
+    lanza otro hilo para que el resto de la cola siga avanzando.
+
+    Returns:
+        bool: True si la construcción estaba en curso y no estaba ya pausada
+    """
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None or job['status'] != JOB_RUNNING or job_id in _paused:
+            return False
+        _paused.add(job_id)
+        job['paused'] = True
+        _release_slot(job['user_id'])
+        if _runner is not None and len(_workers) < get_worker_count() + len(_paused):
+            _spawn_worker()
+        _jobs_changed.notify_all()
+    return True
+
+
+def resume(job_id: str) -> bool:
+    """
+    Vuelve a contar una construcción reanudada en el pool y en el límite de su usuario.
+
+    Se reanuda aunque el pool esté lleno: el exceso se absorbe no lanzando nuevas
+    construcciones hasta que haya plaza.
+
+    Returns:
+        bool: True si la construcción estaba pausada
+    """
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None or job_id not in _paused:
+            return False
+        _paused.discard(job_id)
+        job['paused'] = False
+        _running_by_user[job['user_id']] = _running_by_user.get(job['user_id'], 0) + 1
+        _jobs_changed.notify_all()
+    return True
+
+
+def _recover_jobs():
+    """Vuelve a encolar los trabajos guardados que no llegaron a terminar."""
+    global _sequence
+    try:
+        names = sorted(os.listdir(_get_queue_dir()))
+    except FileNotFoundError:
+        return
+    recovered = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(_get_queue_dir(), name), 'r', encoding='utf-8') as file:
+                recovered.append(json.load(file))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Trabajo de construcción ilegible en la cola: {name}: {str(e)}")
+
+    count = 0
+    for job in sorted(recovered, key=lambda job: job.get('sequence', 0)):
+        _sequence = max(_sequence, job.get('sequence', 0))
+        if not _claim(job['job_id']):
+            # Lo está ejecutando otro proceso que sigue vivo
+            continue
+        if job['status'] == JOB_RUNNING and job['attempts'] >= MAX_ATTEMPTS:
+            logger.error(f"Construcción {job['job_id']} descartada tras {job['attempts']} intentos interrumpidos")
+            _finish(job, JOB_ERROR, "La construcción se interrumpió demasiadas veces")
+        else:
+            # Un trabajo 'running' se interrumpió con el proceso: vuelve a la cola con su prioridad
+            job['status'] = JOB_QUEUED
+            job['started_at'] = None
+            job['paused'] = False
+            _persist(job)
+        # El trabajo se volverá a reclamar al ejecutarlo
+        _release_claim(job['job_id'], remove=job['status'] in FINISHED_STATUSES)
+        _jobs[job['job_id']] = job
+        count += 1
+    if count:
+        logger.info(f"Recuperados {count} trabajos de construcción de la cola persistente")
+
+
+def start(runner: Callable[[Dict], None]):
+    """
+    Arranca el pool de constructores y recupera la cola persistente.
+
+    Args:
+        runner: Función que ejecuta una construcción de forma bloqueante; recibe una copia
+                del trabajo (job_id, user_id, description, config, ...)
+    """
+    global _runner
+    with _jobs_changed:
+        _runner = runner
+        if _workers:
+            return
+        _recover_jobs()
+        for _ in range(get_worker_count()):
+            _spawn_worker()
+        _jobs_changed.notify_all()
+    logger.info(f"Planificador de construcciones iniciado con {len(_workers)} trabajadores")
+
+
+def submit(job_id: str, user_id: str, description: str, config: Dict,
+           priority: int = DEFAULT_PRIORITY) -> Dict:
+    """
+    Encola una construcción.
+
+    Args:
+        job_id: Identificador del trabajo (el project_id del proyecto a construir)
+        user_id: Usuario propietario, para el límite de construcciones por usuario
+        description: Descripción del proyecto
+        config: Configuración de la construcción
+        priority: Prioridad entre MIN_PRIORITY y MAX_PRIORITY (mayor se ejecuta antes)
+
+    Returns:
+        dict: Estado del trabajo (ver get_job)
+
+    Raises:
+        BuildQueueFullError: Si la cola global o la del usuario está llena
+    """
+    global _sequence
+    priority = min(max(int(priority), MIN_PRIORITY), MAX_PRIORITY)
+    now = time.time()
+    with _jobs_changed:
+        _registry.prune(now)
+        queued = _queued_jobs()
+        if len(queued) >= get_max_queued():
+            _stats['rejected'] += 1
+            raise BuildQueueFullError("La cola de construcciones está llena; inténtalo de nuevo más tarde")
+        if sum(1 for job in queued if job['user_id'] == user_id) >= get_max_queued_per_user():
+            _stats['rejected'] += 1
+            raise BuildQueueFullError("Tienes demasiadas construcciones en cola")
+
+        _sequence += 1
+        job = {
+            'job_id': job_id,
+            'user_id': user_id,
+            'description': description,
+            'config': config,
+            'priority': priority,
+            'sequence': _sequence,
+            'status': JOB_QUEUED,
+            'paused': False,
+            'attempts': 0,
+            'error': None,
+            'queued_at': now,
+            'started_at': None,
+            'finished_at': None
+        }
+        _persist(job)
+        _jobs[job_id] = job
+        _stats['submitted'] += 1
+        _jobs_changed.notify()
+    return get_job(job_id)
+
+
+def _describe(job: Dict, queued: List[Dict]) -> Dict:
+    now = time.time()
+    info = {key: job[key] for key in (
+        'job_id', 'user_id', 'priority', 'status', 'attempts', 'error',
+        'queued_at', 'started_at', 'finished_at')}
+    info['paused'] = job.get('paused', False)
+    info['position'] = next(
+        (index + 1 for index, other in enumerate(queued) if other['job_id'] == job['job_id']), None)
+    info['wait_seconds'] = round((job['started_at'] or now) - job['queued_at'], 3)
+    return info
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """
+    Devuelve el estado de un trabajo de construcción.
+
+    Returns:
+        dict o None: Estado del trabajo (incluye su posición si está en cola), o None si no existe
+    """
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return _describe(job, _queued_jobs())
+
+
+def list_jobs(user_id: Optional[str] = None) -> List[Dict]:
+    """Trabajos en cola y en curso (de un usuario, si se indica), en orden de ejecución."""
+    with _jobs_changed:
+        queued = _queued_jobs()
+        running = [job for job in _jobs.values() if job['status'] == JOB_RUNNING]
+        return [
+            _describe(job, queued) for job in running + queued
+            if user_id is None or job['user_id'] == user_id
+        ]
+
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancela un trabajo que aún está en cola.
+
+    Returns:
+        bool: True si se canceló; False si no existe o ya ha empezado
+    """
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None or job['status'] != JOB_QUEUED:
+            return False
+        _finish(job, JOB_CANCELLED)
+        return True
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def get_metrics() -> Dict:
+    """
+    Métricas del planificador: profundidad de la cola, ocupación y tiempos de espera.
+
+    Returns:
+        dict: Métricas actuales (los tiempos en segundos)
+    """
+    now = time.time()
+    with _jobs_changed:
+        queued = _queued_jobs()
+        waits = sorted(_wait_times)
+        by_priority = {}
+        for job in queued:
+            by_priority[job['priority']] = by_priority.get(job['priority'], 0) + 1
+        return {
+            'workers': len(_workers),
+            'running': sum(_running_by_user.values()),
+            'paused': len(_paused),
+            'queue_depth': len(queued),
+            'queue_depth_by_priority': by_priority,
+            'max_queued': get_max_queued(),
+            'max_per_user': get_max_per_user(),
+            'running_by_user': dict(_running_by_user),
+            'oldest_wait_seconds': round(max((now - job['queued_at'] for job in queued), default=0.0), 3),
+            'wait_seconds': {
+                'samples': len(waits),
+                'avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'p50': round(_percentile(waits, 0.5), 3) if waits else 0.0,
+                'p95': round(_percentile(waits, 0.95), 3) if waits else 0.0,
+                'max': round(waits[-1], 3) if waits else 0.0
+            },
+            **_stats
+        }
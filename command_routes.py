@@ -0,0 +1,172 @@
+"""
+Rutas API para los comandos en segundo plano de Codestorm Assistant.
+Permiten lanzar comandos en el workspace del usuario, seguir su salida en directo
+(Server-Sent Events) y cancelarlos.
+"""
+
+import json
+import logging
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+import command_runner
+
+logger = logging.getLogger(__name__)
+
+# Crear el blueprint para las rutas de comandos
+command_bp = Blueprint('commands', __name__)
+
+# Función que devuelve el workspace de un usuario; la fija register_command_routes
+_get_workspace = None
+
+
+def job_response_fields(job):
+    """Campos comunes para responder con un comando que sigue en ejecución."""
+    return {
+        'job_id': job['job_id'],
+        'job_status': job['status'],
+        'running': job['status'] not in command_runner.FINISHED_STATUSES,
+        'stream_url': f"/api/commands/{job['job_id']}/stream"
+    }
+
+
+@command_bp.route('/api/commands', methods=['POST'])
+def start_command():
+    """
+    Lanza un comando en segundo plano en el workspace del usuario.
+
+    Espera:
+    - command: Comando a ejecutar
+    - user_id: ID del usuario (predeterminado: 'default')
+    - timeout: (Opcional) Tiempo máximo de ejecución en segundos
+
+    Retorna:
+    - El trabajo creado (job_id) y la URL para seguir su salida
+    """
+    try:
+        data = request.json or {}
+        command = data.get('command')
+        user_id = data.get('user_id', 'default')
+
+        if not command:
+            return jsonify({
+                'success': False,
+                'error': 'Se requiere un comando'
+            }), 400
+
+        workspace = _get_workspace(user_id)
+        logger.info(f"Lanzando comando en segundo plano: '{command}' en workspace '{user_id}'")
+        job = command_runner.submit(command, workspace, timeout=data.get('timeout'))
+        return jsonify({
+            'success': True,
+            'command': command,
+            **job_response_fields(job)
+        }), 202
+    except Exception as e:
+        logger.error(f"Error al lanzar comando: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@command_bp.route('/api/commands', methods=['GET'])
+def list_commands():
+    """
+    Lista los comandos recientes del workspace de un usuario.
+
+    Parámetros de consulta:
+    - user_id: ID del usuario (predeterminado: 'default')
+    """
+    try:
+        import os
+        workspace = _get_workspace(request.args.get('user_id', 'default'))
+        jobs = command_runner.list_jobs(os.path.abspath(str(workspace)))
+        return jsonify({'success': True, 'jobs': jobs})
+    except Exception as e:
+        logger.error(f"Error al listar comandos: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@command_bp.route('/api/commands/<job_id>', methods=['GET'])
+def get_command(job_id):
+    """
+    Consulta el estado de un comando y su salida.
+
+    Parámetros de consulta:
+    - since: (Opcional) Solo devuelve las líneas con número de secuencia mayor (predeterminado: 0)
+    """
+    since = request.args.get('since', 0, type=int)
+    job = command_runner.get_job(job_id, since=since)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Comando no encontrado'
+        }), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@command_bp.route('/api/commands/<job_id>/stream', methods=['GET'])
+def stream_command(job_id):
+    """
+    Sigue la salida de un comando en directo mediante Server-Sent Events.
+
+    Cada línea se envía como evento 'output' con su número de secuencia como id, de modo
+    que al reconectar (cabecera Last-Event-ID o parámetro since) se continúa donde se
+    quedó. Al terminar se envía un evento 'done' con el estado final.
+    """
+    if command_runner.get_job(job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Comando no encontrado'
+        }), 404
+
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+
+    def event_stream():
+        for event, data in command_runner.iter_events(job_id, since=since):
+            if event == 'heartbeat':
+                yield ": keep-alive\n\n"
+            elif event == 'output':
+                yield f"id: {data['seq']}\nevent: output\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            else:
+                yield f"event: done\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@command_bp.route('/api/commands/<job_id>/cancel', methods=['POST'])
+def cancel_command(job_id):
+    """Cancela un comando en cola o en ejecución (se termina también a sus procesos hijos)."""
+    if command_runner.get_job(job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Comando no encontrado'
+        }), 404
+    if not command_runner.cancel(job_id):
+        return jsonify({
+            'success': False,
+            'error': 'El comando ya ha terminado'
+        }), 409
+    return jsonify({'success': True, 'job_id': job_id})
+
+
+def register_command_routes(app, get_workspace_fn):
+    """
+    Registra las rutas de comandos en la aplicación Flask.
+
+    Args:
+        app: La aplicación Flask
+        get_workspace_fn: Función para obtener el workspace del usuario
+    """
+    global _get_workspace
+    _get_workspace = get_workspace_fn
+    app.register_blueprint(command_bp)
+    logger.info("Rutas de comandos en segundo plano registradas correctamente")
@@ -0,0 +1,570 @@
+"""
+Servicio de ejecución de comandos para Codestorm Assistant.
+Los comandos se ejecutan como trabajos en segundo plano: la salida (stdout y stderr) se
+guarda línea a línea con un número de secuencia para poder seguirla en directo, y cada
+trabajo se puede cancelar o consultar mientras avanza. El número de comandos simultáneos
+por workspace está limitado; los que superan el límite esperan en cola.
+"""
+import os
+import time
+import uuid
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+
+import sandbox
+from job_registry import JobRegistry, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_ERROR, JOB_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+JOB_TIMEOUT = "timeout"
+FINISHED_STATUSES = (JOB_DONE, JOB_ERROR, JOB_TIMEOUT, JOB_CANCELLED)
+
+STREAM_STDOUT = "stdout"
+STREAM_STDERR = "stderr"
+
+# Tiempo máximo de ejecución por defecto y límite para el que pida cada petición
+DEFAULT_TIMEOUT = 600
+MAX_TIMEOUT = 3600
+# Comandos simultáneos por workspace
+DEFAULT_MAX_CONCURRENT = 2
+# Líneas de salida que se conservan por trabajo (las más antiguas se descartan)
+MAX_OUTPUT_LINES = 5000
+# Una línea sin salto de línea se emite igualmente al llegar a este tamaño
+MAX_LINE_LENGTH = 8192
+# Tiempo que se espera tras SIGTERM antes de forzar con SIGKILL
+TERMINATE_GRACE_SECONDS = 5
+
+_processes = {}
+_cancel_events = {}
+_running = {}
+_pending = {}
+_listeners = []
+_registry = JobRegistry(on_expire=lambda job_id: _cancel_events.pop(job_id, None))
+_jobs = _registry.jobs
+_jobs_lock = _registry.lock
+# Se notifica cada vez que un trabajo recibe salida o cambia de estado
+_jobs_changed = _registry.changed
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def get_default_timeout():
+    """Tiempo máximo de ejecución por defecto (COMMAND_TIMEOUT), en segundos."""
+    return min(_env_int('COMMAND_TIMEOUT', DEFAULT_TIMEOUT), MAX_TIMEOUT)
+
+
+def _get_max_concurrent():
+    return _env_int('COMMAND_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT)
+
+
+def add_listener(callback):
+    """
+    Registra una función que recibe los eventos de todos los trabajos.
+
+    La función se llama como callback(event, data), con event 'output' (data es la línea
+    con 'job_id', 'seq', 'stream' y 'text') o 'status' (data es el trabajo sin la salida).
+    Se llama desde los hilos de los trabajos, así que debe ser rápida.
+    """
+    _listeners.append(callback)
+
+
+def _notify_listeners(event, data):
+    for callback in list(_listeners):
+        try:
+            callback(event, data)
+        except Exception as e:
+            logger.warning(f"Error en un receptor de eventos de comandos: {str(e)}")
+
+
+def _public_job(job):
+    job = dict(job)
+    job.pop('output', None)
+    job.pop('on_finish', None)
+    return job
+
+
+def _append_output(job_id, stream, text):
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job['last_seq'] += 1
+        line = {'job_id': job_id, 'seq': job['last_seq'], 'stream': stream, 'text': text}
+        job['output'].append(line)
+        if len(job['output']) > MAX_OUTPUT_LINES:
+            job['output'].popleft()
+            job['dropped_lines'] += 1
+        _jobs_changed.notify_all()
+    _notify_listeners('output', line)
+
+
+def _set_status(job_id, status, **changes):
+    with _jobs_changed:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        job['status'] = status
+        job.update(changes)
+        _jobs_changed.notify_all()
+        public = _public_job(job)
+    _notify_listeners('status', public)
+    return public
+
+
+class _OutputBudget:
+    """Cuenta los bytes de salida de un comando y avisa al superar el límite."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.exceeded = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.total += count
+            if self.max_bytes and self.total > self.max_bytes:
+                self.exceeded.set()
+        return not self.exceeded.is_set()
+
+
+def _read_stream(job_id, pipe, stream, budget):
+    """Lee una tubería por bloques y publica la salida línea a línea en cuanto llega."""
+    pending = b''
+    try:
+        while True:
+            chunk = pipe.read1(65536)
+            if not chunk:
+                break
+            if not budget.add(len(chunk)):
+                # Límite de salida superado: se sigue vaciando la tubería hasta que el
+                # comando se detenga, pero sin guardar nada más
+                pending = b''
+                continue
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                _append_output(job_id, stream, line.rstrip(b'\r').decode('utf-8', errors='replace'))
+            while len(pending) >= MAX_LINE_LENGTH:
+                _append_output(job_id, stream, pending[:MAX_LINE_LENGTH].decode('utf-8', errors='replace'))
+                pending = pending[MAX_LINE_LENGTH:]
+        if pending:
+            _append_output(job_id, stream, pending.rstrip(b'\r').decode('utf-8', errors='replace'))
+    except (OSError, ValueError) as e:
+        logger.debug(f"Lectura de {stream} del trabajo {job_id} interrumpida: {str(e)}")
+    finally:
+        pipe.close()
+
+
+def _terminate(process, box):
+    """Termina el proceso y sus hijos: SIGTERM y, si no responde a tiempo, SIGKILL."""
+    box.kill(process, signal.SIGTERM)
+    if not box.poll(process, TERMINATE_GRACE_SECONDS):
+        box.kill(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        while not box.poll(process, 1.0):
+            pass
+
+
+def _run_job(job_id):
+    with _jobs_lock:
+        job = _jobs[job_id]
+        command, cwd, timeout, limits = job['command'], job['cwd'], job['timeout'], job['limits']
+        cancel_event = _cancel_events[job_id]
+
+    if cancel_event.is_set():
+        _finish_job(job_id, JOB_CANCELLED, None)
+        return
+
+    started_at = time.time()
+    _set_status(job_id, JOB_RUNNING, started_at=started_at)
+    box = sandbox.Sandbox(job_id, limits)
+    try:
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            preexec_fn=box.preexec if os.name == 'posix' else None
+        )
+    except Exception as e:
+        logger.error(f"No se pudo ejecutar el comando '{command}': {str(e)}")
+        box.cleanup()
+        _finish_job(job_id, JOB_ERROR, None, error=str(e))
+        return
+
+    box.started()
+    with _jobs_lock:
+        _processes[job_id] = process
+    budget = _OutputBudget(limits['output_mb'] * 1024 * 1024)
+    readers = [
+        threading.Thread(target=_read_stream, args=(job_id, process.stdout, STREAM_STDOUT, budget), daemon=True),
+        threading.Thread(target=_read_stream, args=(job_id, process.stderr, STREAM_STDERR, budget), daemon=True)
+    ]
+    for reader in readers:
+        reader.start()
+
+    status = JOB_DONE
+    limit_exceeded = None
+    deadline = started_at + timeout
+    while not box.poll(process, min(0.2, max(0.0, deadline - time.time()))):
+        if cancel_event.is_set():
+            status = JOB_CANCELLED
+            _terminate(process, box)
+        elif budget.exceeded.is_set():
+            status, limit_exceeded = JOB_ERROR, sandbox.LIMIT_OUTPUT
+            _terminate(process, box)
+        elif time.time() >= deadline:
+            status, limit_exceeded = JOB_TIMEOUT, sandbox.LIMIT_TIME
+            logger.warning(f"Comando '{command}' detenido al superar {timeout}s")
+            _terminate(process, box)
+
+    # Los hijos que sigan vivos pueden mantener abiertas las tuberías: el trabajo sigue
+    # en ejecución mientras haya salida, con el mismo límite de tiempo y cancelación
+    for reader in readers:
+        while reader.is_alive():
+            reader.join(0.5)
+            if status != JOB_DONE:
+                continue
+            if cancel_event.is_set():
+                status = JOB_CANCELLED
+            elif budget.exceeded.is_set():
+                status, limit_exceeded = JOB_ERROR, sandbox.LIMIT_OUTPUT
+            elif time.time() >= deadline:
+                status, limit_exceeded = JOB_TIMEOUT, sandbox.LIMIT_TIME
+            else:
+                continue
+            box.kill(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    if status == JOB_DONE and budget.exceeded.is_set():
+        # El comando superó el límite y terminó antes de que el bucle de espera lo viera:
+        # su salida está truncada
+        status, limit_exceeded = JOB_ERROR, sandbox.LIMIT_OUTPUT
+    with _jobs_lock:
+        _processes.pop(job_id, None)
+
+    limit_exceeded = limit_exceeded or box.limit_exceeded()
+    usage = box.usage()
+    usage['output_bytes'] = budget.total
+    box.cleanup()
+
+    error = None
+    if status == JOB_TIMEOUT:
+        error = f'Tiempo de ejecución agotado ({timeout}s)'
+    elif status == JOB_CANCELLED:
+        error = 'Comando cancelado'
+    elif limit_exceeded == sandbox.LIMIT_OUTPUT:
+        error = f"La salida del comando supera el límite de {limits['output_mb']} MB"
+    elif limit_exceeded == sandbox.LIMIT_CPU:
+        status, error = JOB_ERROR, f"El comando superó el límite de {limits['cpu_seconds']}s de CPU"
+    elif limit_exceeded == sandbox.LIMIT_MEMORY:
+        status, error = JOB_ERROR, f"El comando superó el límite de {limits['memory_mb']} MB de memoria"
+    _finish_job(job_id, status, process.returncode, error=error, usage=usage, limit_exceeded=limit_exceeded)
+
+
+def _finish_job(job_id, status, exit_code, error=None, usage=None, limit_exceeded=None):
+    public = _set_status(job_id, status, exit_code=exit_code, error=error, usage=usage,
+                         limit_exceeded=limit_exceeded, finished_at=time.time())
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        on_finish = job.get('on_finish') if job else None
+        workspace_key = job['workspace_key'] if job else None
+
+    if public is not None:
+        if status == JOB_DONE and exit_code:
+            logger.warning(f"Comando '{public['command']}' terminó con código {exit_code}")
+        elif limit_exceeded:
+            logger.warning(f"Comando '{public['command']}' detenido por el límite de recursos '{limit_exceeded}'")
+        if usage:
+            logger.info(f"Recursos del comando '{public['command']}': {usage}")
+        if on_finish is not None:
+            try:
+                on_finish(get_job(job_id, since=0))
+            except Exception as e:
+                logger.error(f"Error al procesar el final del comando '{public['command']}': {str(e)}")
+
+    if workspace_key is not None:
+        _release_slot(workspace_key)
+
+
+def _start_thread(job_id):
+    threading.Thread(target=_run_job, args=(job_id,), daemon=True, name=f"command-{job_id[:8]}").start()
+
+
+def _release_slot(workspace_key):
+    """Libera el hueco de un workspace y arranca el siguiente comando en cola, si lo hay."""
+    with _jobs_lock:
+        queue = _pending.get(workspace_key)
+        if queue:
+            next_job_id = queue.popleft()
+        else:
+            next_job_id = None
+            _running[workspace_key] = _running.get(workspace_key, 1) - 1
+            if _running[workspace_key] <= 0:
+                _running.pop(workspace_key, None)
+            _pending.pop(workspace_key, None)
+    if next_job_id is not None:
+        _start_thread(next_job_id)
+
+
+def submit(command, cwd, workspace_key=None, timeout=None, on_finish=None, limits=None):
+    """
+    Encola la ejecución de un comando de shell.
+
+    Args:
+        command: Comando a ejecutar
+        cwd: Directorio de trabajo (normalmente el workspace del usuario)
+        workspace_key: Clave para el límite de comandos simultáneos (por defecto, cwd)
+        timeout: Tiempo máximo de ejecución en segundos (por defecto COMMAND_TIMEOUT)
+        on_finish: Función opcional que recibe el trabajo (con toda su salida) al terminar
+        limits: Límites de recursos más estrictos que los configurados (ver sandbox.get_limits)
+
+    Returns:
+        dict: Estado inicial del trabajo (incluye 'job_id')
+    """
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    try:
+        timeout = int(timeout) if timeout else get_default_timeout()
+    except (TypeError, ValueError):
+        timeout = get_default_timeout()
+    workspace_key = workspace_key or os.path.abspath(str(cwd))
+    job = {
+        'job_id': job_id,
+        'command': command,
+        'cwd': str(cwd),
+        'workspace_key': workspace_key,
+        'timeout': max(1, min(timeout, MAX_TIMEOUT)),
+        'limits': sandbox.get_limits(limits),
+        'status': JOB_QUEUED,
+        'exit_code': None,
+        'error': None,
+        'usage': None,
+        'limit_exceeded': None,
+        'output': deque(),
+        'last_seq': 0,
+        'dropped_lines': 0,
+        'on_finish': on_finish,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None
+    }
+    with _jobs_lock:
+        _registry.prune(now)
+        _jobs[job_id] = job
+        _cancel_events[job_id] = threading.Event()
+        if _running.get(workspace_key, 0) < _get_max_concurrent():
+            _running[workspace_key] = _running.get(workspace_key, 0) + 1
+            start_now = True
+        else:
+            _pending.setdefault(workspace_key, deque()).append(job_id)
+            start_now = False
+
+    if start_now:
+        _start_thread(job_id)
+    else:
+        logger.info(f"Comando '{command}' en cola: el workspace ya tiene {_get_max_concurrent()} comandos en ejecución")
+    return get_job(job_id)
+
+
+def get_job(job_id, since=None):
+    """
+    Devuelve el estado de un trabajo.
+
+    Args:
+        job_id: ID del trabajo
+        since: Si se indica, se incluyen en 'output' las líneas con secuencia mayor
+
+    Returns:
+        dict o None: Copia del trabajo, o None si no existe
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        public = _public_job(job)
+        if since is not None:
+            public['output'] = [line for line in job['output'] if line['seq'] > since]
+    return public
+
+
+def wait(job_id, timeout=None):
+    """
+    Espera a que termine un trabajo.
+
+    Returns:
+        dict o None: El trabajo (sin la salida), o None si no existe; si se agota el tiempo
+        de espera se devuelve igualmente y su estado sigue siendo 'queued' o 'running'
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    with _jobs_changed:
+        while True:
+            job = _jobs.get(job_id)
+            if job is None or job['status'] in FINISHED_STATUSES:
+                break
+            remaining = deadline - time.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            _jobs_changed.wait(remaining)
+    return get_job(job_id)
+
+
+def collect_output(job_id):
+    """
+    Devuelve la salida conservada de un trabajo separada por tubería.
+
+    Returns:
+        Tuple[str, str]: (stdout, stderr)
+    """
+    job = get_job(job_id, since=0)
+    if job is None:
+        return '', ''
+    stdout = [line['text'] for line in job['output'] if line['stream'] == STREAM_STDOUT]
+    stderr = [line['text'] for line in job['output'] if line['stream'] == STREAM_STDERR]
+    return '\n'.join(stdout), '\n'.join(stderr)
+
+
+def iter_events(job_id, since=0, heartbeat=15):
+    """
+    Genera los eventos de un trabajo a medida que se producen, hasta que termina.
+
+    Produce tuplas (event, data): ('output', línea) por cada línea con secuencia mayor que
+    since, ('heartbeat', None) si no hay novedades en heartbeat segundos y, al final,
+    ('status', trabajo).
+    """
+    last_seq = since
+    while True:
+        with _jobs_changed:
+            job = _jobs.get(job_id)
+            if job is None:
+                return
+            deadline = time.time() + heartbeat
+            while job['last_seq'] <= last_seq and job['status'] not in FINISHED_STATUSES:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                _jobs_changed.wait(remaining)
+                job = _jobs.get(job_id)
+                if job is None:
+                    return
+            lines = [line for line in job['output'] if line['seq'] > last_seq]
+            finished = job['status'] in FINISHED_STATUSES
+            public = _public_job(job) if finished else None
+
+        if not lines and not finished:
+            yield 'heartbeat', None
+        for line in lines:
+            last_seq = line['seq']
+            yield 'output', line
+        if finished:
+            yield 'status', public
+            return
+
+
+def cancel(job_id):
+    """
+    Cancela un trabajo en cola o en ejecución.
+
+    Returns:
+        bool: True si el trabajo existía y no había terminado
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            return False
+        _cancel_events[job_id].set()
+        queue = _pending.get(job['workspace_key'])
+        queued = queue is not None and job_id in queue
+        if queued:
+            queue.remove(job_id)
+
+    if queued:
+        # Nunca llegó a ocupar un hueco del workspace: se termina sin liberar ninguno
+        public = _set_status(job_id, JOB_CANCELLED, error='Comando cancelado', finished_at=time.time())
+        logger.info(f"Comando en cola cancelado: {public['command'] if public else job_id}")
+    return True
+
+
+def list_jobs(workspace_key=None):
+    """Devuelve los trabajos (de un workspace, si se indica), del más reciente al más antiguo."""
+    with _jobs_lock:
+        jobs = [
+            _public_job(job) for job in _jobs.values()
+            if workspace_key is None or job['workspace_key'] == workspace_key
+        ]
+    return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+
+def get_wait_seconds():
+    """Tiempo que una petición espera al comando antes de responder con el trabajo (COMMAND_WAIT_SECONDS)."""
+    try:
+        return max(0.0, float(os.environ.get('COMMAND_WAIT_SECONDS', 10)))
+    except ValueError:
+        return 10.0
+
+
+def execute(command, cwd, timeout=None, wait_seconds=None, on_finish=None):
+    """
+    Lanza un comando y espera como mucho wait_seconds a que termine.
+
+    Los comandos rápidos se resuelven dentro de la petición; los lentos siguen en segundo
+    plano y el llamador responde con el trabajo para que el cliente siga su salida.
+
+    Args:
+        command: Comando a ejecutar
+        cwd: Directorio de trabajo
+        timeout: Tiempo máximo de ejecución en segundos (por defecto COMMAND_TIMEOUT)
+        wait_seconds: Espera máxima en la petición (por defecto COMMAND_WAIT_SECONDS)
+        on_finish: Función opcional que recibe el trabajo al terminar
+
+    Returns:
+        dict: El trabajo; si ya terminó incluye 'stdout' y 'stderr'
+    """
+    job = submit(command, cwd, timeout=timeout, on_finish=on_finish)
+    job = wait(job['job_id'], get_wait_seconds() if wait_seconds is None else wait_seconds)
+    if job['status'] in FINISHED_STATUSES:
+        job['stdout'], job['stderr'] = collect_output(job['job_id'])
+    return job
+
+
+def run(command, cwd, timeout=None, limits=None):
+    """
+    Ejecuta un comando con los mismos límites que los trabajos y espera a que termine.
+
+    Pensado para código que ya se ejecuta en su propio hilo (por ejemplo, el Constructor
+    de Tareas); respeta igualmente el límite de comandos simultáneos del workspace.
+
+    Returns:
+        dict: El trabajo terminado, con 'stdout', 'stderr', 'exit_code' y 'usage'
+    """
+    job = submit(command, cwd, timeout=timeout, limits=limits)
+    job = wait(job['job_id'])
+    job['stdout'], job['stderr'] = collect_output(job['job_id'])
+    return job
+
+
+def describe_usage(usage):
+    """Resumen legible del uso de recursos de un comando, o '' si no hay datos."""
+    if not usage:
+        return ''
+    parts = [f"{usage['wall_seconds']:.1f}s"] if usage.get('wall_seconds') is not None else []
+    cpu = usage.get('cpu_seconds')
+    if cpu is None and usage.get('cpu_user_seconds') is not None:
+        cpu = usage['cpu_user_seconds'] + usage['cpu_system_seconds']
+    if cpu is not None:
+        parts.append(f"CPU {cpu:.1f}s")
+    memory = usage.get('memory_peak_mb') or usage.get('max_rss_mb')
+    if memory is not None:
+        parts.append(f"memoria máx. {memory:.0f} MB")
+    if usage.get('pids_peak'):
+        parts.append(f"{usage['pids_peak']} procesos")
+    return ', '.join(parts)
@@ -0,0 +1,145 @@
+"""
+Eventos de progreso del Constructor de Tareas para Codestorm Assistant.
+Cada construcción publica su progreso, sus mensajes y sus notificaciones como eventos
+numerados; los clientes los reciben en directo y, al reconectar, piden los posteriores
+al último número de secuencia que vieron en lugar de volver a consultar el proyecto.
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+EVENT_PROGRESS = "progress"
+EVENT_MESSAGE = "message"
+EVENT_NOTIFICATION = "notification"
+EVENT_END = "end"
+
+# Eventos que se conservan por proyecto para poder reanudar
+MAX_EVENTS = 1000
+
+# Tiempo que se conservan los eventos de una construcción terminada
+FINISHED_STREAM_TTL = 3600
+
+_streams = {}
+_listeners = []
+_streams_lock = threading.Lock()
+# Se notifica cada vez que se publica un evento
+_streams_changed = threading.Condition(_streams_lock)
+
+
+def add_listener(callback):
+    """
+    Registra una función que recibe todos los eventos publicados.
+
+    La función se llama como callback(event) desde el hilo constructor, así que debe
+    ser rápida.
+    """
+    _listeners.append(callback)
+
+
+def _prune_finished_streams(now):
+    expired = [
+        project_id for project_id, stream in _streams.items()
+        if stream['finished_at'] and now - stream['finished_at'] > FINISHED_STREAM_TTL
+    ]
+    for project_id in expired:
+        _streams.pop(project_id, None)
+
+
+def publish(project_id, event, data):
+    """
+    Publica un evento de una construcción.
+
+    Args:
+        project_id: ID del proyecto
+        event: Tipo de evento (progress, message, notification o end)
+        data: Datos del evento (deben poder serializarse a JSON)
+
+    Returns:
+        dict: El evento publicado, con su número de secuencia
+    """
+    now = time.time()
+    with _streams_changed:
+        stream = _streams.get(project_id)
+        if stream is None:
+            _prune_finished_streams(now)
+            stream = _streams[project_id] = {'events': [], 'last_seq': 0, 'finished_at': None}
+        stream['last_seq'] += 1
+        record = {
+            'project_id': project_id,
+            'seq': stream['last_seq'],
+            'event': event,
+            'data': data,
+            'timestamp': now
+        }
+        stream['events'].append(record)
+        if len(stream['events']) > MAX_EVENTS:
+            del stream['events'][:len(stream['events']) - MAX_EVENTS]
+        if event == EVENT_END:
+            stream['finished_at'] = now
+        _streams_changed.notify_all()
+
+    for callback in list(_listeners):
+        try:
+            callback(record)
+        except Exception as e:
+            logger.warning(f"Error en un receptor de eventos del Constructor: {str(e)}")
+    return record
+
+
+def get_events(project_id, since=0):
+    """
+    Devuelve los eventos de una construcción posteriores a una secuencia.
+
+    Returns:
+        dict o None: 'events' (lista), 'last_seq', 'finished' y 'complete' (False si
+        se han descartado eventos posteriores a since por antigüedad), o None si el
+        proyecto no tiene eventos
+    """
+    with _streams_lock:
+        stream = _streams.get(project_id)
+        if stream is None:
+            return None
+        events = [record for record in stream['events'] if record['seq'] > since]
+        first_seq = stream['events'][0]['seq'] if stream['events'] else stream['last_seq'] + 1
+        return {
+            'events': events,
+            'last_seq': stream['last_seq'],
+            'finished': stream['finished_at'] is not None,
+            'complete': first_seq <= since + 1
+        }
+
+
+def iter_events(project_id, since=0, heartbeat=15):
+    """
+    Genera los eventos de una construcción a medida que se publican.
+
+    Produce los eventos con secuencia mayor que since, None si no hay novedades en
+    heartbeat segundos, y termina tras el evento 'end'. Si el proyecto aún no tiene
+    eventos (p. ej. sigue en cola) espera a que publique el primero.
+    """
+    last_seq = since
+    while True:
+        with _streams_changed:
+            deadline = time.time() + heartbeat
+            while True:
+                stream = _streams.get(project_id)
+                if stream is not None and (stream['last_seq'] > last_seq or stream['finished_at']):
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                _streams_changed.wait(remaining)
+            events = [record for record in stream['events'] if record['seq'] > last_seq] if stream else []
+            finished = stream is not None and stream['finished_at'] is not None
+
+        if not events:
+            if finished:
+                return
+            yield None
+        for record in events:
+            last_seq = record['seq']
+            yield record
+            if record['event'] == EVENT_END:
+                return
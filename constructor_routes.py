@@ -12,11 +12,15 @@ import uuid
 import logging
 import threading
 import datetime
-import subprocess
-from flask import jsonify, request, session, current_app
-from sqlalchemy.orm import sessionmaker
+import command_runner
+import build_scheduler
+import constructor_events
+import generation_planner
+from flask import jsonify, request, session, current_app, Response, stream_with_context
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import OperationalError, DisconnectionError
+from sqlalchemy.pool import QueuePool
 
 from models import Project, ProjectSession, Base
 
@@ -24,38 +28,81 @@ from models import Project, ProjectSession, Base
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Conectar a la base de datos de forma robusta
+# Motor y fábrica de sesiones compartidos por todo el proceso: se crean una sola vez y
+# cada hilo (petición o constructor en segundo plano) obtiene su propia sesión
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+# Errores de conexión que merece la pena reintentar
+RETRYABLE_DB_ERRORS = (OperationalError, DisconnectionError)
+
+
+def _env_int(name, default):
+    try:
+        return max(0, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+def get_engine():
+    """
+    Devuelve el motor de base de datos del Constructor, creándolo la primera vez.
+
+    Usa un QueuePool con pre-ping (descarta conexiones cortadas, p. ej. por SSL) y
+    reciclado periódico, y crea las tablas una sola vez al crear el motor.
+    """
+    global _engine, _session_factory
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            database_url = os.environ.get("DATABASE_URL")
+            options = {
+                'pool_pre_ping': True,
+                'pool_recycle': _env_int('CONSTRUCTOR_DB_POOL_RECYCLE', 300)
+            }
+            if database_url and database_url.startswith('postgres'):
+                options.update({
+                    'poolclass': QueuePool,
+                    'pool_size': _env_int('CONSTRUCTOR_DB_POOL_SIZE', 5),
+                    'max_overflow': _env_int('CONSTRUCTOR_DB_MAX_OVERFLOW', 10),
+                    'pool_timeout': 10,
+                    'connect_args': {
+                        "connect_timeout": 5,      # Timeout corto de conexión en segundos
+                        "sslmode": "prefer",       # Más permisivo con SSL
+                        "options": "-c statement_timeout=3000"  # Limitar duración de consultas a 3s
+                    }
+                })
+            engine = create_engine(database_url, **options)
+            # Crear tablas si no existen (una vez por proceso, no en cada sesión)
+            Base.metadata.create_all(engine)
+            _session_factory = scoped_session(sessionmaker(bind=engine))
+            _engine = engine
+            logger.info("Motor de base de datos del Constructor inicializado")
+    return _engine
+
+
 def get_db_session():
     """
-    Obtiene una sesión de base de datos con manejo mejorado de conexiones.
-    Implementa configuraciones para reconexión automática y tolerancia a fallos SSL.
+    Obtiene la sesión de base de datos del hilo actual.
+
+    La sesión sale de una fábrica con ámbito de hilo sobre el motor compartido; cerrarla
+    devuelve su conexión al pool. remove_db_session() la descarta al terminar la petición
+    o el hilo.
     """
-    database_url = os.environ.get("DATABASE_URL")
-    
-    # Configuración ultraconservadora para PostgreSQL con foco en estabilidad SSL
-    # Reducir drásticamente el uso de conexiones para minimizar problemas SSL
-    engine = create_engine(
-        database_url,
-        poolclass=NullPool,      # Desactivar pooling completamente para evitar problemas de SSL
-        connect_args={
-            "connect_timeout": 5,      # Timeout corto de conexión en segundos
-            "sslmode": "prefer",       # Más permisivo con SSL
-            "options": "-c statement_timeout=3000"  # Limitar duración de consultas a 3s
-        }
-    )
-    
-    try:
-        # Crear tablas si no existen
-        Base.metadata.create_all(engine)
-        # Crear y devolver una sesión
-        Session = sessionmaker(bind=engine)
-        return Session()
-    except Exception as e:
-        logger.error(f"Error al conectar a la base de datos: {str(e)}")
-        # Esperar un poco y reintentar una vez más antes de propagar el error
-        time.sleep(2)
-        Session = sessionmaker(bind=engine)
-        return Session()
+    get_engine()
+    return _session_factory()
+
+
+def remove_db_session():
+    """Cierra y descarta la sesión del hilo actual (p. ej. tras un error o al acabar el hilo)."""
+    if _session_factory is not None:
+        _session_factory.remove()
+
+
+# Campos del proyecto que se publican en los eventos de progreso
+PROGRESS_FIELDS = ('status', 'phase', 'progress', 'current_step', 'current_agent')
 
 # Variables globales para gestionar tareas en segundo plano
 active_projects = {}
@@ -67,6 +114,9 @@ def db_operation(func):
     """
     Decorador para manejar operaciones de base de datos con reintentos automáticos
     y cierre adecuado de sesiones.
+    
+    Solo se reintentan los errores de conexión, con esperas cortas: el pre-ping del pool
+    ya descarta las conexiones cortadas antes de usarlas.
     """
     def wrapper(*args, **kwargs):
         max_retries = 3
@@ -79,11 +129,13 @@ def db_operation(func):
                 db = get_db_session()
                 # Pasar la sesión como primer argumento a la función decorada
                 return func(db, *args, **kwargs)
-            except Exception as e:
+            except RETRYABLE_DB_ERRORS as e:
                 last_error = e
                 logger.warning(f"Error en operación de base de datos (intento {retry_count+1}/{max_retries}): {str(e)}")
-                # Aumentar tiempo de espera con cada reintento (backoff exponencial)
-                time.sleep(2 ** retry_count)
+                # Descartar la sesión fallida y esperar un poco más con cada reintento
+                remove_db_session()
+                db = None
+                time.sleep(0.1 * 2 ** retry_count)
                 retry_count += 1
             finally:
                 # Asegurar que la sesión se cierre adecuadamente
@@ -110,8 +162,27 @@ class AutonomousBuilder:
         self.project_id = project_id
         self.user_id = user_id
         self.lock = threading.RLock()  # Lock para operaciones thread-safe
+        # Condición que despierta al hilo constructor al pausar o reanudar (sin sondeo)
+        self.state_changed = threading.Condition(self.lock)
         self.pause_flag = threading.Event()
         self.pause_flag.set()  # Inicialmente no pausado
+        self.wait_factor = 1.0
+        
+        # Escritura diferida: el hilo constructor acumula mensajes, notificaciones y
+        # progreso en su sesión de BD y los confirma por lotes (cada flush_interval
+        # segundos, al cambiar de fase, al pausar y al terminar)
+        self.db = None
+        self.project = None
+        self.session = None
+        self.flush_interval = _env_int('CONSTRUCTOR_FLUSH_INTERVAL_MS', 2000) / 1000.0
+        self._pending_writes = 0
+        self._last_flush = time.monotonic()
+        self.write_stats = {'writes': 0, 'commits': 0}
+        
+        # Lo ya publicado como eventos de progreso (constructor_events)
+        self._published_progress = None
+        self._published_messages = 0
+        self._published_notifications = 0
         
         # Registrar proyecto activo
         active_projects[project_id] = self
@@ -121,7 +192,8 @@ class AutonomousBuilder:
     def update_project(self, project, status, phase, progress, current_step):
         """
         Método auxiliar para actualizar el estado de un proyecto.
-        Crea una sesión de BD y llama a _update_project_status de forma segura.
+        El cambio se acumula en la sesión del constructor; los cambios de estado o de
+        fase se confirman en el acto y el resto con el siguiente lote.
         
         Args:
             project: Objeto del proyecto a actualizar
@@ -131,14 +203,15 @@ class AutonomousBuilder:
             current_step: Descripción del paso actual
         """
         try:
-            # Obtener una sesión de BD directamente en lugar de usar el decorador
-            db = get_db_session()
-            try:
-                result = self._update_project_status(db, project, status, phase, progress, current_step)
-                return result
-            finally:
-                # Asegurar que la sesión se cierre apropiadamente
-                db.close()
+            with self.lock:
+                boundary = project.status != status or project.phase != phase
+                project.status = status
+                project.phase = phase
+                project.progress = progress
+                project.current_step = current_step
+                project.updated_at = datetime.datetime.utcnow()
+            self._queue_write(flush=boundary)
+            return True
         except Exception as e:
             logger.error(f"Error al actualizar estado de proyecto: {str(e)}")
             return False
@@ -146,34 +219,81 @@ class AutonomousBuilder:
     def update_agent(self, agent_id):
         """
         Método auxiliar para cambiar el agente activo.
-        Crea una sesión de BD y llama a _switch_agent de forma segura.
+        Llama a _switch_agent capturando cualquier error.
         
         Args:
             agent_id: ID del agente al que cambiar (architect, developer, testing, fixing)
         """
         try:
-            # Obtener una sesión de BD directamente en lugar de usar el decorador
-            db = get_db_session()
-            try:
-                result = self._switch_agent(db, agent_id)
-                return result
-            finally:
-                # Asegurar que la sesión se cierre apropiadamente
-                db.close()
+            return self._switch_agent(agent_id)
         except Exception as e:
             logger.error(f"Error al cambiar agente a {agent_id}: {str(e)}")
             return False
     
-    def start_building(self, project_description, config=None):
+    def _queue_write(self, flush=False):
+        """
+        Registra que hay cambios pendientes en la sesión del constructor y los confirma
+        si se pide o si ha pasado flush_interval desde el último lote.
+        """
+        self._pending_writes += 1
+        self.write_stats['writes'] += 1
+        if flush or time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush_writes()
+    
+    def _flush_writes(self):
+        """
+        Confirma en una sola transacción todos los cambios acumulados por el constructor
+        y, una vez guardados, los publica como eventos de progreso.
+        """
+        if self.db is None:
+            return
+        with self.lock:
+            # Leer las novedades antes del commit, que expira los objetos de la sesión
+            events = self._collect_events()
+            self.db.commit()
+            self._pending_writes = 0
+            self._last_flush = time.monotonic()
+            self.write_stats['commits'] += 1
+            # Publicar con el lock tomado para no adelantar a la pausa o reanudación
+            for event, data in events:
+                constructor_events.publish(self.project_id, event, data)
+    
+    def _collect_events(self):
+        """Progreso, mensajes y notificaciones que aún no se han publicado."""
+        events = []
+        progress = {field: getattr(self.project, field, None) for field in PROGRESS_FIELDS}
+        progress['error_count'] = getattr(self, 'error_count', 0)
+        if progress['status'] == 'active' and not self.pause_flag.is_set():
+            # La pausa se guarda desde otra sesión: el proyecto del constructor no la ve
+            progress['status'] = 'paused'
+        if progress != self._published_progress:
+            self._published_progress = progress
+            events.append((constructor_events.EVENT_PROGRESS, progress))
+        
+        messages = self.session.message_history or []
+        for message in messages[self._published_messages:]:
+            events.append((constructor_events.EVENT_MESSAGE, message))
+        self._published_messages = len(messages)
+        
+        notifications = getattr(self.project, 'notifications', None) or []
+        for notification in notifications[self._published_notifications:]:
+            events.append((constructor_events.EVENT_NOTIFICATION, notification))
+        self._published_notifications = len(notifications)
+        return events
+    
+    def build(self, project_description, config=None):
         """
-        Inicia el proceso de construcción en un hilo separado.
+        Ejecuta la construcción en el hilo actual.
+        
+        La llama un trabajador del planificador de construcciones (build_scheduler), que
+        limita cuántas construcciones se ejecutan a la vez.
         
         Args:
             project_description: Descripción del proyecto a construir
             config: Diccionario de configuración con opciones como:
                    - model: Modelo de IA a utilizar (openai, anthropic, gemini)
                    - agents: Diccionario con agentes a utilizar {architect: bool, developer: bool, ...}
-                   - development_speed: Velocidad de desarrollo (fast, balanced, thorough)
+                   - development_speed: Velocidad de desarrollo (turbo, fast, balanced, thorough)
         """
         if config is None:
             config = {
@@ -187,13 +307,7 @@ class AutonomousBuilder:
                 'development_speed': 'balanced'
             }
             
-        thread = threading.Thread(
-            target=self._build_process,
-            args=(project_description, config),
-            daemon=True
-        )
-        thread.start()
-        return thread
+        self._build_process(project_description, config)
     
     def _build_process(self, project_description, config):
         """
@@ -220,7 +334,10 @@ class AutonomousBuilder:
             self.development_speed = config.get('development_speed', 'balanced')
             
             # Ajustar intervalos según la velocidad de desarrollo
-            if self.development_speed == 'fast':
+            if self.development_speed == 'turbo':
+                self.notification_interval = 5  # Se sigue informando del progreso
+                self.wait_factor = 0.0          # Sin esperas: solo cuenta el trabajo real
+            elif self.development_speed == 'fast':
                 self.notification_interval = 5  # Notificaciones más frecuentes
                 self.wait_factor = 0.5         # Tiempos de espera más cortos
             elif self.development_speed == 'thorough':
@@ -282,6 +399,14 @@ class AutonomousBuilder:
             session.add_message('user', project_description)
             db.commit()
             
+            # A partir de aquí los cambios se confirman por lotes y se publican como eventos
+            # (el mensaje inicial ya lo tiene el cliente)
+            self.db = db
+            self.project = project
+            self.session = session
+            self._published_messages = len(session.message_history or [])
+            self._published_notifications = len(getattr(project, 'notifications', None) or [])
+            
             # Crear una notificación inicial para el usuario
             self._send_notification(
                 project, 
@@ -295,9 +420,6 @@ class AutonomousBuilder:
             
             # Simular análisis de requisitos
             self._wait_with_pause_check(3)
-            if self._should_stop():
-                logger.info(f"Construcción detenida para proyecto {self.project_id}")
-                return
             
             # Extraer tipo de proyecto y stack tecnológico
             project_type, tech_stack = self._analyze_project_requirements(project_description)
@@ -305,7 +427,7 @@ class AutonomousBuilder:
                 project.project_type = project_type
                 project.tech_stack = tech_stack
                 project.requires_approval = True  # Marcar que el proyecto requiere aprobación
-                db.commit()
+            self._queue_write()
             
             # Generar estructura del proyecto
             file_structure = self._plan_project_structure(project_type, tech_stack)
@@ -345,20 +467,18 @@ class AutonomousBuilder:
             }]
             
             session.add_special_actions(special_actions)
-            db.commit()
+            self._queue_write()
             
             # Esperar confirmación (en un entorno real)
             self.update_project(project, 'pending_approval', 'planning', 10, 'Esperando aprobación del plan de desarrollo')
             
             # Simular planificación
             self._wait_with_pause_check(3)
-            if self._should_stop():
-                return
             
             # Crear estructura de archivos
             file_structure = self._plan_project_structure(project_type, tech_stack)
             session.add_message('assistant', f"He planificado la siguiente estructura de archivos:\n\n```\n{json.dumps(file_structure, indent=2)}\n```\n\n¿Estás de acuerdo con esta estructura? Puedo ajustarla si lo necesitas.")
-            db.commit()
+            self._queue_write()
             
             # Esperar confirmación (en un entorno real)
             self._wait_with_pause_check(2)
@@ -373,26 +493,28 @@ class AutonomousBuilder:
             workspace_path = self._get_workspace_path()
             created_files = []
             
-            # Crear archivos uno por uno
+            # Generar los archivos en paralelo: cada uno en cuanto están listos aquellos de
+            # los que depende (p. ej. los componentes antes que las páginas)
             total_files = self._count_files(file_structure)
             files_created = 0
-            
-            for file_info in self._flatten_file_structure(file_structure):
-                file_path = file_info['path']
-                file_content = self._generate_file_content(file_path, project_type, tech_stack)
-                
-                # Verificar pausa
-                if self._should_stop():
-                    return
-                
-                # Crear el archivo
+            planned_files = [file_info['path'] for file_info in self._flatten_file_structure(file_structure)]
+            graph = generation_planner.build_dependency_graph(planned_files)
+            logger.info(f"Generando {len(graph)} archivos del proyecto {self.project_id} "
+                        f"(ruta crítica: {generation_planner.critical_path_length(graph)})")
+            
+            def write_file(file_path, context):
+                # Se ejecuta en el pool de generación: genera el archivo y lo guarda en disco
+                file_content = self._generate_file_content(file_path, project_type, tech_stack, context)
                 full_path = os.path.join(workspace_path, file_path)
                 os.makedirs(os.path.dirname(full_path), exist_ok=True)
                 
                 with open(full_path, 'w', encoding='utf-8') as f:
                     f.write(file_content)
-                
-                # Registrar archivo creado
+                return file_content
+            
+            def record_file(file_path, file_content):
+                # Se ejecuta en el hilo constructor, que es el único que usa la sesión de BD
+                nonlocal files_created
                 created_files.append(file_path)
                 with self.lock:
                     project.add_file(file_path, file_content[:200])
@@ -400,14 +522,12 @@ class AutonomousBuilder:
                     # Actualizar progreso basado en los archivos creados
                     progress = 25 + min(50, int((files_created / total_files) * 50))
                     project.update_progress(progress)
-                    db.commit()
                 
                 # Informar al usuario
                 session.add_message('assistant', f"✅ Archivo creado: `{file_path}`")
-                db.commit()
-                
-                # Pausa para simular trabajo
-                self._wait_with_pause_check(1)
+                self._queue_write()
+            
+            generation_planner.generate(graph, write_file, record_file, checkpoint=self._wait_while_paused)
             
             # Ejecutar comandos necesarios (instalación de dependencias, etc.)
             self.update_project(project, 'active', 'implementation', 75, 'Instalando dependencias y configurando el proyecto')
@@ -456,7 +576,7 @@ He terminado de construir tu aplicación según la descripción proporcionada. L
 Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación, no dudes en preguntar. ¡Estoy aquí para ayudarte!
 """
             session.add_message('assistant', completion_message)
-            db.commit()
+            self._flush_writes()
             
             # Remover de los proyectos activos
             self._cleanup()
@@ -464,7 +584,18 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
         except Exception as e:
             logger.error(f"Error en la construcción del proyecto {self.project_id}: {str(e)}")
             try:
-                # Intentar registrar el error
+                # Confirmar lo acumulado antes de descartar la sesión del hilo
+                self._flush_writes()
+            except Exception as flush_error:
+                logger.warning(f"No se pudieron guardar los cambios pendientes del proyecto {self.project_id}: {str(flush_error)}")
+            self.db = None
+            error_progress = dict(self._published_progress or {}, status='error', current_step=f"Error: {str(e)}")
+            constructor_events.publish(self.project_id, constructor_events.EVENT_PROGRESS, error_progress)
+            self._published_progress = error_progress
+            try:
+                # Intentar registrar el error con una sesión nueva: la del hilo puede
+                # haber quedado con una transacción fallida
+                remove_db_session()
                 db = get_db_session()
                 project = db.query(Project).filter_by(project_id=self.project_id).first()
                 
@@ -477,8 +608,11 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
                     session = db.query(ProjectSession).filter_by(project_id=project.project_id).first()
                     
                     if session:
-                        session.add_message('assistant', f"❌ Lo siento, ha ocurrido un error durante la construcción: {str(e)}\n\nPor favor, intenta de nuevo o contacta al soporte si el problema persiste.")
+                        error_message = f"❌ Lo siento, ha ocurrido un error durante la construcción: {str(e)}\n\nPor favor, intenta de nuevo o contacta al soporte si el problema persiste."
+                        session.add_message('assistant', error_message)
                         db.commit()
+                        constructor_events.publish(self.project_id, constructor_events.EVENT_MESSAGE,
+                                                   {'role': 'assistant', 'content': error_message})
                 else:
                     logger.error(f"No se encontró el proyecto con ID {self.project_id} para registrar el error")
             except:
@@ -486,26 +620,6 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
             
             self._cleanup()
     
-    def _update_project_status(self, db, project, status, phase, progress, current_step):
-        """
-        Actualiza el estado del proyecto de forma segura.
-        Usa el decorador db_operation para manejo robusto de la sesión.
-        """
-        with self.lock:
-            # Recargar el proyecto para evitar problemas de concurrencia
-            db_project = db.query(Project).filter_by(project_id=project.project_id).first()
-            if db_project:
-                db_project.status = status
-                db_project.phase = phase
-                db_project.progress = progress
-                db_project.current_step = current_step
-                db_project.updated_at = datetime.datetime.utcnow()
-                db.commit()
-                return True
-            else:
-                logger.warning(f"No se pudo actualizar el estado del proyecto con ID {project.project_id}")
-                return False
-    
     def _send_notification(self, project, session, title, message, notification_type="info"):
         """
         Envía una notificación para informar sobre el progreso.
@@ -527,10 +641,8 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
             "timestamp": datetime.datetime.utcnow().isoformat()
         }
         
-        if not hasattr(project, 'notifications') or project.notifications is None:
-            project.notifications = []
-        
-        project.notifications.append(notification)
+        # Reasignar la lista para que la columna JSON se marque como modificada
+        project.notifications = list(getattr(project, 'notifications', None) or []) + [notification]
         
         # Añadir un mensaje más detallado al chat
         icon_map = {
@@ -551,6 +663,8 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
         # Para notificaciones críticas o de progreso, añadirlas al chat
         if notification_type in ["error", "success", "progress"]:
             session.add_message('system', notification_message)
+        
+        self._queue_write(flush=notification_type == "error")
     
     def _analyze_and_fix_error(self, error_text, file_path, project, session):
         """
@@ -707,21 +821,13 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
         session.add_message('assistant', f"⚙️ Ejecutando: `{command}`")
         
         try:
-            # Ejecutar el comando
-            process = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=workspace_path
-            )
-            
-            stdout, stderr = process.communicate(timeout=30)
-            status = process.returncode
-            
-            # Convertir la salida a texto
-            stdout_text = stdout.decode('utf-8', errors='replace')
-            stderr_text = stderr.decode('utf-8', errors='replace')
+            # Ejecutar el comando con los límites de recursos del workspace
+            job = command_runner.run(command, workspace_path)
+            status = job['exit_code'] if job['status'] == command_runner.JOB_DONE else (job['exit_code'] or -1)
+            stdout_text = job['stdout']
+            stderr_text = job['stderr'] or job['error'] or ''
+            if job['error']:
+                stderr_text = f"{job['error']}\n{job['stderr']}".strip()
             
             # Registrar resultado
             if status == 0:
@@ -744,11 +850,15 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
                     # Si se solucionó, re-ejecutar el comando
                     return self._execute_command(command, project, session)
             
+            usage_summary = command_runner.describe_usage(job['usage'])
+            if usage_summary:
+                result += f"\n⏱️ Recursos: {usage_summary}"
             session.add_message('assistant', result)
             
             # Agregar acción completada
             action_id = project.add_pending_action('command', f"Ejecutar: {command}")
-            project.complete_action(action_id, {"stdout": stdout_text, "stderr": stderr_text, "status": status})
+            project.complete_action(action_id, {"stdout": stdout_text, "stderr": stderr_text, "status": status,
+                                                "usage": job['usage']})
             
             return status == 0
         except Exception as e:
@@ -897,51 +1007,27 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
         try:
             session.add_message('assistant', f"⏳ Ejecutando: `{command}`")
             
-            # Crear un proceso con comunicación bidireccional
-            process = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=workspace_path,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
-            
-            # Capturar la salida en tiempo real
-            stdout_output = []
-            stderr_output = []
-            
-            # Función para leer de un stream sin bloqueo
-            def read_stream(stream, output_list):
-                while True:
-                    line = stream.readline()
-                    if not line:
-                        break
-                    output_list.append(line)
-                    # Enviar actualización cada 5 líneas o si contiene información importante
-                    if len(output_list) % 5 == 0 or any(keyword in line for keyword in ['installing', 'created', 'success', 'done', 'finished']):
-                        session.add_message('system', f"📋 Progreso: {line.strip()}")
-            
-            # Crear hilos para leer stdout y stderr
-            stdout_thread = threading.Thread(target=read_stream, args=(process.stdout, stdout_output))
-            stderr_thread = threading.Thread(target=read_stream, args=(process.stderr, stderr_output))
-            
-            # Iniciar hilos
-            stdout_thread.start()
-            stderr_thread.start()
-            
-            # Esperar a que terminen los hilos
-            stdout_thread.join()
-            stderr_thread.join()
-            
-            # Esperar a que termine el proceso
-            status = process.wait()
+            # Lanzar el comando con los límites de recursos del workspace y seguir su
+            # salida en tiempo real
+            job = command_runner.submit(command, workspace_path)
+            line_count = 0
+            for event, data in command_runner.iter_events(job['job_id']):
+                if event != 'output':
+                    continue
+                line_count += 1
+                line = data['text']
+                # Enviar actualización cada 5 líneas o si contiene información importante
+                if line_count % 5 == 0 or any(keyword in line for keyword in ['installing', 'created', 'success', 'done', 'finished']):
+                    session.add_message('system', f"📋 Progreso: {line.strip()}")
+                    self._queue_write()
+            
+            job = command_runner.get_job(job['job_id'])
+            status = job['exit_code'] if job['status'] == command_runner.JOB_DONE else (job['exit_code'] or -1)
             
             # Unir la salida
-            stdout_text = ''.join(stdout_output)
-            stderr_text = ''.join(stderr_output)
+            stdout_text, stderr_text = command_runner.collect_output(job['job_id'])
+            if job['error']:
+                stderr_text = f"{job['error']}\n{stderr_text}".strip()
             
             # Enviar notificación según el resultado
             if status == 0:
@@ -962,7 +1048,8 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
             
             # Agregar acción completada
             action_id = project.add_pending_action('command', f"Ejecutar: {command}")
-            project.complete_action(action_id, {"stdout": stdout_text, "stderr": stderr_text, "status": status})
+            project.complete_action(action_id, {"stdout": stdout_text, "stderr": stderr_text, "status": status,
+                                                "usage": job['usage']})
             
             return status == 0
             
@@ -1244,54 +1331,106 @@ Si necesitas realizar algún ajuste o tienes preguntas sobre la implementación,
     
     def _wait_with_pause_check(self, seconds):
         """
-        Espera un tiempo determinado, verificando si hay que pausar.
-        Ajusta el tiempo de espera según el factor de velocidad configurado.
+        Espera un tiempo determinado sin contar el tiempo en pausa.
+        Ajusta el tiempo de espera según el factor de velocidad configurado (en modo
+        turbo no se espera nada). El hilo duerme en la condición y solo se despierta al
+        agotarse la espera o al pausar/reanudar, nunca por sondeo.
+        """
+        remaining = seconds * self.wait_factor
+        with self.state_changed:
+            while True:
+                self._wait_while_paused()
+                if remaining <= 0:
+                    return
+                timeout = remaining
+                if self._pending_writes:
+                    # Despertar a tiempo para confirmar el lote pendiente
+                    timeout = min(timeout, max(0.0, self._last_flush + self.flush_interval - time.monotonic()))
+                started = time.monotonic()
+                self.state_changed.wait(timeout)
+                remaining -= time.monotonic() - started
+                if self._pending_writes and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_writes()
+    
+    def _wait_while_paused(self):
+        """
+        Bloquea el hilo constructor mientras el proyecto esté pausado.
+        
+        Mientras espera, la construcción no ocupa plaza en el planificador, de modo que las
+        construcciones pausadas no detienen la cola.
         """
-        # Aplicar factor de velocidad al tiempo de espera
-        adjusted_seconds = seconds * self.wait_factor if hasattr(self, 'wait_factor') else seconds
-        
-        end_time = time.time() + adjusted_seconds
-        while time.time() < end_time:
-            if not self.pause_flag.is_set():
-                # Si está pausado, esperar hasta que se reanude
-                self.pause_flag.wait()
-                # Recalcular tiempo de finalización
-                end_time = time.time() + (end_time - time.time())
-            time.sleep(0.1)
+        with self.state_changed:
+            if self.pause_flag.is_set():
+                return
+            if self._pending_writes:
+                self._flush_writes()
+            build_scheduler.suspend(self.project_id)
+            try:
+                while not self.pause_flag.is_set():
+                    self.state_changed.wait()
+            finally:
+                build_scheduler.resume(self.project_id)
     
-    def _should_stop(self):
-        """Verifica si se debe detener la construcción."""
-        return not self.pause_flag.is_set()
+    def _publish_pause_state(self):
+        """Publica el estado de pausa o reanudación (llamar con self.lock tomado)."""
+        progress = dict(self._published_progress or {})
+        if progress.get('status') in ('completed', 'error'):
+            return
+        progress['status'] = 'active' if self.pause_flag.is_set() else 'paused'
+        if progress != self._published_progress:
+            self._published_progress = progress
+            constructor_events.publish(self.project_id, constructor_events.EVENT_PROGRESS, progress)
     
     def pause(self):
         """Pausa la construcción."""
-        self.pause_flag.clear()
+        with self.state_changed:
+            self.pause_flag.clear()
+            self.state_changed.notify_all()
+            self._publish_pause_state()
         # Actualizar estado en la base de datos
         db = get_db_session()
-        project = db.query(Project).filter_by(project_id=self.project_id).first()
-        if project:
-            project.pause()
-            db.commit()
+        try:
+            project = db.query(Project).filter_by(project_id=self.project_id).first()
+            if project:
+                project.pause()
+                db.commit()
+        finally:
+            db.close()
     
     def resume(self):
         """Reanuda la construcción."""
-        self.pause_flag.set()
+        with self.state_changed:
+            self.pause_flag.set()
+            self.state_changed.notify_all()
+            self._publish_pause_state()
         # Actualizar estado en la base de datos
         db = get_db_session()
-        project = db.query(Project).filter_by(project_id=self.project_id).first()
-        if project:
-            project.resume()
-            db.commit()
+        try:
+            project = db.query(Project).filter_by(project_id=self.project_id).first()
+            if project:
+                project.resume()
+                db.commit()
+        finally:
+            db.close()
     
     def _cleanup(self):
         """Limpia los recursos asociados al proyecto."""
         project_id = self.project_id
+        if self.write_stats['writes']:
+            logger.info(f"Proyecto {project_id}: {self.write_stats['writes']} escrituras agrupadas "
+                        f"en {self.write_stats['commits']} commits")
         if project_id in active_projects:
             del active_projects[project_id]
         if project_id in pause_flags:
             del pause_flags[project_id]
         if project_id in project_locks:
             del project_locks[project_id]
+        # Liberar la sesión de base de datos de este hilo
+        self.db = None
+        remove_db_session()
+        # Avisar a los clientes que siguen la construcción de que ha terminado
+        constructor_events.publish(project_id, constructor_events.EVENT_END,
+                                   {'status': (self._published_progress or {}).get('status')})
     
     def _extract_project_name(self, description):
         """Extrae un nombre para el proyecto a partir de la descripción."""
@@ -1611,17 +1750,16 @@ A continuación te presentaré un plan detallado de desarrollo para que puedas r
 """
         return plan
     
-    def _switch_agent(self, db, agent_id):
+    def _switch_agent(self, agent_id):
         """
-        Cambia el agente activo y actualiza el proyecto en la base de datos.
-        Usa el decorador db_operation para manejo robusto de la sesión.
+        Cambia el agente activo del proyecto que se está construyendo.
+        El cambio se confirma con el siguiente lote de escrituras.
         
         Args:
-            db: Sesión de base de datos (proporcionada por el decorador)
             agent_id: ID del agente al que cambiar (architect, developer, testing, fixing)
         """
         # Verificar si el método se llama antes de crear el proyecto
-        if not hasattr(self, 'project_id') or not self.project_id:
+        if self.project is None:
             logger.warning("Intento de cambio de agente antes de inicializar el proyecto")
             return False
             
@@ -1631,32 +1769,21 @@ A continuación te presentaré un plan detallado de desarrollo para que puedas r
             return False
         
         # Actualizar el agente actual
-        project = db.query(Project).filter_by(project_id=self.project_id).first()
+        with self.lock:
+            self.project.current_agent = agent_id
+        self._queue_write()
         
-        if project:
-            with self.lock:
-                project.current_agent = agent_id
-                db.commit()
-            
-            # Enviar notificación sobre el cambio de agente
-            session = db.query(ProjectSession).filter_by(project_id=project.project_id).first()
-            if session:
-                self._send_notification(
-                    project, 
-                    session, 
-                    f"Agente Cambiado", 
-                    f"Ahora el agente '{agent_id}' está trabajando en el proyecto", 
-                    "info"
-                )
-            else:
-                logger.warning(f"No se encontró sesión para el proyecto {project.project_id} al cambiar agente")
-            
-            logger.info(f"Cambiado agente a: {agent_id} para el proyecto {project.project_id}")
-            return True
-        else:
-            logger.warning(f"No se encontró el proyecto con ID {self.project_id} al cambiar agente")
+        # Enviar notificación sobre el cambio de agente
+        self._send_notification(
+            self.project, 
+            self.session, 
+            f"Agente Cambiado", 
+            f"Ahora el agente '{agent_id}' está trabajando en el proyecto", 
+            "info"
+        )
         
-        return False
+        logger.info(f"Cambiado agente a: {agent_id} para el proyecto {self.project_id}")
+        return True
     
     def _plan_project_structure(self, project_type, tech_stack):
         """
@@ -1779,10 +1906,13 @@ A continuación te presentaré un plan detallado de desarrollo para que puedas r
         
         return result
     
-    def _generate_file_content(self, file_path, project_type, tech_stack):
+    def _generate_file_content(self, file_path, project_type, tech_stack, context=None):
         """
         Genera el contenido para un archivo específico basado en su tipo.
-        En un entorno real, esto utilizaría una llamada a la IA.
+        En un entorno real, esto utilizaría una llamada a la IA, a la que se pasaría como
+        contexto el contenido de los archivos de los que depende (context: ruta -> contenido).
+        
+        Se llama desde los hilos del pool de generación, así que no debe usar la sesión de BD.
         """
         filename = os.path.basename(file_path)
         extension = os.path.splitext(filename)[1].lower()
@@ -2076,10 +2206,30 @@ class Config:
             return "# Instrucciones específicas no disponibles para este tipo de proyecto"
 
 
+def _run_build_job(job):
+    """Ejecuta un trabajo del planificador de construcciones (en un hilo trabajador)."""
+    builder = AutonomousBuilder(job['job_id'], job['user_id'])
+    builder.build(job['description'], job['config'])
+
+
 # Rutas para gestión de proyectos del constructor
 def init_constructor_routes(app):
     """Inicializa las rutas del Constructor de Tareas."""
     
+    # Crear el motor y las tablas al arrancar, no en la primera petición
+    try:
+        get_engine()
+    except Exception as e:
+        logger.error(f"Error al inicializar la base de datos del Constructor: {str(e)}")
+    
+    # Arrancar el pool de constructores y reanudar las construcciones pendientes
+    build_scheduler.start(_run_build_job)
+    
+    @app.teardown_appcontext
+    def remove_constructor_db_session(exception=None):
+        """Devuelve al pool la conexión de la sesión usada en la petición."""
+        remove_db_session()
+    
     @app.route('/api/constructor/projects', methods=['GET'])
     def list_projects():
         """Lista todos los proyectos del usuario."""
@@ -2110,6 +2260,19 @@ def init_constructor_routes(app):
             project = db.query(Project).filter_by(project_id=project_id).first()
             
             if not project:
+                # El proyecto aún no existe en la BD mientras su construcción espera en cola
+                job = build_scheduler.get_job(project_id)
+                if job and job['status'] == build_scheduler.JOB_QUEUED:
+                    return jsonify({
+                        'success': True,
+                        'project': {
+                            'project_id': project_id,
+                            'status': 'queued',
+                            'phase': 'queued',
+                            'progress': 0,
+                            'queue': job
+                        }
+                    })
                 return jsonify({
                     'success': False,
                     'error': 'Proyecto no encontrado'
@@ -2133,6 +2296,63 @@ def init_constructor_routes(app):
                 'error': str(e)
             }), 500
     
+    @app.route('/api/constructor/projects/<project_id>/events', methods=['GET'])
+    def project_events(project_id):
+        """
+        Devuelve los eventos de progreso de una construcción posteriores a 'since'.
+        
+        Permite reanudar el seguimiento tras una desconexión sin volver a consultar el
+        proyecto; si 'complete' es False se han perdido eventos y conviene recargarlo.
+        """
+        result = constructor_events.get_events(project_id, request.args.get('since', 0, type=int))
+        if result is None:
+            return jsonify({
+                'success': False,
+                'error': 'No hay eventos para este proyecto'
+            }), 404
+        return jsonify({'success': True, **result})
+    
+    @app.route('/api/constructor/projects/<project_id>/stream', methods=['GET'])
+    def stream_project(project_id):
+        """
+        Sigue el progreso de una construcción en directo mediante Server-Sent Events.
+        
+        Cada evento (progress, message, notification y, al terminar, end) lleva su número
+        de secuencia como id, de modo que al reconectar (cabecera Last-Event-ID o parámetro
+        since) se continúa donde se quedó. Requiere un worker con hilos o asíncrono
+        (gunicorn.conf.py usa gthread); los eventos son propios de cada proceso.
+        """
+        if constructor_events.get_events(project_id) is None and build_scheduler.get_job(project_id) is None:
+            return jsonify({
+                'success': False,
+                'error': 'No hay una construcción en curso para este proyecto'
+            }), 404
+        
+        since = request.headers.get('Last-Event-ID', type=int)
+        if since is None:
+            since = request.args.get('since', 0, type=int)
+        
+        # Cada respuesta dura como mucho CONSTRUCTOR_STREAM_MAX_SECONDS: así una pestaña
+        # abandonada no retiene su hilo y EventSource reconecta con Last-Event-ID
+        deadline = time.monotonic() + _env_int('CONSTRUCTOR_STREAM_MAX_SECONDS', 300)
+        
+        def event_stream():
+            yield "retry: 1000\n\n"
+            for record in constructor_events.iter_events(project_id, since=since):
+                if time.monotonic() >= deadline:
+                    return
+                if record is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield (f"id: {record['seq']}\nevent: {record['event']}\n"
+                           f"data: {json.dumps(record['data'], ensure_ascii=False, default=str)}\n\n")
+        
+        return Response(
+            stream_with_context(event_stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
     @app.route('/api/constructor/start', methods=['POST'])
     def start_project():
         """Inicia un nuevo proyecto de construcción."""
@@ -2155,6 +2375,14 @@ def init_constructor_routes(app):
                     'error': 'Se requiere una descripción del proyecto'
                 }), 400
             
+            try:
+                priority = int(data.get('priority', build_scheduler.DEFAULT_PRIORITY))
+            except (TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': 'La prioridad debe ser un número entero'
+                }), 400
+            
             # Validar el modelo seleccionado
             valid_models = ['openai', 'anthropic', 'gemini']
             if model not in valid_models:
@@ -2170,15 +2398,30 @@ def init_constructor_routes(app):
                 'development_speed': development_speed
             }
             
-            # Iniciar el constructor autónomo con la configuración
-            builder = AutonomousBuilder(project_id, user_id)
-            builder.start_building(description, config)
+            # Publicar el estado inicial antes de encolar para que preceda a los eventos del constructor
+            constructor_events.publish(project_id, constructor_events.EVENT_PROGRESS, {
+                'status': 'queued',
+                'phase': 'queued',
+                'progress': 0
+            })
+            
+            # Encolar la construcción: el planificador la ejecutará cuando haya un constructor libre
+            try:
+                job = build_scheduler.submit(project_id, user_id, description, config, priority)
+            except build_scheduler.BuildQueueFullError as e:
+                constructor_events.publish(project_id, constructor_events.EVENT_END, {'status': 'rejected'})
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                    'queue_depth': build_scheduler.get_metrics()['queue_depth']
+                }), 429
             
             return jsonify({
                 'success': True,
                 'project_id': project_id,
-                'message': 'Construcción del proyecto iniciada correctamente',
-                'config': config
+                'message': 'Construcción del proyecto encolada correctamente',
+                'config': config,
+                'queue': job
             })
         except Exception as e:
             logger.error(f"Error al iniciar proyecto: {str(e)}")
@@ -2187,6 +2430,30 @@ def init_constructor_routes(app):
                 'error': str(e)
             }), 500
     
+    @app.route('/api/constructor/queue', methods=['GET'])
+    def build_queue():
+        """Construcciones en cola y en curso (de un usuario, si se indica) y métricas del planificador."""
+        user_id = request.args.get('user_id')
+        return jsonify({
+            'success': True,
+            'jobs': build_scheduler.list_jobs(user_id),
+            'metrics': build_scheduler.get_metrics()
+        })
+    
+    @app.route('/api/constructor/queue/<project_id>/cancel', methods=['POST'])
+    def cancel_queued_build(project_id):
+        """Cancela una construcción que todavía no ha empezado."""
+        if not build_scheduler.cancel(project_id):
+            return jsonify({
+                'success': False,
+                'error': 'La construcción no está en cola'
+            }), 409
+        constructor_events.publish(project_id, constructor_events.EVENT_END, {'status': 'cancelled'})
+        return jsonify({
+            'success': True,
+            'message': 'Construcción cancelada'
+        })
+    
     @app.route('/api/constructor/pause/<project_id>', methods=['POST'])
     def pause_project(project_id):
         """Pausa la construcción de un proyecto."""
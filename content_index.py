@@ -0,0 +1,491 @@
+"""
+Índice de trigramas para la búsqueda por contenido en los espacios de trabajo.
+Cada directorio raíz (normalmente un workspace) tiene un índice que asocia cada trigrama
+del texto en minúsculas con los archivos que lo contienen. Las búsquedas filtran primero
+los archivos candidatos con el índice y solo leen esos archivos para verificar la
+coincidencia, en lugar de leer el árbol completo en cada consulta.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# Extensiones de archivo que se consideran texto para la búsqueda por contenido
+TEXT_EXTENSIONS = frozenset([
+    '.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv', '.ts', '.jsx',
+    '.tsx', '.vue', '.php', '.java', '.c', '.cpp', '.h', '.sh', '.bat'
+])
+
+# Directorios que no se indexan (metadatos de git y cachés propias)
+SKIPPED_DIRECTORIES = frozenset(['.git', '.content_index', '.extraction_cache', '__pycache__'])
+
+# Los archivos más grandes no se indexan, pero siempre se verifican como candidatos
+MAX_INDEXED_FILE_SIZE = 2 * 1024 * 1024
+
+# Versión del formato guardado (JSON: el índice está bajo user_workspaces y no debe
+# poder ejecutar código al cargarse)
+INDEX_VERSION = 2
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _read_text(path: str) -> Optional[str]:
+    """Lee un archivo de texto en UTF-8, o devuelve None si no es texto legible."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return file.read()
+    except (UnicodeDecodeError, PermissionError, FileNotFoundError, IsADirectoryError):
+        return None
+    except Exception as e:
+        logger.warning(f"Error al leer archivo {path}: {str(e)}")
+        return None
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    Extrae de una expresión regular los literales que toda coincidencia debe contener.
+
+    Solo se analizan las secuencias de caracteres literales del nivel superior; si la
+    expresión tiene alternativas en ese nivel no se puede exigir ningún literal.
+
+    Returns:
+        list: Literales (en minúsculas) de al menos 3 caracteres
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+
+    if any(op == sre_parse.BRANCH for op, _ in parsed):
+        return []
+
+    literals = []
+    current = []
+    for op, value in parsed:
+        if op == sre_parse.LITERAL:
+            current.append(chr(value))
+            continue
+        if len(current) >= 3:
+            literals.append(''.join(current).lower())
+        current = []
+    if len(current) >= 3:
+        literals.append(''.join(current).lower())
+    return literals
+
+
+class ContentIndex:
+    """Índice de trigramas de los archivos de texto bajo un directorio raíz."""
+
+    def __init__(self, root: str, storage_dir: Optional[str] = None):
+        """
+        Inicializa el índice (se construye en segundo plano con ensure_ready).
+
+        Args:
+            root: Directorio raíz a indexar
+            storage_dir: Directorio donde persistir el índice (opcional)
+        """
+        self.root = os.path.abspath(root)
+        self.storage_path = None
+        if storage_dir:
+            digest = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+            self.storage_path = os.path.join(storage_dir, f"{digest}.json")
+
+        self._lock = threading.RLock()
+        self._files = {}        # ruta relativa -> (file_id o None, mtime, size)
+        self._paths = {}        # file_id -> ruta relativa (solo archivos vivos)
+        self._postings = {}     # trigrama -> set de file_id
+        self._unindexed = set() # file_id de archivos demasiado grandes para indexar
+        self._next_id = 0
+        self._stale_ids = 0
+        self._ready = threading.Event()
+        self._build_thread = None
+        self._scan_thread = None
+        self._last_scan = 0.0
+        self._dirty = False
+        self._last_save = 0.0
+        self._save_timer = None
+
+    # -- Construcción y mantenimiento -------------------------------------------------
+
+    def ensure_ready(self):
+        """Arranca la carga o construcción del índice en segundo plano si no se ha hecho."""
+        with self._lock:
+            if self._build_thread is None:
+                self._build_thread = threading.Thread(target=self._build, name="content-index-build", daemon=True)
+                self._build_thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        self.ensure_ready()
+        return self._ready.wait(timeout)
+
+    def _build(self):
+        start = time.time()
+        loaded = self._load()
+        self.scan()
+        self._ready.set()
+        self._save()
+        logger.info(f"Índice de contenido de {self.root} {'actualizado' if loaded else 'construido'}: "
+                    f"{len(self._paths)} archivos en {time.time() - start:.1f}s")
+
+    def _iter_text_files(self, directory: str):
+        """Recorre los archivos de texto bajo un directorio devolviendo (ruta relativa, stat)."""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in SKIPPED_DIRECTORIES:
+                                    stack.append(entry.path)
+                            elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in TEXT_EXTENSIONS:
+                                yield os.path.relpath(entry.path, self.root), entry.stat()
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def scan(self, directory: Optional[str] = None):
+        """
+        Sincroniza el índice con el disco comparando tamaño y fecha de modificación.
+
+        Solo se vuelven a leer los archivos nuevos o modificados.
+
+        Args:
+            directory: Subdirectorio a sincronizar (por defecto, toda la raíz)
+        """
+        directory = os.path.abspath(directory or self.root)
+        prefix = os.path.relpath(directory, self.root)
+        prefix = '' if prefix == '.' else prefix + os.sep
+
+        seen = set()
+        for relative_path, stat in self._iter_text_files(directory):
+            seen.add(relative_path)
+            with self._lock:
+                known = self._files.get(relative_path)
+            if known is None or known[1] != stat.st_mtime or known[2] != stat.st_size:
+                self._index_file(relative_path, stat)
+
+        with self._lock:
+            missing = [path for path in self._files if path.startswith(prefix) and path not in seen]
+            for relative_path in missing:
+                self._remove_file(relative_path)
+            if not prefix:
+                self._last_scan = time.time()
+            self._compact_if_needed()
+
+    def _index_file(self, relative_path: str, stat):
+        """Lee un archivo y lo (re)indexa. Debe llamarse sin mantener el lock durante la lectura."""
+        text = None
+        if stat.st_size <= MAX_INDEXED_FILE_SIZE:
+            text = _read_text(os.path.join(self.root, relative_path))
+        trigrams = _trigrams(text.lower()) if text is not None else None
+
+        with self._lock:
+            self._remove_file(relative_path)
+            if text is None and stat.st_size <= MAX_INDEXED_FILE_SIZE:
+                # Archivo binario o ilegible: se recuerda para no releerlo, pero no es buscable
+                self._files[relative_path] = (None, stat.st_mtime, stat.st_size)
+                return
+            file_id = self._next_id
+            self._next_id += 1
+            self._files[relative_path] = (file_id, stat.st_mtime, stat.st_size)
+            self._paths[file_id] = relative_path
+            if trigrams is None:
+                self._unindexed.add(file_id)
+            else:
+                for trigram in trigrams:
+                    posting = self._postings.get(trigram)
+                    if posting is None:
+                        self._postings[trigram] = {file_id}
+                    else:
+                        posting.add(file_id)
+            self._dirty = True
+
+    def _remove_file(self, relative_path: str):
+        known = self._files.pop(relative_path, None)
+        if known is None:
+            return
+        file_id = known[0]
+        if file_id is not None:
+            # Las listas de trigramas conservan el id hasta la siguiente compactación
+            self._paths.pop(file_id, None)
+            self._unindexed.discard(file_id)
+            self._stale_ids += 1
+        self._dirty = True
+
+    def _compact_if_needed(self):
+        if self._stale_ids <= max(1000, len(self._paths) // 2):
+            return
+        live = self._paths.keys()
+        compacted = {}
+        for trigram, posting in self._postings.items():
+            posting.intersection_update(live)
+            if posting:
+                compacted[trigram] = posting
+        self._postings = compacted
+        self._stale_ids = 0
+
+    def update_path(self, path: str):
+        """
+        Actualiza el índice tras un cambio en un archivo o directorio.
+
+        Args:
+            path: Ruta (absoluta o relativa al directorio actual) que ha cambiado
+        """
+        absolute = os.path.abspath(path)
+        relative_path = os.path.relpath(absolute, self.root)
+        if relative_path.startswith(os.pardir):
+            return
+
+        if os.path.isdir(absolute):
+            self.scan(absolute)
+        elif os.path.isfile(absolute):
+            if os.path.splitext(absolute)[1].lower() in TEXT_EXTENSIONS:
+                self._index_file(relative_path, os.stat(absolute))
+        else:
+            prefix = relative_path + os.sep
+            with self._lock:
+                for known in [p for p in self._files if p == relative_path or p.startswith(prefix)]:
+                    self._remove_file(known)
+        self._schedule_save()
+
+    def _maybe_rescan(self):
+        """Lanza una sincronización en segundo plano si la última es antigua."""
+        interval = _env_int('CONTENT_INDEX_RESCAN_SECONDS', 60)
+        with self._lock:
+            if time.time() - self._last_scan < interval:
+                return
+            if self._scan_thread is not None and self._scan_thread.is_alive():
+                return
+            self._last_scan = time.time()
+            self._scan_thread = threading.Thread(target=self._rescan, name="content-index-scan", daemon=True)
+            self._scan_thread.start()
+
+    def _rescan(self):
+        self.scan()
+        self._save()
+
+    # -- Persistencia ----------------------------------------------------------------
+
+    def _load(self) -> bool:
+        if not self.storage_path or not os.path.exists(self.storage_path):
+            return False
+        try:
+            with open(self.storage_path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') != INDEX_VERSION or data.get('root') != self.root:
+                return False
+            files = {
+                path: (None if file_id is None else int(file_id), float(mtime), int(size))
+                for path, (file_id, mtime, size) in data['files'].items()
+            }
+            paths = {int(file_id): path for file_id, path in data['paths'].items()}
+            postings = {trigram: set(map(int, ids)) for trigram, ids in data['postings'].items()}
+            unindexed = set(map(int, data['unindexed']))
+            next_id = int(data['next_id'])
+            with self._lock:
+                self._files = files
+                self._paths = paths
+                self._postings = postings
+                self._unindexed = unindexed
+                self._next_id = next_id
+            return True
+        except Exception as e:
+            logger.warning(f"No se pudo cargar el índice de contenido {self.storage_path}: {str(e)}")
+            return False
+
+    def _save(self):
+        if not self.storage_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._compact_if_needed()
+            data = json.dumps({
+                'version': INDEX_VERSION,
+                'root': self.root,
+                'files': self._files,
+                'paths': self._paths,
+                'postings': {trigram: list(posting) for trigram, posting in self._postings.items()},
+                'unindexed': list(self._unindexed),
+                'next_id': self._next_id
+            }, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
+            temp_path = f"{self.storage_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(data)
+            os.replace(temp_path, self.storage_path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el índice de contenido {self.storage_path}: {str(e)}")
+
+    def _schedule_save(self):
+        """Guarda el índice como mucho una vez cada 30 segundos tras cambios incrementales."""
+        with self._lock:
+            if self._save_timer is not None and self._save_timer.is_alive():
+                return
+            delay = max(0.0, 30.0 - (time.time() - self._last_save))
+            self._save_timer = threading.Timer(delay, self._save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    # -- Búsqueda --------------------------------------------------------------------
+
+    def _candidates(self, literals: List[str], prefix: str) -> Optional[List[str]]:
+        """Devuelve las rutas relativas candidatas, o None si el índice no puede filtrar."""
+        trigrams = set()
+        for literal in literals:
+            trigrams |= _trigrams(literal)
+        if not trigrams:
+            return None
+
+        with self._lock:
+            postings = []
+            for trigram in trigrams:
+                posting = self._postings.get(trigram)
+                if not posting:
+                    postings = []
+                    break
+                postings.append(posting)
+            ids = set.intersection(*sorted(postings, key=len)) if postings else set()
+            ids |= self._unindexed
+            paths = [self._paths[file_id] for file_id in ids if file_id in self._paths]
+        return [path for path in paths if path.startswith(prefix)]
+
+    def search(self, query: str, base_path: str = '', regex: bool = False) -> List[str]:
+        """
+        Busca archivos cuyo contenido contiene un texto (sin distinguir mayúsculas) o
+        coincide con una expresión regular.
+
+        Mientras el índice se construye, la búsqueda recorre el árbol como antes.
+
+        Args:
+            query: Texto o expresión regular a buscar
+            base_path: Subdirectorio (relativo a la raíz) donde buscar
+            regex: Si es True, query es una expresión regular
+
+        Returns:
+            list: Rutas relativas a la raíz de los archivos que coinciden, ordenadas
+        """
+        if regex:
+            pattern = re.compile(query, re.IGNORECASE | re.MULTILINE)
+            literals = required_literals(query)
+            matches = lambda text: pattern.search(text) is not None
+        else:
+            needle = query.lower()
+            literals = [needle]
+            matches = lambda text: needle in text.lower()
+
+        base_path = os.path.normpath(base_path or '.')
+        prefix = '' if base_path == '.' else base_path + os.sep
+
+        self.ensure_ready()
+        if self.ready:
+            self._maybe_rescan()
+            candidates = self._candidates(literals, prefix)
+            if candidates is None:
+                with self._lock:
+                    candidates = [path for path in self._paths.values() if path.startswith(prefix)]
+        else:
+            candidates = [
+                relative_path
+                for relative_path, _ in self._iter_text_files(os.path.join(self.root, base_path))
+            ]
+
+        results = []
+        for relative_path in candidates:
+            text = _read_text(os.path.join(self.root, relative_path))
+            if text is not None and matches(text):
+                results.append(relative_path)
+        return sorted(results)
+
+    def stats(self) -> Dict:
+        """Devuelve el tamaño y el estado del índice."""
+        with self._lock:
+            return {
+                'root': self.root,
+                'ready': self.ready,
+                'files': len(self._paths),
+                'trigrams': len(self._postings),
+                'unindexed_large_files': len(self._unindexed),
+                'last_scan': self._last_scan
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_storage_dir():
+    return os.environ.get('CONTENT_INDEX_DIR', os.path.join('user_workspaces', '.content_index'))
+
+
+def get_content_index(root: str) -> ContentIndex:
+    """Obtiene (o crea) el índice de contenido de un directorio raíz."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = ContentIndex(root, _get_storage_dir())
+            _indexes[root] = index
+    index.ensure_ready()
+    return index
+
+
+def find_content_index(path: str) -> ContentIndex:
+    """Devuelve el índice existente que cubre una ruta o, si no hay ninguno, crea uno para ella."""
+    absolute = os.path.abspath(path)
+    with _indexes_lock:
+        for root, index in _indexes.items():
+            if absolute == root or absolute.startswith(root + os.sep):
+                return index
+    return get_content_index(absolute)
+
+
+def notify_path_changed(path: str):
+    """
+    Informa de que un archivo o directorio se ha creado, modificado o eliminado.
+
+    Actualiza todos los índices que cubren la ruta; si no hay ninguno no hace nada.
+    """
+    absolute = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = [
+            index for root, index in _indexes.items()
+            if absolute == root or absolute.startswith(root + os.sep)
+        ]
+    for index in indexes:
+        if not index.ready:
+            continue
+        try:
+            index.update_path(absolute)
+        except Exception as e:
+            logger.warning(f"Error al actualizar el índice de contenido para {path}: {str(e)}")
@@ -0,0 +1,187 @@
+"""
+Gestión de la ventana de contexto de las conversaciones para Codestorm Assistant.
+Cuenta tokens por proveedor, mantiene una ventana con los turnos más recientes y
+resume de forma incremental los turnos antiguos, guardando el resumen en el almacén
+de conversaciones para que el coste de cada turno no crezca con la longitud del chat.
+"""
+import os
+import logging
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Caracteres por token aproximados cuando no hay tokenizador exacto disponible
+CHARS_PER_TOKEN = {
+    "openai": 4.0,
+    "anthropic": 3.5,
+    "gemini": 4.0
+}
+
+# Tokens extra por mensaje (rol, separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Mínimo de mensajes recientes que siempre se conservan literalmente
+MIN_RECENT_MESSAGES = 2
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def _get_openai_encoder():
+    global _encoder
+    if tiktoken is None:
+        return None
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                _encoder = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                logger.warning(f"No se pudo cargar el tokenizador de OpenAI: {str(e)}")
+                return None
+        return _encoder
+
+
+def count_tokens(text, provider="openai"):
+    """
+    Cuenta (o estima) los tokens de un texto para un proveedor.
+
+    Args:
+        text: Texto a medir
+        provider: Proveedor de IA (openai, anthropic, gemini)
+
+    Returns:
+        int: Número de tokens
+    """
+    if not text:
+        return 0
+    if provider == "openai":
+        encoder = _get_openai_encoder()
+        if encoder is not None:
+            return len(encoder.encode(text, disallowed_special=()))
+    return int(len(text) / CHARS_PER_TOKEN.get(provider, 4.0)) + 1
+
+
+def count_message_tokens(message, provider="openai"):
+    """Cuenta los tokens de un mensaje de la conversación."""
+    return count_tokens(message.get('content', ''), provider) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_history_token_budget():
+    """Presupuesto de tokens para el historial literal (AI_CONTEXT_MAX_TOKENS)."""
+    try:
+        return int(os.environ.get('AI_CONTEXT_MAX_TOKENS', 3000))
+    except ValueError:
+        return 3000
+
+
+def _fit_recent(messages, provider, budget):
+    """Devuelve el índice desde el que los mensajes más recientes caben en el presupuesto."""
+    total = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        tokens = count_message_tokens(messages[index], provider)
+        if total + tokens > budget and len(messages) - index > MIN_RECENT_MESSAGES:
+            break
+        total += tokens
+        start = index
+    return start
+
+
+def summarize_messages(previous_summary, messages, model="openai", agent_name="Asistente"):
+    """
+    Actualiza el resumen de una conversación con nuevos mensajes.
+
+    Args:
+        previous_summary: Resumen acumulado hasta ahora (puede estar vacío)
+        messages: Mensajes nuevos a incorporar al resumen
+        model: Modelo de IA a utilizar
+        agent_name: Nombre del agente para etiquetar sus respuestas
+
+    Returns:
+        str: Resumen actualizado
+    """
+    # Importar aquí para evitar problemas de importación circular
+    from agents_utils import generate_content
+
+    transcript = "\n".join(
+        f"{'Usuario' if msg.get('role') == 'user' else agent_name}: {msg.get('content', '')}"
+        for msg in messages
+    )
+    system_prompt = """Eres un asistente que resume conversaciones técnicas de forma fiel y compacta.
+Conserva decisiones tomadas, requisitos, nombres de archivos, fragmentos de código relevantes y preguntas pendientes.
+No inventes información. Responde solo con el resumen, en español, en menos de 300 palabras."""
+    prompt = f"""Resumen previo de la conversación:
+{previous_summary or '(sin resumen previo)'}
+
+Nuevos mensajes a incorporar:
+{transcript}
+
+Devuelve el resumen actualizado que combine el resumen previo y los nuevos mensajes."""
+    return generate_content(prompt, system_prompt, model, temperature=0.2).strip()
+
+
+def prepare_context(context, model="openai", conversation_id=None, agent_name="Asistente", max_tokens=None):
+    """
+    Ajusta el historial de una conversación al presupuesto de tokens.
+
+    Los mensajes recientes se conservan literalmente mientras quepan en el presupuesto.
+    Con conversation_id, los mensajes que salen de la ventana se incorporan al resumen
+    guardado de la conversación; cuando la ventana se desborda se desplaza hasta la
+    mitad del presupuesto, de modo que el resumen solo se regenera de vez en cuando.
+    Sin conversation_id, los mensajes antiguos simplemente se descartan.
+
+    Args:
+        context: Lista de mensajes {'role', 'content'} en orden cronológico
+        model: Proveedor de IA para el que se cuentan los tokens
+        conversation_id: Identificador de la conversación (opcional)
+        agent_name: Nombre del agente, usado al resumir
+        max_tokens: Presupuesto de tokens para el historial literal (opcional)
+
+    Returns:
+        dict: {'summary': str o None, 'messages': lista de mensajes recientes,
+               'omitted': número de mensajes que no se envían literalmente}
+    """
+    messages = [msg for msg in (context or []) if msg.get('content')]
+    budget = max_tokens or get_history_token_budget()
+
+    if not conversation_id:
+        start = _fit_recent(messages, model, budget)
+        if start:
+            logger.info(f"Historial recortado: se omiten {start} mensajes antiguos")
+        return {'summary': None, 'messages': messages[start:], 'omitted': start}
+
+    # Importar aquí para evitar problemas de importación circular
+    from conversation_store import get_conversation_store
+    store = get_conversation_store()
+
+    state = store.get_summary(conversation_id)
+    summary = state['summary']
+    boundary = state['summarized_count']
+
+    # Si el cliente ha reiniciado la conversación, descartar el resumen anterior
+    if boundary > len(messages):
+        summary, boundary = '', 0
+
+    recent = messages[boundary:]
+    recent_tokens = sum(count_message_tokens(msg, model) for msg in recent)
+
+    if recent_tokens > budget:
+        new_boundary = boundary + _fit_recent(recent, model, budget // 2)
+        to_summarize = messages[boundary:new_boundary]
+        if to_summarize:
+            try:
+                summary = summarize_messages(summary, to_summarize, model, agent_name)
+                boundary = new_boundary
+                store.set_summary(conversation_id, summary, boundary)
+                logger.info(f"Resumen de la conversación {conversation_id} actualizado ({boundary} mensajes resumidos)")
+            except Exception as e:
+                logger.error(f"Error al resumir la conversación {conversation_id}: {str(e)}")
+                start = boundary + _fit_recent(messages[boundary:], model, budget)
+                return {'summary': summary or None, 'messages': messages[start:], 'omitted': start}
+
+    return {'summary': summary or None, 'messages': messages[boundary:], 'omitted': boundary}
@@ -0,0 +1,363 @@
+"""
+Almacén de conversaciones en el servidor para Codestorm Assistant.
+Guarda los mensajes de cada conversación en la base de datos (SQLite o PostgreSQL según
+DATABASE_URL) con escrituras de solo añadido, y mantiene las conversaciones activas en una
+caché en memoria para que cada petición solo tenga que enviar el mensaje nuevo. Antes de
+usar una conversación de la caché se comprueba contra la base de datos que ningún otro
+proceso la ha modificado.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from models import db, Conversation, ConversationMessage
+
+logger = logging.getLogger(__name__)
+
+# Longitud máxima de un identificador de conversación (columna String(64))
+MAX_CONVERSATION_ID_LENGTH = 64
+
+
+def _empty_state():
+    return {
+        'messages': [],
+        'summary': '',
+        'summarized_count': 0,
+        'document': None,
+        # Versión en la base de datos: última posición y fecha de actualización de la fila
+        'last_position': None,
+        'updated_at': None
+    }
+
+
+class ConversationStore:
+    """Conversaciones persistidas en base de datos con una caché LRU en memoria."""
+
+    def __init__(self, database_url=None, max_cached=256):
+        """
+        Inicializa el almacén.
+
+        Args:
+            database_url: URL de SQLAlchemy de la base de datos (sin ella solo se usa memoria)
+            max_cached: Número máximo de conversaciones mantenidas en memoria
+        """
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._conversation_locks = {}
+        self._Session = None
+
+        if database_url:
+            try:
+                connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+                engine = create_engine(database_url, pool_pre_ping=True, connect_args=connect_args)
+                db.metadata.create_all(engine, tables=[Conversation.__table__, ConversationMessage.__table__])
+                self._Session = sessionmaker(bind=engine, expire_on_commit=False)
+            except Exception as e:
+                logger.error(f"No se pudo inicializar el almacén de conversaciones en base de datos: {str(e)}")
+                self._Session = None
+
+    @property
+    def persistent(self):
+        return self._Session is not None
+
+    def _conversation_lock(self, conversation_id):
+        with self._lock:
+            lock = self._conversation_locks.get(conversation_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._conversation_locks[conversation_id] = lock
+            return lock
+
+    def _remember(self, conversation_id, state):
+        with self._lock:
+            self._cache[conversation_id] = state
+            self._cache.move_to_end(conversation_id)
+            while len(self._cache) > self.max_cached:
+                evicted, _ = self._cache.popitem(last=False)
+                self._conversation_locks.pop(evicted, None)
+
+    def _forget(self, conversation_id):
+        with self._lock:
+            self._cache.pop(conversation_id, None)
+
+    def _is_current(self, conversation_id, state):
+        """Indica si el estado en caché coincide con la versión guardada en la base de datos."""
+        session = self._Session()
+        try:
+            # Una sola consulta: la fecha de la fila y la última posición (índice único)
+            last_position = (session.query(func.max(ConversationMessage.position))
+                             .filter(ConversationMessage.conversation_id == conversation_id)
+                             .scalar_subquery())
+            row = (session.query(Conversation.updated_at, last_position)
+                   .filter(Conversation.id == conversation_id)
+                   .first())
+            if row is None:
+                return state['updated_at'] is None and state['last_position'] is None
+            return row[0] == state['updated_at'] and row[1] == state['last_position']
+        except Exception as e:
+            # Sin poder comprobarla se trata como un fallo de caché
+            logger.warning(f"No se pudo comprobar la versión de la conversación {conversation_id}: {str(e)}")
+            return False
+        finally:
+            session.close()
+
+    def _load(self, conversation_id):
+        """Devuelve el estado de una conversación desde la caché o la base de datos."""
+        with self._lock:
+            state = self._cache.get(conversation_id)
+        if state is not None:
+            # Otro proceso puede haber añadido mensajes o cambiado el resumen
+            if not self.persistent or self._is_current(conversation_id, state):
+                with self._lock:
+                    if conversation_id in self._cache:
+                        self._cache.move_to_end(conversation_id)
+                return state
+
+        state = _empty_state()
+        if self.persistent:
+            session = self._Session()
+            try:
+                conversation = session.get(Conversation, conversation_id)
+                if conversation is not None:
+                    rows = (session.query(ConversationMessage)
+                            .filter_by(conversation_id=conversation_id)
+                            .order_by(ConversationMessage.position)
+                            .all())
+                    state['messages'] = [row.to_dict() for row in rows]
+                    state['last_position'] = rows[-1].position if rows else None
+                    state['updated_at'] = conversation.updated_at
+                    state['summary'] = conversation.summary or ''
+                    state['summarized_count'] = conversation.summarized_count or 0
+                    if conversation.document_content:
+                        state['document'] = {
+                            'source': conversation.document_source,
+                            'content': conversation.document_content,
+                            'word_count': len(conversation.document_content.split())
+                        }
+            except Exception as e:
+                logger.error(f"Error al cargar la conversación {conversation_id}: {str(e)}")
+            finally:
+                session.close()
+
+        self._remember(conversation_id, state)
+        return state
+
+    def _update_conversation(self, conversation_id, state, **fields):
+        """Crea o actualiza la fila de la conversación con los campos indicados."""
+        if not self.persistent:
+            return
+        session = self._Session()
+        try:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                conversation = Conversation(id=conversation_id)
+                session.add(conversation)
+            elif conversation.updated_at != state['updated_at']:
+                # Otro proceso la modificó: la próxima lectura la vuelve a cargar
+                self._forget(conversation_id)
+            for name, value in fields.items():
+                setattr(conversation, name, value)
+            session.commit()
+            state['updated_at'] = conversation.updated_at
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error al actualizar la conversación {conversation_id}: {str(e)}")
+        finally:
+            session.close()
+
+    def get_messages(self, conversation_id):
+        """
+        Obtiene los mensajes de una conversación en orden cronológico.
+
+        Returns:
+            list: Mensajes {'role', 'content'} (vacía si la conversación no existe)
+        """
+        state = self._load(conversation_id)
+        with self._conversation_lock(conversation_id):
+            return list(state['messages'])
+
+    def append_messages(self, conversation_id, messages, agent_id=None):
+        """
+        Añade mensajes al final de una conversación, creándola si no existe.
+
+        Los mensajes existentes nunca se reescriben: cada mensaje se inserta como una
+        fila nueva con la siguiente posición de la conversación.
+
+        Args:
+            conversation_id: Identificador de la conversación
+            messages: Lista de mensajes {'role', 'content'}
+            agent_id: Agente que participa en la conversación (opcional)
+        """
+        messages = [
+            {'role': msg.get('role', 'user'), 'content': msg.get('content', '')}
+            for msg in messages if msg.get('content')
+        ]
+        if not messages:
+            return
+
+        state = self._load(conversation_id)
+        with self._conversation_lock(conversation_id):
+            if self.persistent:
+                session = self._Session()
+                try:
+                    conversation = session.get(Conversation, conversation_id)
+                    if conversation is None:
+                        conversation = Conversation(id=conversation_id, agent_id=agent_id)
+                        session.add(conversation)
+                        session.flush()
+                    elif agent_id and conversation.agent_id != agent_id:
+                        conversation.agent_id = agent_id
+                    last_position = session.query(
+                        func.max(ConversationMessage.position)
+                    ).filter_by(conversation_id=conversation_id).scalar()
+                    if last_position != state['last_position'] or conversation.updated_at != state['updated_at']:
+                        # Otro proceso escribió desde que se cargó: la caché ya no vale
+                        self._forget(conversation_id)
+                    next_position = (last_position if last_position is not None else -1) + 1
+                    session.add_all([
+                        ConversationMessage(
+                            conversation_id=conversation_id,
+                            position=next_position + offset,
+                            role=msg['role'],
+                            content=msg['content'],
+                            agent_id=agent_id if msg['role'] == 'assistant' else None
+                        )
+                        for offset, msg in enumerate(messages)
+                    ])
+                    session.commit()
+                    state['last_position'] = next_position + len(messages) - 1
+                    state['updated_at'] = conversation.updated_at
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"Error al guardar mensajes de la conversación {conversation_id}: {str(e)}")
+                finally:
+                    session.close()
+            state['messages'].extend(messages)
+
+    def get_summary(self, conversation_id):
+        """
+        Devuelve el resumen guardado de una conversación.
+
+        Returns:
+            dict: {'summary': str, 'summarized_count': int}
+        """
+        state = self._load(conversation_id)
+        with self._conversation_lock(conversation_id):
+            return {'summary': state['summary'], 'summarized_count': state['summarized_count']}
+
+    def set_summary(self, conversation_id, summary, summarized_count):
+        """Guarda el resumen y cuántos mensajes iniciales cubre."""
+        state = self._load(conversation_id)
+        with self._conversation_lock(conversation_id):
+            state['summary'] = summary
+            state['summarized_count'] = summarized_count
+            self._update_conversation(conversation_id, state, summary=summary, summarized_count=summarized_count)
+
+    def get_document(self, conversation_id):
+        """
+        Devuelve el documento de contexto asociado a una conversación.
+
+        Returns:
+            dict o None: {'source', 'content', 'word_count'}
+        """
+        return self._load(conversation_id)['document']
+
+    def set_document(self, conversation_id, document_context):
+        """Asocia un documento de contexto ({'source', 'content'}) a una conversación."""
+        state = self._load(conversation_id)
+        with self._conversation_lock(conversation_id):
+            state['document'] = {
+                'source': document_context.get('source'),
+                'content': document_context.get('content', ''),
+                'word_count': document_context.get('word_count') or len(document_context.get('content', '').split())
+            }
+            self._update_conversation(
+                conversation_id,
+                state,
+                document_source=document_context.get('source'),
+                document_content=document_context.get('content', '')
+            )
+
+    def stats(self):
+        """Devuelve el estado del almacén."""
+        with self._lock:
+            return {
+                'cached_conversations': len(self._cache),
+                'max_cached': self.max_cached,
+                'persistent': self.persistent
+            }
+
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """
+    Obtiene el almacén de conversaciones compartido por el proceso.
+
+    Usa DATABASE_URL (por defecto sqlite:///codestorm.db) y CONVERSATION_CACHE_SIZE
+    para el número de conversaciones mantenidas en memoria.
+    """
+    global _conversation_store
+    with _conversation_store_lock:
+        if _conversation_store is None:
+            _conversation_store = ConversationStore(
+                database_url=os.environ.get('DATABASE_URL', 'sqlite:///codestorm.db'),
+                max_cached=int(os.environ.get('CONVERSATION_CACHE_SIZE', 256))
+            )
+        return _conversation_store
+
+
+def is_valid_conversation_id(conversation_id):
+    """Indica si un identificador de conversación es utilizable."""
+    return (isinstance(conversation_id, str) and 0 < len(conversation_id) <= MAX_CONVERSATION_ID_LENGTH)
+
+
+def load_history(conversation_id, client_context=None):
+    """
+    Obtiene el historial con el que responder a un mensaje nuevo.
+
+    Con un conversation_id válido se usa el historial guardado en el servidor; si la
+    conversación todavía no existe y el cliente envía su historial (clientes antiguos),
+    ese historial se guarda como punto de partida. Sin conversation_id se usa el
+    historial enviado por el cliente.
+
+    Args:
+        conversation_id: Identificador de la conversación (opcional)
+        client_context: Historial enviado por el cliente (opcional)
+
+    Returns:
+        list: Mensajes {'role', 'content'} en orden cronológico
+    """
+    client_context = [
+        msg for msg in (client_context or [])
+        if msg.get('role') != 'system' and msg.get('content')
+    ]
+    if not is_valid_conversation_id(conversation_id):
+        return client_context
+
+    store = get_conversation_store()
+    history = store.get_messages(conversation_id)
+    if not history and client_context:
+        store.append_messages(conversation_id, client_context)
+        history = store.get_messages(conversation_id)
+    return history
+
+
+def record_exchange(conversation_id, user_message, response, agent_id=None):
+    """Añade a la conversación el mensaje del usuario y la respuesta del asistente."""
+    if not is_valid_conversation_id(conversation_id):
+        return
+    get_conversation_store().append_messages(
+        conversation_id,
+        [
+            {'role': 'user', 'content': user_message},
+            {'role': 'assistant', 'content': response}
+        ],
+        agent_id=agent_id
+    )
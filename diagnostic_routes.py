@@ -9,6 +9,9 @@ import openai
 from openai import OpenAI
 from anthropic import Anthropic
 import google.generativeai as genai
+import ai_clients
+import provider_health
+from response_cache import get_response_cache
 
 def register_diagnostic_routes(app):
     """Registra las rutas de diagnóstico en la aplicación Flask."""
@@ -19,7 +22,7 @@ def register_diagnostic_routes(app):
         return jsonify({
             'status': 'ok', 
             'message': 'Aplicación funcionando correctamente',
-            'diagnostic_routes': ['health', 'api/test_apis']
+            'diagnostic_routes': ['health', 'api/test_apis', 'api/diagnostic/cache', 'api/diagnostic/clients']
         })
 
     @app.route('/api/test_apis', methods=['GET'])
@@ -134,4 +137,22 @@ def register_diagnostic_routes(app):
         else:
             results['status'] = 'all_failed'
         
-        return jsonify(results)
\ No newline at end of file
+        return jsonify(results)
+
+    @app.route('/api/diagnostic/cache', methods=['GET'])
+    def cache_stats():
+        """Devuelve los contadores de la caché de respuestas de IA."""
+        return jsonify({
+            'success': True,
+            'cache': get_response_cache().stats()
+        })
+
+    @app.route('/api/diagnostic/clients', methods=['GET'])
+    def clients_status():
+        """Devuelve el estado de los clientes de IA según la verificación en segundo plano."""
+        return jsonify({
+            'success': True,
+            'providers': ai_clients.get_client_status(),
+            'available': ai_clients.get_available_providers(),
+            'health': provider_health.get_health_report()
+        })
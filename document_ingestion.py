@@ -0,0 +1,161 @@
+"""
+Cola de ingesta de documentos para Codestorm Assistant.
+La extracción de texto (pypdf, BeautifulSoup, python-pptx...) se ejecuta en un pool de
+procesos para no bloquear los hilos que atienden peticiones y aprovechar todos los
+núcleos; cada documento subido es un trabajo cuyo estado se puede consultar.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import document_loader
+from job_registry import JobRegistry, JOB_QUEUED, JOB_PROCESSING, JOB_DONE, JOB_ERROR
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Futuros del pool por trabajo (protegidos por el lock del registro)
+_futures = {}
+_registry = JobRegistry(on_expire=lambda job_id: _futures.pop(job_id, None))
+
+
+def _get_worker_count():
+    try:
+        return max(1, int(os.environ.get('DOCUMENT_INGEST_WORKERS', os.cpu_count() or 1)))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def _get_executor(reset=False):
+    """Devuelve el pool de procesos de extracción, creándolo (o recreándolo) si hace falta."""
+    global _executor
+    with _executor_lock:
+        if reset and _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=False)
+            _executor = None
+        if _executor is None:
+            workers = _get_worker_count()
+            try:
+                _executor = ProcessPoolExecutor(max_workers=workers)
+                logger.info(f"Pool de ingesta de documentos iniciado con {workers} procesos")
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"No se pudo crear el pool de procesos, se usarán hilos: {str(e)}")
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="document-ingest")
+        return _executor
+
+
+def _extract_document(file_path):
+    """
+    Extrae el texto de un documento dentro de un proceso del pool.
+
+    El texto queda en la caché de extracción junto al documento; al proceso principal
+    solo vuelve el resumen.
+    """
+    return document_loader.get_document_summary(file_path)
+
+
+def _on_job_done(job_id, future):
+    try:
+        result = future.result()
+        error = None if result.get('success') else result.get('error', 'No se pudo procesar el documento')
+    except Exception as e:
+        result, error = None, str(e)
+        if isinstance(e, BrokenProcessPool):
+            _get_executor(reset=True)
+
+    with _registry.lock:
+        job = _registry.jobs.get(job_id)
+        _futures.pop(job_id, None)
+        if job is None:
+            return
+        job['finished_at'] = time.time()
+        if error:
+            job['status'] = JOB_ERROR
+            job['error'] = error
+            logger.warning(f"Error al procesar el documento {job['filename']}: {error}")
+        else:
+            job['status'] = JOB_DONE
+            job['word_count'] = result['total_words']
+            preview = result['text_preview']
+            job['preview'] = preview[:300] + '...' if len(preview) > 300 else preview
+            logger.info(f"Documento {job['filename']} procesado en {job['finished_at'] - job['created_at']:.1f}s")
+
+
+def submit(file_path, user_id='default'):
+    """
+    Encola la extracción de un documento ya guardado en disco.
+
+    Args:
+        file_path: Ruta al documento
+        user_id: ID del usuario propietario
+
+    Returns:
+        dict: Estado inicial del trabajo (incluye 'job_id')
+    """
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'filename': os.path.basename(file_path),
+        'path': file_path,
+        'user_id': user_id,
+        'status': JOB_QUEUED,
+        'word_count': None,
+        'preview': None,
+        'error': None,
+        'created_at': now,
+        'finished_at': None
+    }
+    _registry.add(job)
+
+    try:
+        future = _get_executor().submit(_extract_document, file_path)
+    except BrokenProcessPool:
+        future = _get_executor(reset=True).submit(_extract_document, file_path)
+
+    with _registry.lock:
+        _futures[job_id] = future
+    future.add_done_callback(lambda done: _on_job_done(job_id, done))
+    return get_job(job_id)
+
+
+def get_job(job_id):
+    """
+    Devuelve el estado de un trabajo de ingesta.
+
+    Returns:
+        dict o None: Copia del trabajo, o None si no existe
+    """
+    with _registry.lock:
+        job = _registry.jobs.get(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+        future = _futures.get(job_id)
+    if job['status'] == JOB_QUEUED and future is not None and future.running():
+        job['status'] = JOB_PROCESSING
+    return job
+
+
+def list_jobs(user_id=None, job_ids=None):
+    """Devuelve los trabajos de un usuario o con los IDs indicados, del más reciente al más antiguo."""
+    with _registry.lock:
+        candidates = list(_registry.jobs)
+    jobs = [get_job(job_id) for job_id in (job_ids or candidates)]
+    jobs = [job for job in jobs if job and (user_id is None or job['user_id'] == user_id)]
+    return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+
+def get_pending_job_for_path(file_path):
+    """Devuelve el trabajo pendiente de un documento, o None si no se está procesando."""
+    with _registry.lock:
+        job_ids = [
+            job_id for job_id, job in _registry.jobs.items()
+            if job['path'] == file_path and job['status'] == JOB_QUEUED
+        ]
+    return get_job(job_ids[-1]) if job_ids else None
@@ -5,9 +5,16 @@ Permite extraer texto de distintos tipos de archivos para proporcionar contexto
 
 import os
 import re
+import json
+import hashlib
 import logging
+import zipfile
+import posixpath
+import threading
+import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
+from urllib.parse import unquote
 
 # Importar librerías para procesamiento de diferentes tipos de documentos
 from bs4 import BeautifulSoup
@@ -20,6 +27,10 @@ from ebooklib import epub
 
 logger = logging.getLogger(__name__)
 
+# Espacios de nombres XML del contenedor y del paquete OPF de un EPUB
+EPUB_CONTAINER_NS = 'urn:oasis:names:tc:opendocument:xmlns:container'
+EPUB_OPF_NS = 'http://www.idpf.org/2007/opf'
+
 class DocumentLoader:
     """Clase para cargar y procesar documentos de diferentes formatos."""
     
@@ -40,153 +51,422 @@ class DocumentLoader:
             
         try:
             ext = os.path.splitext(file_path)[1].lower()
-            
-            if ext == '.pdf':
-                return DocumentLoader.extract_text_from_pdf(file_path)
-            elif ext in ['.docx', '.doc']:
-                return DocumentLoader.extract_text_from_docx(file_path)
-            elif ext in ['.html', '.htm']:
-                return DocumentLoader.extract_text_from_html(file_path)
-            elif ext == '.md':
-                return DocumentLoader.extract_text_from_markdown(file_path)
-            elif ext in ['.txt', '.py', '.js', '.css', '.json', '.csv', '.xml', '.yml', '.yaml']:
-                return DocumentLoader.extract_text_from_text(file_path)
-            elif ext == '.pptx':
-                return DocumentLoader.extract_text_from_pptx(file_path)
-            elif ext == '.epub':
-                return DocumentLoader.extract_text_from_epub(file_path)
-            else:
+            extractor = DocumentLoader._get_extractor(ext)
+            if extractor is None:
                 logger.warning(f"Formato de archivo no soportado: {ext}")
                 return None
+            return extractor(file_path)
         except Exception as e:
             logger.error(f"Error al procesar el documento {file_path}: {str(e)}")
             return None
-    
+
     @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
-        """Extrae texto de un archivo PDF."""
-        text = ""
-        
-        try:
+    def _get_extractor(ext: str):
+        """
+        Devuelve la función que extrae el texto de una extensión, o None si no se admite.
+
+        Las funciones extract_text_from_* lanzan una excepción si el documento no se puede
+        leer: un mensaje de error devuelto como texto acabaría en la caché de extracción.
+        """
+        if ext == '.pdf':
+            return DocumentLoader.extract_text_from_pdf
+        elif ext in ['.docx', '.doc']:
+            return DocumentLoader.extract_text_from_docx
+        elif ext in ['.html', '.htm']:
+            return DocumentLoader.extract_text_from_html
+        elif ext == '.md':
+            return DocumentLoader.extract_text_from_markdown
+        elif ext in ['.txt', '.py', '.js', '.css', '.json', '.csv', '.xml', '.yml', '.yaml']:
+            return DocumentLoader.extract_text_from_text
+        elif ext == '.pptx':
+            return DocumentLoader.extract_text_from_pptx
+        elif ext == '.epub':
+            return DocumentLoader.extract_text_from_epub
+        return None
+
+    @staticmethod
+    def iter_pages(file_path: str) -> Iterator[str]:
+        """
+        Extrae el texto de un documento página a página (o por diapositivas/secciones).
+
+        Es un generador: cada página se extrae al pedirla, de modo que quien solo
+        necesita el principio del documento puede dejar de iterar sin procesar el resto.
+        A diferencia de load_document, los errores de extracción se propagan como
+        excepciones en lugar de devolverse como texto.
+
+        Args:
+            file_path: Ruta al archivo
+
+        Yields:
+            str: Texto de cada página, en orden
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+
+        if ext == '.pdf':
             with open(file_path, 'rb') as file:
                 reader = pypdf.PdfReader(file)
-                for page_num in range(len(reader.pages)):
-                    page = reader.pages[page_num]
-                    text += page.extract_text() + "\n\n"
-                    
-            # Limpiar espacios en blanco excesivos
-            text = re.sub(r'\s+', ' ', text).strip()
-            return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del PDF {file_path}: {str(e)}")
-            return f"Error al procesar el PDF: {str(e)}"
+                for page in reader.pages:
+                    yield re.sub(r'\s+', ' ', page.extract_text() or '').strip()
+        elif ext == '.pptx':
+            presentation = Presentation(file_path)
+            for slide in presentation.slides:
+                yield "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+        elif ext == '.epub':
+            yield from DocumentLoader._iter_epub_sections(file_path)
+        else:
+            extractor = DocumentLoader._get_extractor(ext)
+            if extractor is None:
+                raise ValueError(f"Formato de archivo no soportado: {ext}")
+            yield extractor(file_path)
+
+    @staticmethod
+    def _iter_epub_sections(file_path: str) -> Iterator[str]:
+        """
+        Recorre las secciones de un EPUB en el orden de lectura (spine) leyendo del ZIP
+        solo la sección que se pide en cada momento.
+        """
+        with zipfile.ZipFile(file_path) as archive:
+            try:
+                container = ET.fromstring(archive.read('META-INF/container.xml'))
+                rootfile = container.find(f'.//{{{EPUB_CONTAINER_NS}}}rootfile').get('full-path')
+                package = ET.fromstring(archive.read(rootfile))
+                manifest = {
+                    item.get('id'): item.get('href')
+                    for item in package.iter(f'{{{EPUB_OPF_NS}}}item')
+                }
+                spine = [itemref.get('idref') for itemref in package.iter(f'{{{EPUB_OPF_NS}}}itemref')]
+            except (KeyError, AttributeError, ET.ParseError) as e:
+                logger.warning(f"No se pudo leer el índice del EPUB {file_path}, se carga completo: {str(e)}")
+                spine = None
+
+            if spine is None:
+                book = epub.read_epub(file_path)
+                for item in book.get_items():
+                    if item.get_type() == ebooklib.ITEM_DOCUMENT:
+                        yield BeautifulSoup(item.get_content().decode('utf-8'), 'html.parser').get_text()
+                return
+
+            base_dir = posixpath.dirname(rootfile)
+            for idref in spine:
+                href = manifest.get(idref)
+                if not href:
+                    continue
+                section_path = posixpath.normpath(posixpath.join(base_dir, unquote(href.split('#')[0])))
+                try:
+                    content = archive.read(section_path)
+                except KeyError:
+                    logger.warning(f"Sección no encontrada en el EPUB {file_path}: {section_path}")
+                    continue
+                yield BeautifulSoup(content, 'html.parser').get_text()
+
+    @staticmethod
+    def extract_text_from_pdf(file_path: str) -> str:
+        """Extrae texto de un archivo PDF."""
+        # Unir las páginas ya limpias en lugar de concatenar y limpiar el documento entero
+        return ' '.join(page for page in DocumentLoader.iter_pages(file_path) if page)
     
     @staticmethod
     def extract_text_from_docx(file_path: str) -> str:
         """Extrae texto de un archivo DOCX."""
-        try:
-            doc = docx.Document(file_path)
-            text = "\n\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del DOCX {file_path}: {str(e)}")
-            return f"Error al procesar el documento DOCX: {str(e)}"
+        doc = docx.Document(file_path)
+        text = "\n\n".join([paragraph.text for paragraph in doc.paragraphs])
+        return text
     
     @staticmethod
     def extract_text_from_html(file_path: str) -> str:
         """Extrae texto de un archivo HTML."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                soup = BeautifulSoup(file.read(), 'html.parser')
-                
-                # Eliminar scripts y estilos
-                for script in soup(["script", "style"]):
-                    script.extract()
-                
-                # Extraer texto
-                text = soup.get_text(separator=' ')
-                
-                # Limpiar espacios en blanco excesivos
-                lines = (line.strip() for line in text.splitlines())
-                chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                text = '\n'.join(chunk for chunk in chunks if chunk)
-                
-                return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del HTML {file_path}: {str(e)}")
-            return f"Error al procesar el HTML: {str(e)}"
+        with open(file_path, 'r', encoding='utf-8') as file:
+            soup = BeautifulSoup(file.read(), 'html.parser')
+            
+            # Eliminar scripts y estilos
+            for script in soup(["script", "style"]):
+                script.extract()
+            
+            # Extraer texto
+            text = soup.get_text(separator=' ')
+            
+            # Limpiar espacios en blanco excesivos
+            lines = (line.strip() for line in text.splitlines())
+            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+            text = '\n'.join(chunk for chunk in chunks if chunk)
+            
+            return text
     
     @staticmethod
     def extract_text_from_markdown(file_path: str) -> str:
         """Extrae texto de un archivo Markdown."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                md_text = file.read()
-                
-                # Convertir a HTML y luego extraer el texto
-                html = markdown(md_text)
-                soup = BeautifulSoup(html, 'html.parser')
-                text = soup.get_text()
-                
-                return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del Markdown {file_path}: {str(e)}")
-            return f"Error al procesar el Markdown: {str(e)}"
+        with open(file_path, 'r', encoding='utf-8') as file:
+            md_text = file.read()
+            
+            # Convertir a HTML y luego extraer el texto
+            html = markdown(md_text)
+            soup = BeautifulSoup(html, 'html.parser')
+            text = soup.get_text()
+            
+            return text
     
     @staticmethod
     def extract_text_from_text(file_path: str) -> str:
         """Extrae texto de archivos de texto plano."""
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
-                return file.read()
-        except Exception as e:
-            logger.error(f"Error al extraer texto del archivo {file_path}: {str(e)}")
-            return f"Error al procesar el archivo de texto: {str(e)}"
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+            return file.read()
     
     @staticmethod
     def extract_text_from_pptx(file_path: str) -> str:
         """Extrae texto de una presentación PowerPoint."""
-        try:
-            presentation = Presentation(file_path)
-            text = ""
+        presentation = Presentation(file_path)
+        text = ""
+        
+        for slide in presentation.slides:
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    text += shape.text + "\n"
+            text += "\n"
             
-            for slide in presentation.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-                text += "\n"
-                
-            return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del PPTX {file_path}: {str(e)}")
-            return f"Error al procesar la presentación PowerPoint: {str(e)}"
+        return text
     
     @staticmethod
     def extract_text_from_epub(file_path: str) -> str:
         """Extrae texto de un libro electrónico EPUB."""
+        return "".join(section + "\n\n" for section in DocumentLoader._iter_epub_sections(file_path))
+
+
+# Caché persistente del texto extraído. Se guarda junto a los documentos del usuario
+# (<carpeta del documento>/.extraction_cache/) y se valida con el tamaño y la fecha de
+# modificación del archivo; si cambian, se compara el hash del contenido.
+EXTRACTION_CACHE_DIR = '.extraction_cache'
+# 2: las versiones anteriores podían guardar mensajes de error como texto extraído
+EXTRACTION_CACHE_VERSION = 2
+PAGE_SEPARATOR = "\n\n"
+
+
+def _extraction_cache_paths(file_path: str):
+    """Devuelve las rutas de los metadatos y del texto en caché de un documento."""
+    directory, file_name = os.path.split(os.path.abspath(file_path))
+    cache_dir = os.path.join(directory, EXTRACTION_CACHE_DIR)
+    return (
+        os.path.join(cache_dir, f"{file_name}.json"),
+        os.path.join(cache_dir, f"{file_name}.txt")
+    )
+
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, content: str):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+
+def invalidate_extraction_cache(file_path: str):
+    """Elimina el texto en caché de un documento (al borrarlo o sobrescribirlo)."""
+    for path in _extraction_cache_paths(file_path):
         try:
-            book = epub.read_epub(file_path)
-            text = ""
-            
-            for item in book.get_items():
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    html_content = item.get_content().decode('utf-8')
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    text += soup.get_text() + "\n\n"
-            
-            return text
-        except Exception as e:
-            logger.error(f"Error al extraer texto del EPUB {file_path}: {str(e)}")
-            return f"Error al procesar el libro electrónico: {str(e)}"
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar la caché de extracción {path}: {str(e)}")
+
+
+def _get_cached_extraction(file_path: str, stat) -> Optional[Dict]:
+    """Devuelve los metadatos en caché si siguen siendo válidos para el archivo."""
+    meta_path, text_path = _extraction_cache_paths(file_path)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta.get('version') == EXTRACTION_CACHE_VERSION and os.path.exists(text_path):
+            if meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+                return meta
+            # El archivo se ha tocado pero puede que no haya cambiado su contenido
+            if meta['size'] == stat.st_size and meta['sha256'] == _file_sha256(file_path):
+                meta['mtime'] = stat.st_mtime
+                _write_atomic(meta_path, json.dumps(meta))
+                return meta
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
 
 
-def get_document_summary(file_path: str, max_length: int = 1000) -> Dict:
+def get_extraction(file_path: str) -> Optional[Dict]:
+    """
+    Obtiene los metadatos de la extracción de un documento, extrayéndolo si hace falta.
+
+    Args:
+        file_path: Ruta al archivo
+
+    Returns:
+        dict: {'word_count', 'char_count', 'page_offsets', 'sha256', 'size', 'mtime'}
+        o None si no se pudo extraer texto. Si la caché no se puede escribir, incluye
+        además el texto en la clave 'text'.
+    """
+    if not os.path.exists(file_path):
+        logger.error(f"El archivo no existe: {file_path}")
+        return None
+
+    meta_path, text_path = _extraction_cache_paths(file_path)
+    stat = os.stat(file_path)
+
+    meta = _get_cached_extraction(file_path, stat)
+    if meta is not None:
+        return meta
+
+    # Escribir el texto página a página en un fichero temporal para no tenerlo
+    # entero en memoria; si la caché no se puede escribir, se acumula en memoria
+    temp_path = f"{text_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        writer = open(temp_path, 'w', encoding='utf-8')
+    except OSError as e:
+        logger.warning(f"No se pudo guardar la caché de extracción de {file_path}: {str(e)}")
+        writer = None
+    in_memory_pages = []
+
+    page_offsets = []
+    offset = 0
+    word_count = 0
+    try:
+        for page in DocumentLoader.iter_pages(file_path):
+            if page_offsets:
+                offset += len(PAGE_SEPARATOR)
+                if writer:
+                    writer.write(PAGE_SEPARATOR)
+            page_offsets.append(offset)
+            offset += len(page)
+            word_count += len(page.split())
+            if writer:
+                writer.write(page)
+            else:
+                in_memory_pages.append(page)
+    except Exception as e:
+        logger.error(f"Error al extraer texto del documento {file_path}: {str(e)}")
+        if writer:
+            writer.close()
+            os.remove(temp_path)
+        return None
+
+    if writer:
+        writer.close()
+    if not word_count:
+        if writer:
+            os.remove(temp_path)
+        return None
+
+    meta = {
+        'version': EXTRACTION_CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': _file_sha256(file_path),
+        'word_count': word_count,
+        'char_count': offset,
+        'page_offsets': page_offsets
+    }
+
+    if writer:
+        try:
+            os.replace(temp_path, text_path)
+            _write_atomic(meta_path, json.dumps(meta))
+            logger.info(f"Texto extraído y guardado en caché: {file_path} ({word_count} palabras)")
+            return meta
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la caché de extracción de {file_path}: {str(e)}")
+            source_path = temp_path if os.path.exists(temp_path) else text_path
+            with open(source_path, 'r', encoding='utf-8') as file:
+                meta['text'] = file.read()
+            if source_path == temp_path:
+                os.remove(temp_path)
+            return meta
+
+    meta['text'] = PAGE_SEPARATOR.join(in_memory_pages)
+    return meta
+
+
+def read_extracted_text(file_path: str, max_chars: Optional[int] = None) -> Optional[str]:
+    """
+    Devuelve el texto extraído de un documento usando la caché.
+
+    Args:
+        file_path: Ruta al archivo
+        max_chars: Número máximo de caracteres a leer (opcional)
+
+    Returns:
+        str: Texto del documento o None si no se pudo extraer
+    """
+    meta = get_extraction(file_path)
+    if meta is None:
+        return None
+    return _read_extraction_text(file_path, meta, max_chars)
+
+
+def _read_extraction_text(file_path: str, meta: Dict, max_chars: Optional[int] = None) -> str:
+    if 'text' in meta:
+        return meta['text'][:max_chars] if max_chars else meta['text']
+
+    _, text_path = _extraction_cache_paths(file_path)
+    with open(text_path, 'r', encoding='utf-8') as file:
+        return file.read(max_chars) if max_chars else file.read()
+
+
+def get_document_preview(file_path: str, max_chars: int = 1000) -> Optional[str]:
+    """
+    Obtiene el principio del texto de un documento sin extraerlo entero.
+
+    Si el texto ya está en caché se lee solo el prefijo; si no, se extraen páginas
+    hasta reunir max_chars caracteres y se deja de procesar el resto del documento.
+
+    Args:
+        file_path: Ruta al archivo
+        max_chars: Número máximo de caracteres a devolver
+
+    Returns:
+        str: Principio del texto o None si no se pudo extraer
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    if _get_cached_extraction(file_path, os.stat(file_path)) is not None:
+        _, text_path = _extraction_cache_paths(file_path)
+        with open(text_path, 'r', encoding='utf-8') as file:
+            return file.read(max_chars)
+
+    parts = []
+    collected = 0
+    pages = DocumentLoader.iter_pages(file_path)
+    try:
+        for page in pages:
+            if parts:
+                parts.append(PAGE_SEPARATOR)
+                collected += len(PAGE_SEPARATOR)
+            parts.append(page)
+            collected += len(page)
+            if collected >= max_chars:
+                break
+    except Exception as e:
+        logger.error(f"Error al obtener la vista previa de {file_path}: {str(e)}")
+        return None
+    finally:
+        pages.close()
+
+    text = ''.join(parts)[:max_chars]
+    return text if text.strip() else None
+
+
+def get_document_summary(file_path: str, max_length: int = 1000, count_words: bool = True) -> Dict:
     """
     Obtiene un resumen de un documento para mostrar en la interfaz.
     
     Args:
         file_path: Ruta al archivo
         max_length: Longitud máxima del texto extraído para el resumen
+        count_words: Si es False y el texto no está en caché, solo se extraen las primeras
+            páginas para el extracto y total_words es None
         
     Returns:
         dict: Información sobre el documento incluyendo tipo y extracto
@@ -199,12 +479,17 @@ def get_document_summary(file_path: str, max_length: int = 1000) -> Dict:
         file_type = os.path.splitext(file_path)[1].lower()
         file_name = os.path.basename(file_path)
         
-        text = DocumentLoader.load_document(file_path)
+        if count_words:
+            extraction = get_extraction(file_path)
+            # Leer solo el principio del texto en caché para el resumen
+            text = _read_extraction_text(file_path, extraction, max_length + 1) if extraction else None
+            total_words = extraction['word_count'] if extraction else None
+        else:
+            text = get_document_preview(file_path, max_length + 1)
+            total_words = None
         
         if text:
-            # Truncar el texto para el resumen
             text_preview = text[:max_length] + "..." if len(text) > max_length else text
-            total_words = len(text.split())
             
             return {
                 "success": True,
@@ -221,19 +506,20 @@ def get_document_summary(file_path: str, max_length: int = 1000) -> Dict:
         return {"success": False, "error": str(e)}
 
 
-def load_document_as_context(file_path: str, max_length: int = 10000) -> Dict:
+def load_document_as_context(file_path: str, max_length: Optional[int] = 10000) -> Dict:
     """
     Carga un documento y lo prepara como contexto para los agentes.
     
     Args:
         file_path: Ruta al archivo
-        max_length: Longitud máxima del texto para usar como contexto
+        max_length: Longitud máxima del texto para usar como contexto (None para el texto completo,
+            que después se reduce por fragmentos con document_retrieval)
         
     Returns:
         dict: Contexto formateado para los agentes
     """
     try:
-        text = DocumentLoader.load_document(file_path)
+        text = read_extracted_text(file_path)
         
         if not text:
             return {
@@ -242,7 +528,7 @@ def load_document_as_context(file_path: str, max_length: int = 10000) -> Dict:
             }
         
         # Truncar si es demasiado largo
-        if len(text) > max_length:
+        if max_length and len(text) > max_length:
             text = text[:max_length] + "... [Contenido truncado debido a su longitud]"
         
         file_name = os.path.basename(file_path)
@@ -0,0 +1,305 @@
+"""
+Recuperación de fragmentos relevantes de documentos para Codestorm Assistant.
+Divide el texto de un documento en fragmentos solapados, construye un índice léxico BM25
+(y opcionalmente una matriz de embeddings con NumPy) y selecciona los fragmentos más
+relevantes para cada pregunta dentro de un presupuesto de tokens, en lugar de enviar
+solo el principio del documento.
+"""
+
+import os
+import re
+import math
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import context_window
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de los fragmentos y solapamiento entre fragmentos consecutivos (en palabras)
+CHUNK_WORDS = 180
+CHUNK_OVERLAP_WORDS = 40
+
+# Separador entre fragmentos no consecutivos en el contexto enviado al modelo
+EXCERPT_SEPARATOR = "\n\n[...]\n\n"
+
+# Peso del índice léxico frente a los embeddings en la puntuación híbrida
+LEXICAL_WEIGHT = 0.5
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+WORD_PATTERN = re.compile(r"\S+")
+
+
+def get_document_token_budget() -> int:
+    """Presupuesto de tokens para el contenido del documento (DOCUMENT_CONTEXT_MAX_TOKENS)."""
+    try:
+        return int(os.environ.get('DOCUMENT_CONTEXT_MAX_TOKENS', 1500))
+    except ValueError:
+        return 1500
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Normaliza un texto y lo divide en términos para el índice léxico.
+
+    Se pasa a minúsculas y se eliminan las tildes para que "función" y "funcion" coincidan.
+    """
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    normalized = ''.join(char for char in normalized if not unicodedata.combining(char))
+    return [term for term in TOKEN_PATTERN.findall(normalized) if len(term) > 1 or term.isdigit()]
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS, overlap_words: int = CHUNK_OVERLAP_WORDS) -> List[Dict]:
+    """
+    Divide un texto en fragmentos solapados, conservando el texto original de cada uno.
+
+    Args:
+        text: Texto completo del documento
+        chunk_words: Número de palabras por fragmento
+        overlap_words: Palabras compartidas entre fragmentos consecutivos
+
+    Returns:
+        list: Fragmentos {'index', 'start', 'end', 'text'} en orden del documento
+    """
+    spans = [match.span() for match in WORD_PATTERN.finditer(text)]
+    if not spans:
+        return []
+
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for first in range(0, len(spans), step):
+        last = min(first + chunk_words, len(spans)) - 1
+        start, end = spans[first][0], spans[last][1]
+        chunks.append({
+            'index': len(chunks),
+            'start': start,
+            'end': end,
+            'text': text[start:end]
+        })
+        if last == len(spans) - 1:
+            break
+    return chunks
+
+
+class BM25Index:
+    """Índice léxico BM25 sobre una lista de textos."""
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(tokenize(text)) for text in texts]
+        self.lengths = [sum(tf.values()) for tf in self.term_frequencies]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        document_frequency = Counter()
+        for tf in self.term_frequencies:
+            document_frequency.update(tf.keys())
+        total = len(texts)
+        self.idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """Devuelve la puntuación BM25 de cada texto para la consulta."""
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        results = []
+        for tf, length in zip(self.term_frequencies, self.lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+
+def get_embedding_model() -> Optional[str]:
+    """Modelo de embeddings de OpenAI a usar (DOCUMENT_EMBEDDING_MODEL), o None si está desactivado."""
+    return os.environ.get('DOCUMENT_EMBEDDING_MODEL', '').strip() or None
+
+
+def _embed_texts(texts: List[str], model_name: str):
+    """Calcula los embeddings normalizados de una lista de textos con OpenAI."""
+    # Importar aquí para no cargar los clientes de IA al indexar sin embeddings
+    import ai_clients
+
+    client = ai_clients.get_openai_client()
+    if client is None:
+        raise ValueError("Cliente de OpenAI no configurado. Verifica la clave API.")
+
+    vectors = []
+    for offset in range(0, len(texts), 100):
+        response = client.embeddings.create(model=model_name, input=texts[offset:offset + 100])
+        vectors.extend(item.embedding for item in response.data)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DocumentIndex:
+    """Fragmentos de un documento con su índice BM25 y, opcionalmente, sus embeddings."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.chunks = chunk_text(text)
+        self.bm25 = BM25Index([chunk['text'] for chunk in self.chunks])
+        self._embeddings = None
+        self._embeddings_failed = False
+        self._lock = threading.Lock()
+
+    def _get_embeddings(self):
+        """Devuelve la matriz de embeddings de los fragmentos, calculándola en el primer uso."""
+        model_name = get_embedding_model()
+        if np is None or not model_name or self._embeddings_failed:
+            return None, None
+        with self._lock:
+            if self._embeddings is None and not self._embeddings_failed:
+                try:
+                    self._embeddings = _embed_texts([chunk['text'] for chunk in self.chunks], model_name)
+                except Exception as e:
+                    logger.warning(f"No se pudieron calcular los embeddings del documento, se usará solo BM25: {str(e)}")
+                    self._embeddings_failed = True
+        return self._embeddings, model_name
+
+    def rank(self, query: str) -> List[float]:
+        """
+        Puntúa cada fragmento para una consulta.
+
+        Con embeddings disponibles combina BM25 (normalizado) y similitud coseno.
+
+        Returns:
+            list: Puntuación de cada fragmento, en el orden del documento
+        """
+        lexical = self.bm25.scores(query)
+        embeddings, model_name = self._get_embeddings()
+        if embeddings is None:
+            return lexical
+
+        try:
+            query_vector = _embed_texts([query], model_name)[0]
+        except Exception as e:
+            logger.warning(f"No se pudo calcular el embedding de la consulta: {str(e)}")
+            return lexical
+
+        semantic = embeddings @ query_vector
+        top = max(lexical) if lexical else 0.0
+        normalized = [score / top for score in lexical] if top > 0 else [0.0] * len(lexical)
+        return [
+            LEXICAL_WEIGHT * lex + (1 - LEXICAL_WEIGHT) * float(sem)
+            for lex, sem in zip(normalized, semantic)
+        ]
+
+    def select(self, query: str, token_budget: int, model: str = "openai") -> List[Dict]:
+        """
+        Selecciona los fragmentos más relevantes que caben en el presupuesto de tokens.
+
+        Si ningún fragmento coincide con la consulta se devuelven los primeros del documento.
+
+        Returns:
+            list: Fragmentos seleccionados, en el orden del documento
+        """
+        scores = self.rank(query)
+        if any(score > 0 for score in scores):
+            order = sorted((i for i in range(len(self.chunks)) if scores[i] > 0), key=lambda i: scores[i], reverse=True)
+        else:
+            order = list(range(len(self.chunks)))
+
+        selected = []
+        used = 0
+        for index in order:
+            tokens = context_window.count_tokens(self.chunks[index]['text'], model)
+            if used + tokens > token_budget:
+                if selected:
+                    continue
+                # El primer fragmento siempre se incluye, recortado si hace falta
+                return [dict(self.chunks[index], text=_truncate_to_budget(self.chunks[index]['text'], token_budget, model))]
+            selected.append(self.chunks[index])
+            used += tokens
+        return sorted(selected, key=lambda chunk: chunk['index'])
+
+
+def _truncate_to_budget(text: str, token_budget: int, model: str) -> str:
+    """Recorta un texto por palabras hasta que quepa en el presupuesto de tokens."""
+    words = text.split()
+    while words and context_window.count_tokens(' '.join(words), model) > token_budget:
+        words = words[:max(1, int(len(words) * 0.8))] if len(words) > 1 else []
+    return ' '.join(words)
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+MAX_CACHED_INDEXES = 32
+
+
+def get_document_index(text: str) -> DocumentIndex:
+    """Obtiene el índice de un texto, reutilizándolo si ya se construyó antes."""
+    key = hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = DocumentIndex(text)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > MAX_CACHED_INDEXES:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def select_document_context(document_context: Dict, question: str, model: str = "openai",
+                            token_budget: Optional[int] = None) -> Dict:
+    """
+    Reduce el contenido de un documento a los fragmentos relevantes para una pregunta.
+
+    Args:
+        document_context: Contexto del documento ({'content', 'source', ...})
+        question: Pregunta del usuario
+        model: Proveedor de IA para el que se cuentan los tokens
+        token_budget: Presupuesto de tokens para el contenido (opcional)
+
+    Returns:
+        dict: Copia del contexto con 'content' limitado al presupuesto y, si se han
+        seleccionado fragmentos, 'retrieved_chunks' y 'total_chunks'
+    """
+    content = document_context.get('content') or ''
+    budget = token_budget or get_document_token_budget()
+    if context_window.count_tokens(content, model) <= budget:
+        return document_context
+
+    index = get_document_index(content)
+    selected = index.select(question, budget, model)
+    logger.info(f"Documento {document_context.get('source', 'documento')}: "
+                f"{len(selected)} de {len(index.chunks)} fragmentos seleccionados para la consulta")
+
+    excerpts = []
+    previous_end = None
+    for chunk in selected:
+        if previous_end is not None and chunk['start'] <= previous_end:
+            # Fragmentos solapados: añadir solo la parte nueva
+            excerpts[-1] += index.text[previous_end:chunk['end']]
+        else:
+            excerpts.append(chunk['text'])
+        previous_end = chunk['end']
+
+    return dict(
+        document_context,
+        content=EXCERPT_SEPARATOR.join(excerpts),
+        retrieved_chunks=len(selected),
+        total_chunks=len(index.chunks)
+    )
@@ -10,6 +10,7 @@ from typing import Dict, List, Optional
 from flask import Blueprint, jsonify, request, send_file
 from werkzeug.utils import secure_filename
 import document_loader
+import document_ingestion
 
 logger = logging.getLogger(__name__)
 
@@ -35,29 +36,38 @@ def allowed_file(filename):
 @document_bp.route('/api/documents/upload', methods=['POST'])
 def upload_document():
     """
-    Sube un documento y lo almacena para uso posterior como contexto.
+    Sube uno o varios documentos y encola la extracción de su texto.
+    
+    La respuesta se devuelve en cuanto los archivos están guardados; el texto se
+    extrae en segundo plano y el progreso se consulta en /api/documents/jobs.
     
     Espera:
-    - file: El archivo a subir
+    - file: El archivo a subir (o files: varios archivos)
     - user_id: ID del usuario (opcional)
     
     Retorna:
-    - Información sobre el documento subido
+    - Información sobre los documentos subidos y el ID de su trabajo de ingesta
     """
     try:
-        if 'file' not in request.files:
+        files = request.files.getlist('files') or request.files.getlist('file')
+        if not files:
             return jsonify({
                 'success': False,
                 'error': 'No se ha proporcionado ningún archivo'
             }), 400
             
-        file = request.files['file']
-        
-        if file.filename == '':
+        if any(file.filename == '' for file in files):
             return jsonify({
                 'success': False,
                 'error': 'Nombre de archivo vacío'
             }), 400
+        
+        rejected = [file.filename for file in files if not allowed_file(file.filename)]
+        if rejected:
+            return jsonify({
+                'success': False,
+                'error': f'Formato de archivo no permitido ({", ".join(rejected)}). Formatos soportados: {", ".join(ALLOWED_EXTENSIONS)}'
+            }), 400
             
         user_id = request.form.get('user_id', 'default')
         
@@ -65,45 +75,32 @@ def upload_document():
         user_document_dir = os.path.join(UPLOAD_FOLDER, user_id)
         os.makedirs(user_document_dir, exist_ok=True)
         
-        if file and allowed_file(file.filename):
+        documents = []
+        for file in files:
             filename = secure_filename(file.filename)
             file_path = os.path.join(user_document_dir, filename)
             
-            # Guardar el archivo
+            # Guardar el archivo (si sobrescribe uno anterior, descartar su texto en caché)
+            document_loader.invalidate_extraction_cache(file_path)
             file.save(file_path)
             
-            # Obtener información del documento
-            doc_info = document_loader.get_document_summary(file_path)
-            
-            if doc_info['success']:
-                return jsonify({
-                    'success': True,
-                    'message': 'Documento subido correctamente',
-                    'document': {
-                        'filename': filename,
-                        'path': file_path,
-                        'size': doc_info['file_size'],
-                        'word_count': doc_info['total_words'],
-                        'preview': doc_info['text_preview'][:300] + '...' if len(doc_info['text_preview']) > 300 else doc_info['text_preview']
-                    }
-                })
-            else:
-                # Si no se pudo procesar, devolver error pero mantener el archivo
-                return jsonify({
-                    'success': True,
-                    'message': 'Documento subido pero no se pudo procesar completamente',
-                    'warning': doc_info['error'],
-                    'document': {
-                        'filename': filename,
-                        'path': file_path,
-                        'size': os.path.getsize(file_path),
-                    }
-                })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Formato de archivo no permitido. Formatos soportados: {", ".join(ALLOWED_EXTENSIONS)}'
-            }), 400
+            # Encolar la extracción del texto
+            job = document_ingestion.submit(file_path, user_id)
+            documents.append({
+                'filename': filename,
+                'path': file_path,
+                'size': os.path.getsize(file_path),
+                'job_id': job['job_id'],
+                'status': job['status']
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': 'Documento subido, procesando en segundo plano' if len(documents) == 1
+                       else f'{len(documents)} documentos subidos, procesando en segundo plano',
+            'document': documents[0],
+            'documents': documents
+        }), 202
     except Exception as e:
         logger.error(f"Error al subir documento: {str(e)}")
         return jsonify({
@@ -112,6 +109,48 @@ def upload_document():
         }), 500
 
 
+@document_bp.route('/api/documents/jobs/<job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    """
+    Obtiene el estado de un trabajo de ingesta de documentos.
+    
+    Retorna:
+    - Estado del trabajo (queued, processing, done, error), número de palabras y extracto
+    """
+    job = document_ingestion.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'El trabajo de ingesta no existe'
+        }), 404
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+
+@document_bp.route('/api/documents/jobs', methods=['GET'])
+def list_ingestion_jobs():
+    """
+    Lista los trabajos de ingesta de un usuario.
+    
+    Parámetros:
+    - user_id: ID del usuario (opcional)
+    - ids: IDs de trabajos separados por comas (opcional)
+    
+    Retorna:
+    - Lista de trabajos y cuántos siguen pendientes
+    """
+    user_id = request.args.get('user_id', 'default')
+    job_ids = [job_id for job_id in request.args.get('ids', '').split(',') if job_id]
+    jobs = document_ingestion.list_jobs(user_id=user_id, job_ids=job_ids or None)
+    return jsonify({
+        'success': True,
+        'jobs': jobs,
+        'pending': sum(1 for job in jobs if job['status'] in (document_ingestion.JOB_QUEUED, document_ingestion.JOB_PROCESSING))
+    })
+
+
 @document_bp.route('/api/documents/list', methods=['GET'])
 def list_documents():
     """
@@ -205,6 +244,23 @@ def get_document_info(filename):
                 'error': 'El documento no existe'
             }), 404
             
+        # Si el documento todavía se está procesando, no extraerlo otra vez aquí
+        pending_job = document_ingestion.get_pending_job_for_path(file_path)
+        if pending_job:
+            return jsonify({
+                'success': True,
+                'document': {
+                    'filename': filename,
+                    'path': file_path,
+                    'size': os.path.getsize(file_path),
+                    'type': os.path.splitext(filename)[1].lower(),
+                    'word_count': None,
+                    'preview': None,
+                    'processing': True,
+                    'job_id': pending_job['job_id']
+                }
+            })
+        
         # Obtener información del documento
         doc_info = document_loader.get_document_summary(file_path)
         
@@ -256,8 +312,9 @@ def delete_document(filename):
                 'error': 'El documento no existe'
             }), 404
             
-        # Eliminar el archivo
+        # Eliminar el archivo y su texto en caché
         os.remove(file_path)
+        document_loader.invalidate_extraction_cache(file_path)
         
         return jsonify({
             'success': True,
@@ -337,7 +394,8 @@ def chat_with_context():
     - agent_id: ID del agente a utilizar (opcional)
     - user_id: ID del usuario (opcional)
     - document_already_processed: Booleano que indica si el documento ya fue procesado (opcional)
-    - context: Contexto previo de la conversación (opcional)
+    - conversation_id: ID de la conversación guardada en el servidor (opcional)
+    - context: Contexto previo de la conversación, solo si no se envía conversation_id (opcional)
     
     Retorna:
     - Respuesta del asistente considerando el contexto del documento
@@ -350,7 +408,11 @@ def chat_with_context():
         agent_id = data.get('agent_id', 'general')
         user_id = data.get('user_id', 'default')
         document_already_processed = data.get('document_already_processed', False)
-        conversation_context = data.get('context', [])
+        conversation_id = data.get('conversation_id')
+        
+        # Importar aquí para evitar problemas de importación circular
+        from conversation_store import get_conversation_store, is_valid_conversation_id, load_history, record_exchange
+        conversation_context = load_history(conversation_id, data.get('context', []))
         
         if not message:
             return jsonify({
@@ -364,26 +426,38 @@ def chat_with_context():
                 'error': 'No se ha especificado un documento como contexto'
             }), 400
         
+        filename = secure_filename(document_filename)
+        
+        # Documento ya procesado en esta conversación y guardado en el servidor
+        stored_document = None
+        if is_valid_conversation_id(conversation_id):
+            stored_document = get_conversation_store().get_document(conversation_id)
+            if stored_document and stored_document.get('source') != filename:
+                stored_document = None
+        
         # Si el documento ya fue procesado, usar el contexto de la conversación previa
-        if document_already_processed and conversation_context:
+        if stored_document or (document_already_processed and conversation_context):
             logger.info(f"Usando contexto existente para documento ya procesado: {document_filename}")
             
             # Para documentos ya procesados, usar el contexto de conversación para responder
             import agents_utils
             
-            # Extraer el contenido del documento del historial de conversación
-            document_content = ""
-            for msg in conversation_context:
-                if msg.get('role') == 'assistant' and f"He extraído el contenido del documento '{document_filename}'" in msg.get('content', ''):
-                    document_content = msg.get('content', '')
-                    break
-            
-            # Construir un contexto de documento sintético
-            document_context = {
-                'content': document_content,
-                'source': document_filename,
-                'word_count': len(document_content.split())
-            }
+            if stored_document:
+                document_context = stored_document
+            else:
+                # Clientes sin conversation_id: extraer el contenido del documento del historial
+                document_content = ""
+                for msg in conversation_context:
+                    if msg.get('role') == 'assistant' and f"He extraído el contenido del documento '{document_filename}'" in msg.get('content', ''):
+                        document_content = msg.get('content', '')
+                        break
+                
+                # Construir un contexto de documento sintético
+                document_context = {
+                    'content': document_content,
+                    'source': document_filename,
+                    'word_count': len(document_content.split())
+                }
             
             # Generar respuesta usando el agente con el contexto del documento
             response_result = agents_utils.generate_response(
@@ -391,7 +465,8 @@ def chat_with_context():
                 agent_id=agent_id,
                 context=conversation_context,
                 model="openai",  # Se podría hacer configurable
-                document_context=document_context
+                document_context=document_context,
+                conversation_id=conversation_id
             )
             
             if not response_result['success']:
@@ -404,6 +479,7 @@ def chat_with_context():
                 }), 500
                 
             response = response_result['response']
+            record_exchange(conversation_id, message, response, agent_id)
             
             return jsonify({
                 'success': True,
@@ -417,7 +493,6 @@ def chat_with_context():
             })
             
         # Si es la primera vez que se procesa, cargar el documento
-        filename = secure_filename(document_filename)
         file_path = os.path.join(UPLOAD_FOLDER, user_id, filename)
         
         if not os.path.exists(file_path):
@@ -427,7 +502,8 @@ def chat_with_context():
             }), 404
             
         # Obtener el contexto del documento
-        context_result = document_loader.load_document_as_context(file_path)
+        # Se carga el texto completo: al responder solo se envían los fragmentos relevantes
+        context_result = document_loader.load_document_as_context(file_path, max_length=None)
         
         if not context_result['success']:
             return jsonify({
@@ -439,12 +515,22 @@ def chat_with_context():
         document_context = context_result['context']
         word_count = document_context['word_count']
         
+        # Guardar el documento en la conversación para las siguientes preguntas
+        if is_valid_conversation_id(conversation_id):
+            get_conversation_store().set_document(conversation_id, document_context)
+        
         # Determinar si el documento es lo suficientemente pequeño para mostrarlo directamente
         # (menos de 1000 palabras se considera pequeño)
         MAX_WORDS_FOR_DIRECT_DISPLAY = 1000
         
         if word_count <= MAX_WORDS_FOR_DIRECT_DISPLAY:
-            # Para documentos pequeños, devolver el contenido para mostrarlo directamente
+            # Para documentos pequeños, devolver el contenido para mostrarlo directamente.
+            # En el historial del servidor basta con una nota: el contenido ya está guardado aparte
+            record_exchange(
+                conversation_id, message,
+                f"He extraído el contenido del documento '{document_filename}' (contiene {word_count} palabras).",
+                agent_id
+            )
             return jsonify({
                 'success': True,
                 'message': message,
@@ -465,8 +551,10 @@ def chat_with_context():
         response_result = agents_utils.generate_response(
             user_message=message,
             agent_id=agent_id,
+            context=conversation_context,
             model="openai",  # Se podría hacer configurable
-            document_context=document_context
+            document_context=document_context,
+            conversation_id=conversation_id
         )
         
         if not response_result['success']:
@@ -489,6 +577,7 @@ def chat_with_context():
             })
             
         response = response_result['response']
+        record_exchange(conversation_id, message, response, agent_id)
         
         return jsonify({
             'success': True,
@@ -1,14 +1,14 @@
 # Funciones para descarga de archivos y directorios
 import os
 import logging
-import zipfile
-import io
 import shutil
 import subprocess
 from pathlib import Path
-from flask import request, jsonify, send_file, session
+from flask import request, jsonify, send_file, session, Response, stream_with_context
 import requests
 
+import archive_utils
+
 def download_file_route(app, get_user_workspace):
     @app.route('/api/download_file/<path:file_path>')
     def download_file(file_path):
@@ -42,7 +42,12 @@ def download_file_route(app, get_user_workspace):
 def download_directory_route(app, get_user_workspace):
     @app.route('/api/download_directory/<path:directory_path>')
     def download_directory(directory_path):
-        """Download a directory as a ZIP file."""
+        """
+        Download a directory as a ZIP file, streamed while the tree is walked.
+
+        Optional query parameter `compression`: 'auto' (default, already compressed
+        files are stored as is), 'deflated' or 'stored'.
+        """
         try:
             # Get the user workspace
             user_id = session.get('user_id', 'default')
@@ -58,36 +63,19 @@ def download_directory_route(app, get_user_workspace):
                 
             if not target_path.exists() or not target_path.is_dir():
                 return jsonify({'error': 'El directorio no existe'}), 404
+
+            compression = request.args.get('compression', archive_utils.COMPRESSION_AUTO)
+            if compression not in archive_utils.ZIP_COMPRESSION_MODES:
+                return jsonify({'error': f'Modo de compresión no válido: {compression}'}), 400
                 
-            # Create an in-memory ZIP file
-            memory_file = io.BytesIO()
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Walk through the directory and add all files
-                base_dir_name = target_path.name
-                base_path = target_path.parent
-                
-                for root, dirs, files in os.walk(target_path):
-                    # Get the relative path from the base directory
-                    rel_path = os.path.relpath(root, base_path)
-                    
-                    # Add each file to the ZIP
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_name = os.path.join(rel_path, file)
-                        zipf.write(file_path, arc_name)
-            
-            # Reset file pointer to beginning
-            memory_file.seek(0)
-            
             # Create a filename for the ZIP
-            zip_filename = f"{base_dir_name}.zip"
+            zip_filename = f"{target_path.name}.zip"
             
-            # Send the ZIP file
-            return send_file(
-                memory_file,
+            # Stream the ZIP file as it is built, without holding it in memory
+            return Response(
+                stream_with_context(archive_utils.stream_zip(str(target_path), True, compression)),
                 mimetype='application/zip',
-                as_attachment=True,
-                download_name=zip_filename
+                headers=archive_utils.attachment_headers(zip_filename)
             )
             
         except Exception as e:
@@ -0,0 +1,91 @@
+"""
+Trabajos de extracción de archivos comprimidos para Codestorm Assistant.
+Las extracciones grandes se ejecutan en segundo plano; cada una es un trabajo cuyo
+progreso (entradas y bytes extraídos) se puede consultar mientras avanza.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import file_explorer
+from job_registry import JobRegistry, JOB_QUEUED, JOB_PROCESSING, JOB_DONE, JOB_ERROR
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_registry = JobRegistry()
+
+
+def _get_worker_count():
+    try:
+        return max(1, int(os.environ.get('EXTRACT_JOB_WORKERS', 2)))
+    except ValueError:
+        return 2
+
+
+def _get_executor():
+    """Devuelve el pool de hilos de extracción, creándolo si hace falta."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_get_worker_count(), thread_name_prefix="extract-job")
+        return _executor
+
+
+def _run_job(job_id, file_path, extract_dir):
+    _registry.update(job_id, status=JOB_PROCESSING)
+    try:
+        success, message, files = file_explorer.extract_compressed_file(
+            file_path, extract_dir, lambda progress: _registry.update(job_id, progress=progress))
+    except Exception as e:
+        success, message, files = False, str(e), []
+
+    if success:
+        _registry.update(job_id, status=JOB_DONE, message=message, files=files, finished_at=time.time())
+    else:
+        logger.warning(f"Error al extraer {file_path}: {message}")
+        _registry.update(job_id, status=JOB_ERROR, error=message, finished_at=time.time())
+
+
+def submit(file_path, extract_dir):
+    """
+    Encola la extracción de un archivo comprimido.
+
+    Args:
+        file_path: Ruta al archivo comprimido
+        extract_dir: Directorio donde extraer el contenido
+
+    Returns:
+        dict: Estado inicial del trabajo (incluye 'job_id')
+    """
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'filename': os.path.basename(file_path),
+        'status': JOB_QUEUED,
+        'progress': None,
+        'message': None,
+        'files': None,
+        'error': None,
+        'created_at': now,
+        'finished_at': None
+    }
+    _registry.add(job)
+
+    _get_executor().submit(_run_job, job_id, file_path, extract_dir)
+    return get_job(job_id)
+
+
+def get_job(job_id):
+    """
+    Devuelve el estado de un trabajo de extracción.
+
+    Returns:
+        dict o None: Copia del trabajo, o None si no existe
+    """
+    return _registry.get(job_id)
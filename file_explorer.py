@@ -5,6 +5,7 @@ dentro de una estructura de directorios.
 """
 
 import os
+import re
 import logging
 import json
 import zipfile
@@ -12,6 +13,8 @@ import shutil
 import tempfile
 import datetime
 from typing import Dict, List, Tuple, Optional, Union
+import content_index
+import workspace_index
 
 logger = logging.getLogger(__name__)
 
@@ -69,6 +72,7 @@ def update_file_content(file_path: str, content: str) -> Tuple[bool, str]:
         # Escribir el nuevo contenido
         with open(file_path, 'w', encoding='utf-8') as file:
             file.write(content)
+        workspace_index.notify_path_changed(file_path)
             
         return True, f"Archivo {file_path} actualizado correctamente"
     except Exception as e:
@@ -100,6 +104,7 @@ def create_file(file_path: str, content: str) -> Tuple[bool, str]:
         # Escribir el contenido
         with open(file_path, 'w', encoding='utf-8') as file:
             file.write(content)
+        workspace_index.notify_path_changed(file_path)
             
         return True, f"Archivo {file_path} creado correctamente"
     except Exception as e:
@@ -107,6 +112,29 @@ def create_file(file_path: str, content: str) -> Tuple[bool, str]:
         return False, f"Error al crear el archivo: {str(e)}"
 
 
+def _directory_entries(directory_path: str) -> List[Tuple[str, bool, Optional[int]]]:
+    """
+    Devuelve (nombre, es_directorio, tamaño) de cada entrada de un directorio, desde el
+    índice del workspace si lo cubre o leyendo el disco en caso contrario.
+    """
+    index = workspace_index.find_workspace_index(directory_path)
+    entries = index.list_directory(directory_path) if index else None
+    if entries is not None:
+        return entries
+
+    entries = []
+    with os.scandir(directory_path) as iterator:
+        for entry in iterator:
+            try:
+                if entry.is_dir():
+                    entries.append((entry.name, True, None))
+                else:
+                    entries.append((entry.name, False, entry.stat().st_size))
+            except OSError as e:
+                logger.warning(f"Error al obtener info de archivo {entry.path}: {str(e)}")
+    return entries
+
+
 def list_directory(directory_path: str, depth: int = 1, max_depth: int = 2) -> Tuple[bool, List[Dict], str]:
     """
     Lista archivos y subdirectorios dentro de un directorio.
@@ -125,14 +153,14 @@ def list_directory(directory_path: str, depth: int = 1, max_depth: int = 2) -> T
             
         items = []
         
-        for item in os.listdir(directory_path):
+        for item, is_dir, file_size in _directory_entries(directory_path):
             # Ignorar archivos ocultos
             if item.startswith('.'):
                 continue
                 
             item_path = os.path.join(directory_path, item)
             
-            if os.path.isdir(item_path):
+            if is_dir:
                 item_data = {
                     'name': item,
                     'type': 'directory',
@@ -148,21 +176,17 @@ def list_directory(directory_path: str, depth: int = 1, max_depth: int = 2) -> T
                 items.append(item_data)
             else:
                 # Para archivos, obtener información básica
-                try:
-                    file_size = os.path.getsize(item_path)
-                    file_type = os.path.splitext(item)[1].lstrip('.').lower()
-                    
-                    item_data = {
-                        'name': item,
-                        'type': 'file',
-                        'file_type': file_type,
-                        'size': file_size,
-                        'path': item_path
-                    }
-                    
-                    items.append(item_data)
-                except Exception as e:
-                    logger.warning(f"Error al obtener info de archivo {item_path}: {str(e)}")
+                file_type = os.path.splitext(item)[1].lstrip('.').lower()
+                
+                item_data = {
+                    'name': item,
+                    'type': 'file',
+                    'file_type': file_type,
+                    'size': file_size,
+                    'path': item_path
+                }
+                
+                items.append(item_data)
         
         # Ordenar: primero directorios, luego archivos (alfabéticamente)
         items.sort(key=lambda x: (0 if x['type'] == 'directory' else 1, x['name'].lower()))
@@ -180,7 +204,7 @@ def find_file(base_directory: str, target: str, search_type: str = 'name') -> Tu
     Args:
         base_directory: Directorio base para iniciar la búsqueda
         target: Nombre o patrón a buscar
-        search_type: Tipo de búsqueda ('name', 'content', 'extension')
+        search_type: Tipo de búsqueda ('name', 'content', 'regex', 'extension')
         
     Returns:
         Tuple[bool, List[str], str]: (éxito, lista de rutas encontradas, mensaje de error)
@@ -212,23 +236,19 @@ def find_file(base_directory: str, target: str, search_type: str = 'name') -> Tu
                     if file_name.lower().endswith(f".{target.lower()}"):
                         found_items.append(os.path.join(root, file_name))
         
-        # Búsqueda por contenido (solo archivos de texto)
-        elif search_type == 'content':
-            for root, _, files in os.walk(base_directory):
-                for file_name in files:
-                    file_path = os.path.join(root, file_name)
-                    try:
-                        # Solo procesar archivos que probablemente sean de texto
-                        _, ext = os.path.splitext(file_name)
-                        if ext.lower() in ['.txt', '.md', '.py', '.js', '.html', '.css', '.json', '.xml', '.csv', '.ts', '.jsx', '.tsx', '.vue', '.php', '.java', '.c', '.cpp', '.h', '.sh', '.bat']:
-                            with open(file_path, 'r', encoding='utf-8') as file:
-                                if target.lower() in file.read().lower():
-                                    found_items.append(file_path)
-                    except (UnicodeDecodeError, PermissionError):
-                        # Ignorar archivos que no se pueden leer como texto o con permisos restringidos
-                        pass
-                    except Exception as e:
-                        logger.warning(f"Error al leer archivo {file_path}: {str(e)}")
+        # Búsqueda por contenido (solo archivos de texto) o por expresión regular,
+        # filtrando candidatos con el índice de trigramas
+        elif search_type in ('content', 'regex'):
+            index = content_index.find_content_index(base_directory)
+            absolute_base = os.path.abspath(base_directory)
+            try:
+                matches = index.search(target, os.path.relpath(absolute_base, index.root), regex=(search_type == 'regex'))
+            except re.error as e:
+                return False, [], f"Expresión regular no válida: {str(e)}"
+            for relative_path in matches:
+                # Devolver las rutas con el mismo formato que la ruta base recibida
+                match_path = os.path.join(index.root, relative_path)
+                found_items.append(os.path.join(base_directory, os.path.relpath(match_path, absolute_base)))
         
         return True, found_items, ""
     except Exception as e:
@@ -293,7 +313,9 @@ def analyze_project_structure(workspace_path: str, max_depth: int = 3) -> Dict:
             'pubspec.yaml', 'AndroidManifest.xml', 'Info.plist'
         ]
         
-        for root, _, files in os.walk(workspace_path):
+        index = workspace_index.find_workspace_index(workspace_path)
+        walker = index.walk(workspace_path) if index else None
+        for root, _, files in (walker or os.walk(workspace_path)):
             for file in files:
                 if file in common_important_files:
                     important_files.append(os.path.join(root, file))
@@ -314,65 +336,44 @@ def analyze_project_structure(workspace_path: str, max_depth: int = 3) -> Dict:
         }
         
         
-def extract_compressed_file(file_path: str, extract_dir: Optional[str] = None) -> Tuple[bool, str, List[Dict]]:
+def extract_compressed_file(file_path: str, extract_dir: Optional[str] = None,
+                            progress_callback=None) -> Tuple[bool, str, List[Dict]]:
     """
-    Extrae el contenido de un archivo ZIP a un directorio.
+    Extrae el contenido de un archivo ZIP, tar o RAR a un directorio.
+    
+    La extracción se hace por fragmentos, con límites de tamaño descomprimido y de número
+    de entradas, y sin permitir rutas que salgan del directorio de extracción.
     
     Args:
         file_path: Ruta al archivo comprimido
         extract_dir: Directorio donde extraer el contenido (si es None, se crea un directorio junto al archivo)
+        progress_callback: Función opcional que recibe el progreso de la extracción
         
     Returns:
         Tuple[bool, str, List[Dict]]: (éxito, mensaje, lista de archivos extraídos)
     """
+    # Importar aquí para no cargar el módulo de archivos comprimidos hasta que se use
+    import archive_utils
+
     try:
         # Verificar si el archivo existe
         if not os.path.exists(file_path):
             return False, f"El archivo {file_path} no existe", []
             
-        # Determinar el tipo de archivo por su extensión
-        file_ext = os.path.splitext(file_path)[1].lower()
-        
-        # Solo soportamos archivos ZIP por ahora
-        if file_ext != '.zip':
-            return False, f"Formato de archivo no soportado: {file_ext}. Solo se admiten archivos .zip", []
-        
         # Si no se especificó directorio de extracción, usar uno junto al archivo
         if extract_dir is None:
-            base_dir = os.path.dirname(file_path)
-            file_name = os.path.splitext(os.path.basename(file_path))[0]
-            extract_dir = os.path.join(base_dir, file_name)
+            extract_dir = default_extract_dir(file_path)
             
-        # Crear directorio de extracción si no existe
-        os.makedirs(extract_dir, exist_ok=True)
+        result = archive_utils.extract_archive(file_path, extract_dir, progress_callback)
+        workspace_index.notify_path_changed(extract_dir)
         
-        extracted_files = []
-        
-        # Extraer archivo ZIP
-        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            # Listar archivos antes de extraer
-            for file_info in zip_ref.infolist():
-                # Verificar si es directorio (termina con / o \)
-                is_dir = file_info.filename.endswith('/') or file_info.filename.endswith('\\')
-                
-                # Formar fecha en formato ISO
-                date_time = datetime.datetime(*file_info.date_time)
-                date_str = date_time.strftime("%Y-%m-%d")
-                
-                extracted_files.append({
-                    'name': file_info.filename,
-                    'size': file_info.file_size,
-                    'date': date_str,
-                    'is_dir': is_dir
-                })
-            
-            # Extraer todos los archivos
-            zip_ref.extractall(extract_dir)
-            
-        return True, f"Archivo extraído correctamente en: {extract_dir}", extracted_files
-    except zipfile.BadZipFile:
-        logger.error(f"El archivo {file_path} no es un ZIP válido")
-        return False, f"El archivo no es un ZIP válido o está corrupto", []
+        message = f"Archivo extraído correctamente en: {extract_dir}"
+        if result['skipped']:
+            message += f" ({len(result['skipped'])} entradas omitidas por seguridad)"
+        return True, message, result['files']
+    except archive_utils.ExtractionError as e:
+        logger.error(f"Extracción de {file_path} detenida: {str(e)}")
+        return False, str(e), []
     except PermissionError:
         logger.error(f"Error de permisos al extraer archivo {file_path}")
         return False, f"No tienes permisos para extraer en la ubicación seleccionada", []
@@ -381,66 +382,74 @@ def extract_compressed_file(file_path: str, extract_dir: Optional[str] = None) -
         return False, f"Error al extraer el archivo: {str(e)}", []
 
 
-def create_zip_archive(source_path: str, output_zip_path: str, include_root: bool = True) -> Tuple[bool, str]:
+def default_extract_dir(file_path: str) -> str:
+    """Directorio de extracción por defecto: junto al archivo, con su nombre sin extensión."""
+    # Importar aquí para no cargar el módulo de archivos comprimidos hasta que se use
+    import archive_utils
+
+    file_name = os.path.basename(file_path)
+    for extension in archive_utils.TAR_EXTENSIONS + archive_utils.ZIP_EXTENSIONS + archive_utils.RAR_EXTENSIONS:
+        if file_name.lower().endswith(extension):
+            file_name = file_name[:-len(extension)]
+            break
+    else:
+        file_name = os.path.splitext(file_name)[0]
+    return os.path.join(os.path.dirname(file_path), file_name)
+
+
+def create_archive(source_path: str, output_path: str, include_root: bool = True,
+                   archive_format: str = 'zip', compression: str = 'auto') -> Tuple[bool, str]:
     """
-    Crea un archivo ZIP a partir de un directorio o archivo.
+    Crea un archivo comprimido (ZIP, tar.gz o tar.zst) a partir de un directorio o archivo,
+    comprimiendo en paralelo con todos los núcleos.
     
     Args:
         source_path: Ruta al directorio o archivo a comprimir
-        output_zip_path: Ruta donde guardar el archivo ZIP
-        include_root: Si es True, incluye el directorio raíz en el archivo ZIP
+        output_path: Ruta donde guardar el archivo comprimido
+        include_root: Si es True, incluye el directorio raíz en el archivo
+        archive_format: Formato del archivo ('zip', 'tar.gz' o 'tar.zst')
+        compression: Compresión de los miembros del ZIP ('auto', 'deflated' o 'stored')
         
     Returns:
         Tuple[bool, str]: (éxito, mensaje)
     """
+    # Importar aquí para no cargar el módulo de archivos comprimidos hasta que se use
+    import archive_utils
+
     try:
         # Verificar si la ruta existe
         if not os.path.exists(source_path):
             return False, f"La ruta {source_path} no existe"
             
-        # Determinar el nombre del archivo ZIP si está vacío o es None
-        if not output_zip_path:
-            if os.path.isdir(source_path):
-                output_zip_path = source_path.rstrip(os.path.sep) + '.zip'
-            else:
-                output_zip_path = source_path + '.zip'
-                
-        # Crear archivo ZIP
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            if os.path.isdir(source_path):
-                # Es un directorio, añadir todos sus contenidos
-                base_dir = os.path.basename(source_path.rstrip(os.path.sep)) if include_root else ''
+        # Determinar el nombre del archivo si está vacío o es None
+        if not output_path:
+            output_path = source_path.rstrip(os.path.sep) + '.' + archive_format
                 
-                for root, dirs, files in os.walk(source_path):
-                    # Calcular la ruta relativa desde source_path
-                    if include_root:
-                        rel_dir = os.path.relpath(root, os.path.dirname(source_path))
-                    else:
-                        rel_dir = os.path.relpath(root, source_path)
-                        
-                    # Añadir el directorio vacío (si se debe incluir)
-                    if include_root or rel_dir != '.':
-                        zipf.write(root, rel_dir)
-                        
-                    # Añadir archivos
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        if include_root:
-                            arc_name = os.path.relpath(file_path, os.path.dirname(source_path))
-                        else:
-                            arc_name = os.path.relpath(file_path, source_path)
-                        zipf.write(file_path, arc_name)
-            else:
-                # Es un archivo, añadirlo directamente
-                zipf.write(source_path, os.path.basename(source_path))
+        stats = archive_utils.create_archive(source_path, output_path, include_root, archive_format, compression)
+        workspace_index.notify_path_changed(output_path)
                 
-        return True, f"Archivo ZIP creado correctamente: {output_zip_path}"
+        return True, (f"Archivo {archive_format} creado correctamente: {output_path} "
+                      f"({stats['members']} entradas en {stats['seconds']}s)")
+    except ValueError as e:
+        return False, str(e)
     except PermissionError:
-        logger.error(f"Error de permisos al crear archivo ZIP en {output_zip_path}")
-        return False, f"No tienes permisos para crear el archivo ZIP en esa ubicación"
-    except zipfile.BadZipFile:
-        logger.error(f"Error al crear archivo ZIP inválido en {output_zip_path}")
-        return False, f"No se pudo crear un archivo ZIP válido"
+        logger.error(f"Error de permisos al crear archivo comprimido en {output_path}")
+        return False, f"No tienes permisos para crear el archivo en esa ubicación"
     except Exception as e:
-        logger.error(f"Error al crear archivo ZIP desde {source_path}: {str(e)}")
-        return False, f"Error al crear el archivo ZIP: {str(e)}"
\ No newline at end of file
+        logger.error(f"Error al crear archivo comprimido desde {source_path}: {str(e)}")
+        return False, f"Error al crear el archivo comprimido: {str(e)}"
+
+
+def create_zip_archive(source_path: str, output_zip_path: str, include_root: bool = True) -> Tuple[bool, str]:
+    """
+    Crea un archivo ZIP a partir de un directorio o archivo.
+    
+    Args:
+        source_path: Ruta al directorio o archivo a comprimir
+        output_zip_path: Ruta donde guardar el archivo ZIP
+        include_root: Si es True, incluye el directorio raíz en el archivo ZIP
+        
+    Returns:
+        Tuple[bool, str]: (éxito, mensaje)
+    """
+    return create_archive(source_path, output_zip_path, include_root, 'zip')
@@ -7,10 +7,14 @@ dentro de una estructura de directorios.
 import os
 import logging
 import json
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, jsonify, request, send_file, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import file_explorer
-import tempfile
+import content_index
+import workspace_index
+import archive_utils
+import extraction_jobs
+import upload_sessions
 import shutil
 
 logger = logging.getLogger(__name__)
@@ -54,7 +58,8 @@ def list_directory():
                 'error': f'El directorio "{target_path}" no existe.'
             }), 404
 
-        # Listar el contenido del directorio
+        # Listar el contenido del directorio (desde el índice del workspace cuando esté listo)
+        workspace_index.get_workspace_index(workspace_path)
         success, items, error = file_explorer.list_directory(target_path, 1, max_depth)
 
         if success:
@@ -267,7 +272,7 @@ def search_files():
 
     Parámetros de consulta:
     - query: Texto a buscar
-    - type: Tipo de búsqueda ('name', 'content', 'extension')
+    - type: Tipo de búsqueda ('name', 'content', 'regex', 'extension')
     - path: Ruta base para la búsqueda (predeterminado: '.')
     - workspace_id: ID del espacio de trabajo (predeterminado: 'default')
 
@@ -297,6 +302,10 @@ def search_files():
                 'error': 'Acceso denegado: la ruta se sale del espacio de trabajo'
             }), 403
 
+        # Las búsquedas por contenido usan el índice de trigramas de todo el workspace
+        if search_type in ('content', 'regex'):
+            content_index.get_content_index(workspace_path)
+
         # Realizar la búsqueda
         success, found_items, error = file_explorer.find_file(search_path, query, search_type)
 
@@ -360,6 +369,7 @@ def analyze_project():
             }), 403
 
         # Analizar el proyecto
+        workspace_index.get_workspace_index(workspace_path)
         analysis = file_explorer.analyze_project_structure(project_path, max_depth)
 
         # Convertir rutas absolutas a relativas en el resultado
@@ -384,22 +394,27 @@ def analyze_project():
 @file_explorer_bp.route('/api/explorer/compress', methods=['POST'])
 def compress_to_zip():
     """
-    Comprime un archivo o directorio en formato ZIP.
+    Comprime un archivo o directorio en formato ZIP, tar.gz o tar.zst usando varios núcleos.
 
     Espera:
     - path: Ruta relativa al archivo o directorio a comprimir
-    - output_path: (Opcional) Ruta relativa donde guardar el archivo ZIP
-    - include_root: (Opcional) Si se debe incluir el directorio raíz en el ZIP (predeterminado: True)
+    - output_path: (Opcional) Ruta relativa donde guardar el archivo comprimido
+    - include_root: (Opcional) Si se debe incluir el directorio raíz en el archivo (predeterminado: True)
+    - format: (Opcional) 'zip' (predeterminado), 'tar.gz' o 'tar.zst'
+    - compression: (Opcional) Compresión de los miembros del ZIP: 'auto' (predeterminado; no
+      recomprime imágenes ni archivos ya comprimidos), 'deflated' o 'stored'
     - workspace_id: ID del espacio de trabajo (predeterminado: 'default')
 
     Retorna:
-    - Confirmación de compresión y ruta del archivo ZIP generado
+    - Confirmación de compresión y ruta del archivo generado
     """
     try:
         data = request.json
         relative_path = data.get('path')
         relative_output_path = data.get('output_path')
         include_root = data.get('include_root', True)
+        archive_format = data.get('format', archive_utils.FORMAT_ZIP)
+        compression = data.get('compression', archive_utils.COMPRESSION_AUTO)
         workspace_id = data.get('workspace_id', 'default')
 
         if not relative_path:
@@ -408,6 +423,12 @@ def compress_to_zip():
                 'error': 'Debe especificar una ruta a comprimir'
             }), 400
 
+        if archive_format not in archive_utils.ARCHIVE_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f'Formato no válido: {archive_format}. Use uno de: {", ".join(archive_utils.ARCHIVE_FORMATS)}'
+            }), 400
+
         # Construir rutas completas
         workspace_path = os.path.join('user_workspaces', workspace_id)
         source_path = os.path.join(workspace_path, relative_path)
@@ -417,13 +438,11 @@ def compress_to_zip():
             output_zip_path = os.path.join(workspace_path, relative_output_path)
         else:
             # Si no se especificó una ruta de salida, usar una por defecto
-            if os.path.isdir(source_path):
-                output_zip_path = source_path.rstrip(os.path.sep) + '.zip'
-            else:
-                output_zip_path = source_path + '.zip'
+            output_zip_path = source_path.rstrip(os.path.sep) + '.' + archive_format
 
         # Asegurar que no se salga del directorio del usuario
-        if not os.path.abspath(source_path).startswith(os.path.abspath(workspace_path)):
+        if not os.path.abspath(source_path).startswith(os.path.abspath(workspace_path)) or \
+                not os.path.abspath(output_zip_path).startswith(os.path.abspath(workspace_path)):
             response = jsonify({
                 'success': False,
                 'error': 'Acceso denegado: la ruta se sale del espacio de trabajo'
@@ -431,23 +450,20 @@ def compress_to_zip():
             response.headers['Content-Type'] = 'application/json'
             return response, 403
 
-        # Comprimir en ZIP
-        success, message = file_explorer.create_zip_archive(source_path, output_zip_path, include_root)
+        # Comprimir en el formato solicitado
+        success, message = file_explorer.create_archive(
+            source_path, output_zip_path, include_root, archive_format, compression
+        )
 
         if success:
-            # Obtener la ruta relativa del archivo ZIP generado
-            if output_zip_path:
-                result_path = os.path.relpath(output_zip_path, workspace_path)
-            else:
-                if os.path.isdir(source_path):
-                    result_path = os.path.relpath(source_path + '.zip', workspace_path)
-                else:
-                    result_path = os.path.relpath(source_path + '.zip', workspace_path)
+            # Obtener la ruta relativa del archivo generado
+            result_path = os.path.relpath(output_zip_path, workspace_path)
 
             return jsonify({
                 'success': True,
                 'message': message,
-                'zip_path': result_path
+                'zip_path': result_path,
+                'format': archive_format
             })
         else:
             return jsonify({
@@ -465,20 +481,23 @@ def compress_to_zip():
 @file_explorer_bp.route('/api/explorer/extract', methods=['POST'])
 def extract_compressed():
     """
-    Extrae un archivo comprimido (ZIP o RAR).
+    Extrae un archivo comprimido (ZIP, tar o RAR).
 
     Espera:
     - path: Ruta relativa al archivo comprimido
     - extract_dir: (Opcional) Ruta relativa donde extraer el contenido
+    - background: (Opcional) Si es True, la extracción se hace en segundo plano y se
+      devuelve un job_id para consultar el progreso
     - workspace_id: ID del espacio de trabajo (predeterminado: 'default')
 
     Retorna:
-    - Confirmación de extracción y lista de archivos extraídos
+    - Confirmación de extracción y lista de archivos extraídos (o el trabajo encolado)
     """
     try:
         data = request.json
         relative_path = data.get('path')
         relative_extract_dir = data.get('extract_dir')
+        background = bool(data.get('background', False))
         workspace_id = data.get('workspace_id', 'default')
 
         if not relative_path:
@@ -492,31 +511,43 @@ def extract_compressed():
         file_path = os.path.join(workspace_path, relative_path)
 
         # Si se especificó un directorio de extracción, construirlo
-        extract_dir = None
         if relative_extract_dir:
             extract_dir = os.path.join(workspace_path, relative_extract_dir)
+        else:
+            extract_dir = file_explorer.default_extract_dir(file_path)
 
         # Asegurar que no se salga del directorio del usuario
-        if not os.path.abspath(file_path).startswith(os.path.abspath(workspace_path)):
-            response = jsonify({
-                'success': False,
-                'error': 'Acceso denegado: la ruta se sale del espacio de trabajo'
-            })
-            response.headers['Content-Type'] = 'application/json'
-            return response, 403
+        workspace_abs = os.path.abspath(workspace_path)
+        for path in (file_path, extract_dir):
+            path_abs = os.path.abspath(path)
+            if path_abs != workspace_abs and not path_abs.startswith(workspace_abs + os.sep):
+                response = jsonify({
+                    'success': False,
+                    'error': 'Acceso denegado: la ruta se sale del espacio de trabajo'
+                })
+                response.headers['Content-Type'] = 'application/json'
+                return response, 403
+
+        extract_rel_path = os.path.relpath(extract_dir, workspace_path)
+
+        if background:
+            if not os.path.isfile(file_path):
+                return jsonify({
+                    'success': False,
+                    'error': f'El archivo {relative_path} no existe'
+                }), 404
+            job = extraction_jobs.submit(file_path, extract_dir)
+            return jsonify({
+                'success': True,
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'extract_path': extract_rel_path
+            }), 202
 
         # Extraer archivo comprimido
         success, message, extracted_files = file_explorer.extract_compressed_file(file_path, extract_dir)
 
         if success:
-            # Obtener la ruta relativa del directorio de extracción
-            if extract_dir:
-                extract_rel_path = os.path.relpath(extract_dir, workspace_path)
-            else:
-                # Si no se especificó, se creó uno junto al archivo
-                file_name = os.path.splitext(os.path.basename(file_path))[0]
-                extract_rel_path = os.path.join(os.path.dirname(relative_path), file_name)
-
             return jsonify({
                 'success': True,
                 'message': message,
@@ -536,6 +567,24 @@ def extract_compressed():
         }), 500
 
 
+@file_explorer_bp.route('/api/explorer/extract/jobs/<job_id>', methods=['GET'])
+def get_extract_job(job_id):
+    """
+    Consulta el estado de una extracción en segundo plano.
+
+    Retorna:
+    - Estado del trabajo ('queued', 'processing', 'done' o 'error'), progreso
+      (entradas y bytes extraídos) y, al terminar, la lista de archivos o el error
+    """
+    job = extraction_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Trabajo de extracción no encontrado'
+        }), 404
+    return jsonify({'success': True, 'job': job})
+
+
 @file_explorer_bp.route('/api/explorer/download', methods=['GET'])
 def download_file_or_dir():
     """
@@ -544,9 +593,11 @@ def download_file_or_dir():
     Parámetros de consulta:
     - path: Ruta relativa al archivo o directorio
     - workspace_id: ID del espacio de trabajo (predeterminado: 'default')
+    - compression: Compresión del ZIP de directorios: 'auto' (predeterminado; los archivos
+      ya comprimidos se guardan sin recomprimir), 'deflated' o 'stored'
 
     Retorna:
-    - El archivo para descarga, o un archivo ZIP para directorios
+    - El archivo para descarga, o un archivo ZIP para directorios generado por fragmentos
     """
     try:
         relative_path = request.args.get('path')
@@ -580,38 +631,24 @@ def download_file_or_dir():
         if os.path.isfile(file_path):
             return send_file(file_path, as_attachment=True, download_name=os.path.basename(file_path))
 
-        # Si es un directorio, comprimirlo primero
+        # Si es un directorio, enviarlo como ZIP generado a medida que se recorre
         if os.path.isdir(file_path):
-            # Crear un archivo ZIP temporal
-            with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as temp_file:
-                temp_zip_path = temp_file.name
-
-            # Comprimir el directorio
-            success, message = file_explorer.create_zip_archive(file_path, temp_zip_path, True)
-
-            if success:
-                # Establecer nombre de descarga para el ZIP
-                dir_name = os.path.basename(file_path.rstrip(os.path.sep))
-                download_name = f"{dir_name}.zip"
-
-                # Enviar el archivo y programar su eliminación después
-                return send_file(
-                    temp_zip_path,
-                    as_attachment=True,
-                    download_name=download_name,
-                    # Eliminar archivo temporal después de enviarlo
-                    # Este parámetro no funciona en Flask antiguo, pero sí en versiones recientes
-                    max_age=0
-                )
-            else:
-                # Limpiar si hubo error
-                if os.path.exists(temp_zip_path):
-                    os.unlink(temp_zip_path)
-
+            compression = request.args.get('compression', archive_utils.COMPRESSION_AUTO)
+            if compression not in archive_utils.ZIP_COMPRESSION_MODES:
                 return jsonify({
                     'success': False,
-                    'error': f'Error al comprimir el directorio: {message}'
-                }), 500
+                    'error': f'Modo de compresión no válido: {compression}'
+                }), 400
+
+            # Establecer nombre de descarga para el ZIP
+            dir_name = os.path.basename(os.path.abspath(file_path))
+            download_name = f"{dir_name}.zip"
+
+            return Response(
+                stream_with_context(archive_utils.stream_zip(file_path, True, compression)),
+                mimetype='application/zip',
+                headers=archive_utils.attachment_headers(download_name)
+            )
 
         # Ni archivo ni directorio (no debería llegar aquí)
         return jsonify({
@@ -687,6 +724,7 @@ def upload_file():
         try:
             # Usar el método save proporcionado por werkzeug, que maneja internamente los archivos grandes
             uploaded_file.save(file_path)
+            workspace_index.notify_path_changed(file_path)
             logger.info(f"Archivo {filename} guardado correctamente en {file_path}")
         except Exception as save_error:
             logger.error(f"Error al guardar archivo: {str(save_error)}")
@@ -698,16 +736,14 @@ def upload_file():
             return response, 500
 
         # Si es archivo comprimido y se solicitó extracción (que ahora siempre es falso por defecto)
-        file_ext = os.path.splitext(filename)[1].lower()
-        if extract and file_ext in ['.zip']:
+        if extract and archive_utils.archive_kind(filename) is not None:
             # Extraer archivo
             try:
                 success, message, extracted_files = file_explorer.extract_compressed_file(file_path)
 
                 if success:
                     # Obtener la ruta relativa del directorio de extracción
-                    file_name = os.path.splitext(filename)[0]
-                    extract_rel_path = os.path.join(relative_path, file_name)
+                    extract_rel_path = os.path.relpath(file_explorer.default_extract_dir(file_path), workspace_path)
 
                     response = jsonify({
                         'success': True,
@@ -821,6 +857,7 @@ def delete_file_or_directory():
                 else:
                     os.remove(target_path)
                     logger.info(f"Successfully deleted file: {target_path}")
+                workspace_index.notify_path_changed(target_path)
                 return jsonify({'success': True, 'message': f'Deleted {path}'})
             except PermissionError as pe:
                 logger.error(f"Permission denied when deleting {target_path}: {str(pe)}")
@@ -840,7 +877,9 @@ def delete_file_or_directory():
 def upload_chunk():
     """
     Sube un fragmento de archivo al espacio de trabajo.
-    Esta ruta está diseñada para subir archivos grandes en fragmentos.
+    Esta ruta está diseñada para subir archivos grandes en fragmentos. Se mantiene por
+    compatibilidad; los clientes nuevos deben usar las sesiones de /api/explorer/uploads,
+    que escriben cada fragmento en su posición y permiten reanudar la subida.
 
     Form data:
     - chunk: Fragmento de archivo a subir
@@ -916,6 +955,7 @@ def upload_chunk():
                     chunk_file_path = os.path.join(temp_dir, f"chunk_{i}")
                     with open(chunk_file_path, 'rb') as cf:
                         final_file.write(cf.read())
+            workspace_index.notify_path_changed(final_path)
 
             # Limpiar fragmentos temporales
             import shutil
@@ -948,7 +988,170 @@ def upload_chunk():
             'error': f'Error al subir fragmento: {str(e)}'
         }), 500
 
+
+def _upload_session_error(error: upload_sessions.UploadSessionError):
+    """Respuesta JSON para un error de una sesión de subida."""
+    response = {'success': False, 'error': str(error)}
+    if error.session is not None:
+        response['upload'] = error.session
+    return jsonify(response), error.status_code
+
+
+@file_explorer_bp.route('/api/explorer/uploads', methods=['POST'])
+def create_upload_session():
+    """
+    Crea una sesión de subida reanudable con el archivo preasignado.
+
+    Espera (JSON):
+    - filename: Nombre del archivo a crear
+    - size: Tamaño total del archivo en bytes
+    - sha256: (Opcional) Hash SHA-256 del archivo completo, verificado al terminar
+    - chunk_size: (Opcional) Tamaño de fragmento preferido
+    - path: Ruta relativa donde guardar el archivo (predeterminado: '.')
+    - workspace_id: ID del espacio de trabajo (predeterminado: 'default')
+
+    Retorna:
+    - upload_id, chunk_size y los rangos [inicio, fin) que faltan por enviar
+    """
+    try:
+        data = request.json or {}
+        filename = secure_filename(data.get('filename', ''))
+        relative_path = data.get('path', '.')
+        workspace_id = data.get('workspace_id', 'default')
+
+        if not filename:
+            return jsonify({
+                'success': False,
+                'error': 'El nombre del archivo es obligatorio'
+            }), 400
+
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'El tamaño del archivo es obligatorio'
+            }), 400
+
+        # Construir ruta completa
+        workspace_path = os.path.join('user_workspaces', workspace_id)
+        target_dir = os.path.join(workspace_path, relative_path)
+
+        # Asegurar que no se salga del directorio del usuario
+        if not os.path.abspath(target_dir).startswith(os.path.abspath(workspace_path)):
+            return jsonify({
+                'success': False,
+                'error': 'Acceso denegado: la ruta se sale del espacio de trabajo'
+            }), 403
+
+        upload = upload_sessions.create_session(
+            target_dir, filename, size, data.get('sha256'), data.get('chunk_size')
+        )
+        return jsonify({'success': True, 'upload': upload}), 201
+    except upload_sessions.UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        logger.error(f"Error al crear la sesión de subida: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error al crear la sesión de subida: {str(e)}'
+        }), 500
+
+
+@file_explorer_bp.route('/api/explorer/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """
+    Devuelve el estado de una sesión de subida, con los rangos que faltan para reanudarla.
+    """
+    try:
+        return jsonify({'success': True, 'upload': upload_sessions.get_session(upload_id)})
+    except upload_sessions.UploadSessionError as e:
+        return _upload_session_error(e)
+
+
+@file_explorer_bp.route('/api/explorer/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """
+    Escribe un fragmento en su posición del archivo.
+
+    Parámetros de consulta:
+    - offset: Posición del fragmento en bytes
+
+    Cabeceras:
+    - X-Chunk-SHA256: (Opcional) Hash SHA-256 del fragmento; si no coincide no se acepta
+
+    El cuerpo de la petición son los bytes del fragmento.
+
+    Retorna:
+    - Estado de la sesión tras el fragmento
+    """
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({
+                'success': False,
+                'error': 'Debe indicar la posición del fragmento (offset)'
+            }), 400
+
+        upload = upload_sessions.write_chunk(
+            upload_id, offset, request.stream, request.content_length,
+            request.headers.get('X-Chunk-SHA256')
+        )
+        return jsonify({'success': True, 'upload': upload})
+    except upload_sessions.UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        logger.error(f"Error al escribir fragmento de la subida {upload_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error al subir fragmento: {str(e)}'
+        }), 500
+
+
+@file_explorer_bp.route('/api/explorer/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """
+    Verifica el archivo completo (todos los rangos y el SHA-256) y lo mueve a su destino.
+
+    Retorna:
+    - Ruta relativa del archivo y su SHA-256
+    """
+    try:
+        result = upload_sessions.complete_session(upload_id)
+        workspace_index.notify_path_changed(result['path'])
+
+        workspace_root = os.path.abspath('user_workspaces')
+        file_path = os.path.relpath(result['path'], workspace_root).split(os.sep, 1)[-1]
+        return jsonify({
+            'success': True,
+            'message': f'Archivo "{result["filename"]}" subido y verificado correctamente',
+            'file_path': file_path,
+            'size': result['size'],
+            'sha256': result['sha256'],
+            'completed': True,
+            'is_zip': os.path.splitext(result['filename'])[1].lower() == '.zip'
+        })
+    except upload_sessions.UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        logger.error(f"Error al completar la subida {upload_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Error al completar la subida: {str(e)}'
+        }), 500
+
+
+@file_explorer_bp.route('/api/explorer/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload_session(upload_id):
+    """Cancela una sesión de subida y elimina los datos recibidos."""
+    try:
+        upload_sessions.abort_session(upload_id)
+        return jsonify({'success': True, 'message': 'Subida cancelada'})
+    except upload_sessions.UploadSessionError as e:
+        return _upload_session_error(e)
+
+
 def register_file_explorer_routes(app):
     """Registra las rutas de exploración de archivos en la aplicación Flask."""
     app.register_blueprint(file_explorer_bp)
-    logger.info("Rutas de exploración de archivos registradas correctamente")
\ No newline at end of file
+    logger.info("Rutas de exploración de archivos registradas correctamente")
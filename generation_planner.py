@@ -0,0 +1,183 @@
+"""
+Planificador de generación de archivos del Constructor de Tareas para Codestorm Assistant.
+Construye un grafo de dependencias sobre la estructura planificada de un proyecto (los
+componentes antes que las páginas, la configuración independiente del código, ...) y
+genera en paralelo los archivos cuyas dependencias ya están listas, con un límite de
+generaciones simultáneas compartido por todas las construcciones del proceso.
+"""
+import os
+import fnmatch
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+# Reglas de dependencia: (patrón del archivo, patrones de los archivos de los que depende).
+# Los patrones se comparan con la ruta relativa completa (separador '/'); '*' abarca
+# también subdirectorios.
+DEPENDENCY_RULES = [
+    # Frontend: las páginas usan componentes; App los monta y el punto de entrada carga App
+    ('*pages/*', ['*components/*']),
+    ('*App.js', ['*pages/*', '*components/*', '*App.css']),
+    ('*App.jsx', ['*pages/*', '*components/*', '*App.css']),
+    ('*App.vue', ['*views/*', '*components/*']),
+    ('*views/*', ['*components/*']),
+    ('src/index.js', ['src/App.js', 'src/App.jsx']),
+    ('src/main.js', ['src/App.vue']),
+    # Backend: las rutas usan los modelos y la aplicación lo registra todo
+    ('*routes/*', ['*models/*', 'config.py']),
+    ('*views.py', ['*models.py', '*models/*']),
+    ('app.py', ['config.py', '*routes/*', '*models/*']),
+    ('main.py', ['config.py', '*routes/*', '*models/*']),
+    # Plantillas que extienden la base
+    ('*templates/*', ['*templates/base.html']),
+]
+
+
+def _get_concurrency() -> int:
+    try:
+        return max(1, int(os.environ.get('CONSTRUCTOR_GENERATION_CONCURRENCY', DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_CONCURRENCY
+
+
+# Generaciones simultáneas en todo el proceso (cada una es, en producción, una llamada a la IA)
+_generation_slots = threading.BoundedSemaphore(_get_concurrency())
+
+
+def _normalize(path: str) -> str:
+    return path.replace(os.sep, '/')
+
+
+def build_dependency_graph(paths: List[str]) -> Dict[str, List[str]]:
+    """
+    Construye el grafo de dependencias entre los archivos planificados.
+
+    Un módulo de un paquete Python depende además del __init__.py de su directorio. Las
+    dependencias que formarían un ciclo se descartan.
+
+    Args:
+        paths: Rutas relativas de los archivos, en el orden planificado
+
+    Returns:
+        dict: Ruta -> lista de rutas de las que depende (en el orden planificado)
+    """
+    graph = {}
+    for path in paths:
+        normalized = _normalize(path)
+        dependencies = []
+        for pattern, dependency_patterns in DEPENDENCY_RULES:
+            if not fnmatch.fnmatch(normalized, pattern):
+                continue
+            for other in paths:
+                if other == path or other in dependencies:
+                    continue
+                if any(fnmatch.fnmatch(_normalize(other), dependency) for dependency in dependency_patterns):
+                    dependencies.append(other)
+        if normalized.endswith('.py') and os.path.basename(normalized) != '__init__.py':
+            package_init = os.path.join(os.path.dirname(path), '__init__.py')
+            if package_init in paths and package_init not in dependencies:
+                dependencies.append(package_init)
+        graph[path] = dependencies
+
+    _drop_cycles(graph)
+    return graph
+
+
+def _drop_cycles(graph: Dict[str, List[str]]):
+    """Elimina las dependencias que cierran un ciclo (búsqueda en profundidad)."""
+    visiting, done = set(), set()
+
+    def visit(path):
+        visiting.add(path)
+        for dependency in list(graph[path]):
+            if dependency in visiting:
+                logger.warning(f"Dependencia circular ignorada: {path} -> {dependency}")
+                graph[path].remove(dependency)
+            elif dependency not in done:
+                visit(dependency)
+        visiting.discard(path)
+        done.add(path)
+
+    for path in graph:
+        if path not in done:
+            visit(path)
+
+
+def critical_path_length(graph: Dict[str, List[str]]) -> int:
+    """Número de archivos de la cadena de dependencias más larga del grafo."""
+    depth = {}
+
+    def path_depth(path):
+        if path not in depth:
+            depth[path] = 1 + max((path_depth(dependency) for dependency in graph[path]), default=0)
+        return depth[path]
+
+    return max((path_depth(path) for path in graph), default=0)
+
+
+def generate(graph: Dict[str, List[str]], task: Callable[[str, Dict[str, str]], str],
+             on_done: Callable[[str, str], None], checkpoint: Optional[Callable[[], None]] = None,
+             max_workers: Optional[int] = None) -> List[str]:
+    """
+    Genera los archivos del grafo en paralelo respetando sus dependencias.
+
+    task se ejecuta en los hilos del pool y recibe la ruta y el contenido ya generado de
+    sus dependencias; on_done y checkpoint se ejecutan en el hilo que llama, en el orden
+    en que terminan los archivos. Si una tarea falla no se lanzan más, se espera a las
+    que están en curso y se propaga el error.
+
+    Args:
+        graph: Grafo devuelto por build_dependency_graph
+        task: Función (ruta, contexto) -> contenido que genera y guarda un archivo
+        on_done: Función (ruta, contenido) llamada al terminar cada archivo
+        checkpoint: Función llamada antes de lanzar cada tanda (p. ej. para esperar si
+                    la construcción está pausada)
+        max_workers: Tamaño del pool (por defecto CONSTRUCTOR_GENERATION_CONCURRENCY)
+
+    Returns:
+        list: Rutas en el orden en que se completaron
+    """
+    pending = {path: set(dependencies) for path, dependencies in graph.items()}
+    contents = {}
+    completed = []
+
+    def run_task(path, context):
+        with _generation_slots:
+            return task(path, context)
+
+    with ThreadPoolExecutor(max_workers=max_workers or _get_concurrency(),
+                            thread_name_prefix="constructor-gen") as executor:
+        running = {}
+        while pending or running:
+            ready = [path for path, dependencies in pending.items() if not dependencies]
+            if ready:
+                if checkpoint:
+                    checkpoint()
+                for path in ready:
+                    del pending[path]
+                    context = {dependency: contents[dependency] for dependency in graph[path]}
+                    running[executor.submit(run_task, path, context)] = path
+
+            if not running:
+                raise RuntimeError(f"Archivos con dependencias sin resolver: {', '.join(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    # No lanzar más archivos; las tareas en curso terminan al salir del pool
+                    for other in running:
+                        other.cancel()
+                    raise error
+                contents[path] = future.result()
+                completed.append(path)
+                for dependencies in pending.values():
+                    dependencies.discard(path)
+                on_done(path, contents[path])
+
+    return completed
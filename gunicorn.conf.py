@@ -0,0 +1,18 @@
+"""
+Configuración de gunicorn para Codestorm Assistant (se carga sola con `gunicorn main:app`).
+
+El seguimiento en directo del Constructor (/api/constructor/projects/<id>/stream) mantiene
+abierta una respuesta por pestaña: con el worker síncrono por defecto cada pestaña
+ocuparía el único worker y el árbitro lo mataría al agotar el timeout. Con gthread cada
+conexión ocupa solo un hilo.
+
+Los eventos del Constructor y la cola de construcciones en memoria son propios de cada
+proceso, así que por defecto se usa un único worker: con varios, el seguimiento de una
+construcción solo funciona si la petición llega al proceso que la ejecuta.
+"""
+import os
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
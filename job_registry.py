@@ -0,0 +1,83 @@
+"""
+Registro de trabajos en segundo plano para Codestorm Assistant.
+Lo comparten la ingesta de documentos, la extracción de archivos comprimidos, la
+ejecución de comandos y el planificador de construcciones: guarda los trabajos de un
+proceso por ID, conserva los terminados un tiempo para poder consultarlos y avisa a
+quien espera cada vez que uno cambia.
+"""
+import time
+import threading
+
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+
+# Tiempo que se conservan los trabajos terminados para poder consultarlos
+FINISHED_JOB_TTL = 3600
+
+
+class JobRegistry:
+    """Trabajos en memoria indexados por 'job_id', con expiración de los terminados."""
+
+    def __init__(self, ttl=FINISHED_JOB_TTL, on_expire=None):
+        """
+        Inicializa el registro.
+
+        Args:
+            ttl: Segundos que se conserva un trabajo desde su 'finished_at'
+            on_expire: Función llamada como on_expire(job_id) al descartar un trabajo
+                       (con el lock tomado), para limpiar el estado asociado
+        """
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # Se notifica en cada update(); los módulos la usan también para sus propios cambios
+        self.changed = threading.Condition(self.lock)
+        self._on_expire = on_expire
+
+    def prune(self, now=None):
+        """Descarta los trabajos terminados hace más de ttl (llamar con el lock tomado)."""
+        now = time.time() if now is None else now
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.get('finished_at') and now - job['finished_at'] > self.ttl
+        ]
+        for job_id in expired:
+            self.jobs.pop(job_id, None)
+            if self._on_expire is not None:
+                self._on_expire(job_id)
+
+    def add(self, job):
+        """Registra un trabajo nuevo, descartando antes los expirados."""
+        with self.lock:
+            self.prune()
+            self.jobs[job['job_id']] = job
+
+    def update(self, job_id, **changes):
+        """
+        Aplica cambios a un trabajo y avisa a quien espera en changed.
+
+        Returns:
+            bool: False si el trabajo no existe (p. ej. ya expiró)
+        """
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.update(changes)
+            self.changed.notify_all()
+            return True
+
+    def get(self, job_id):
+        """
+        Devuelve el estado de un trabajo.
+
+        Returns:
+            dict o None: Copia del trabajo, o None si no existe
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
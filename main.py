@@ -7,6 +7,7 @@ import os
 import logging
 from flask import Flask, render_template #Added flask import
 from routes_analyzer import register_analyzer_routes
+from command_routes import register_command_routes
 from document_routes import register_document_routes
 from github_routes import register_github_routes
 from file_explorer_routes import register_file_explorer_routes
@@ -22,6 +23,9 @@ os.makedirs('user_workspaces/context_documents', exist_ok=True)
 # Registrar las rutas del analizador de proyectos
 register_analyzer_routes(app, get_user_workspace)
 
+# Registrar las rutas de comandos en segundo plano
+register_command_routes(app, get_user_workspace)
+
 # Registrar las rutas para manejo de documentos
 try:
     register_document_routes(app)
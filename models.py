@@ -53,4 +53,41 @@ class Command(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
     def __repr__(self):
-        return f'<Command {self.generated_command[:20]}...>'
\ No newline at end of file
+        return f'<Command {self.generated_command[:20]}...>'
+
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+
+    id = db.Column(db.String(64), primary_key=True)
+    agent_id = db.Column(db.String(50), nullable=True)
+    summary = db.Column(db.Text, nullable=True)
+    summarized_count = db.Column(db.Integer, nullable=False, default=0)
+    document_source = db.Column(db.String(256), nullable=True)
+    document_content = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relaciones
+    messages = db.relationship('ConversationMessage', backref='conversation', lazy=True,
+                               order_by='ConversationMessage.position')
+
+    def __repr__(self):
+        return f'<Conversation {self.id}>'
+
+class ConversationMessage(db.Model):
+    __tablename__ = 'conversation_messages'
+    __table_args__ = (db.UniqueConstraint('conversation_id', 'position'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.String(64), db.ForeignKey('conversations.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    agent_id = db.Column(db.String(50), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {'role': self.role, 'content': self.content}
+
+    def __repr__(self):
+        return f'<ConversationMessage {self.conversation_id}#{self.position}>'
@@ -8,6 +8,8 @@ import json
 import logging
 from pathlib import Path
 
+import workspace_index
+
 logger = logging.getLogger(__name__)
 
 def analyze_project_structure(project_path):
@@ -20,9 +22,11 @@ def analyze_project_structure(project_path):
     Returns:
         dict: Información del proyecto incluyendo tipo, archivos presentes y recomendaciones
     """
-    # Obtener lista de archivos en el proyecto
+    # Obtener lista de archivos en el proyecto (desde el índice del workspace si lo cubre)
+    index = workspace_index.find_workspace_index(project_path)
+    walker = index.walk(project_path) if index else None
     files = []
-    for root, dirs, filenames in os.walk(project_path):
+    for root, dirs, filenames in (walker or os.walk(project_path)):
         # Eliminar directorios que queremos ignorar
         dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'venv' and d != 'node_modules' and d != '__pycache__']
         
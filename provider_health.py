@@ -0,0 +1,255 @@
+"""
+Seguimiento de salud y circuit breaker por proveedor de IA para Codestorm Assistant.
+Registra el resultado y la latencia de cada llamada, abre el circuito de un proveedor
+cuando falla de forma repetida o devuelve límites de tasa, y lo vuelve a probar con una
+única petición (estado semiabierto) cuando termina el periodo de espera.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+RATE_LIMIT_PATTERN = re.compile(r"rate.?limit|429|quota|too many requests|límite de (?:solicitudes|cuota)", re.IGNORECASE)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def is_rate_limit_error(error):
+    """Indica si una excepción corresponde a un límite de tasa del proveedor."""
+    if type(error).__name__ == "RateLimitError":
+        return True
+    return bool(RATE_LIMIT_PATTERN.search(str(error)))
+
+
+class ProviderHealth:
+    """Estado de salud y circuit breaker de un proveedor."""
+
+    def __init__(self, name, window_size=20, min_samples=10, error_rate_threshold=0.5,
+                 failure_threshold=5, cooldown=30.0, max_cooldown=300.0,
+                 rate_limit_cooldown=60.0, probe_timeout=60.0):
+        self.name = name
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self.error_rate_threshold = error_rate_threshold
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.probe_timeout = probe_timeout
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window_size)  # (éxito, latencia)
+        self._state = STATE_CLOSED
+        self._cooldown = cooldown
+        self._opened_until = 0.0
+        self._probe_started = None
+        self.consecutive_failures = 0
+        self.rate_limited_at = None
+        self.last_error = None
+
+    def _current_state(self, now):
+        if self._state == STATE_OPEN and now >= self._opened_until:
+            self._state = STATE_HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.time())
+
+    def allow_request(self):
+        """
+        Indica si se puede enviar una petición al proveedor.
+
+        En estado semiabierto solo se deja pasar una petición de prueba a la vez.
+        """
+        now = time.time()
+        with self._lock:
+            state = self._current_state(now)
+            if state == STATE_CLOSED:
+                return True
+            if state == STATE_OPEN:
+                return False
+            if self._probe_started is None or now - self._probe_started > self.probe_timeout:
+                self._probe_started = now
+                logger.info(f"Proveedor {self.name} en estado semiabierto: enviando petición de prueba")
+                return True
+            return False
+
+    def record_success(self, latency):
+        """Registra una llamada correcta y su latencia en segundos."""
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                # Al recuperarse se descarta la ventana de errores que abrió el circuito
+                logger.info(f"Proveedor {self.name} recuperado, cerrando el circuito")
+                self._outcomes.clear()
+            self._outcomes.append((True, latency))
+            self.consecutive_failures = 0
+            self._state = STATE_CLOSED
+            self._cooldown = self.base_cooldown
+            self._probe_started = None
+
+    def release_probe(self):
+        """Libera la petición de prueba reservada por una llamada abandonada sin resultado."""
+        with self._lock:
+            self._probe_started = None
+
+    def record_failure(self, error, latency):
+        """Registra una llamada fallida y decide si hay que abrir el circuito."""
+        now = time.time()
+        rate_limited = is_rate_limit_error(error)
+        with self._lock:
+            self._outcomes.append((False, latency))
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if rate_limited:
+                self.rate_limited_at = now
+
+            state = self._current_state(now)
+            if state == STATE_HALF_OPEN:
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+                self._open(now, self._cooldown, "falló la petición de prueba")
+            elif rate_limited:
+                self._open(now, max(self._cooldown, self.rate_limit_cooldown), "límite de tasa alcanzado")
+            elif state == STATE_CLOSED and self._should_trip():
+                self._open(now, self._cooldown, "demasiados errores recientes")
+
+    def _should_trip(self):
+        if self.consecutive_failures >= self.failure_threshold:
+            return True
+        if len(self._outcomes) < self.min_samples:
+            return False
+        errors = sum(1 for success, _ in self._outcomes if not success)
+        return errors / len(self._outcomes) >= self.error_rate_threshold
+
+    def _open(self, now, cooldown, reason):
+        self._state = STATE_OPEN
+        self._opened_until = now + cooldown
+        self._probe_started = None
+        logger.warning(f"Circuito abierto para {self.name} durante {cooldown:.0f}s: {reason}")
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(1 for success, _ in self._outcomes if not success) / len(self._outcomes)
+
+    def p95_latency(self):
+        """Latencia p95 (segundos) de las llamadas correctas recientes, o None sin datos."""
+        with self._lock:
+            latencies = sorted(latency for success, latency in self._outcomes if success)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+
+    def snapshot(self):
+        """Devuelve un resumen serializable del estado del proveedor."""
+        now = time.time()
+        state = self.state
+        p95 = self.p95_latency()
+        with self._lock:
+            samples = len(self._outcomes)
+            opened_for = max(0.0, self._opened_until - now) if state == STATE_OPEN else 0.0
+            consecutive_failures = self.consecutive_failures
+            rate_limited_at = self.rate_limited_at
+            last_error = self.last_error
+        return {
+            'state': state,
+            'samples': samples,
+            'error_rate': round(self.error_rate(), 3),
+            'p95_latency': round(p95, 3) if p95 is not None else None,
+            'consecutive_failures': consecutive_failures,
+            'retry_in': round(opened_for, 1),
+            'rate_limited_at': rate_limited_at,
+            'last_error': last_error
+        }
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_provider_health(provider):
+    """Obtiene (o crea) el estado de salud de un proveedor."""
+    with _registry_lock:
+        health = _registry.get(provider)
+        if health is None:
+            health = ProviderHealth(
+                provider,
+                failure_threshold=int(_env_float('AI_BREAKER_FAILURE_THRESHOLD', 5)),
+                error_rate_threshold=_env_float('AI_BREAKER_ERROR_RATE', 0.5),
+                cooldown=_env_float('AI_BREAKER_COOLDOWN', 30.0),
+                rate_limit_cooldown=_env_float('AI_BREAKER_RATE_LIMIT_COOLDOWN', 60.0)
+            )
+            _registry[provider] = health
+        return health
+
+
+def rank_providers(preferred, providers):
+    """
+    Ordena los proveedores para una petición según su salud.
+
+    El proveedor solicitado va primero si su circuito no está abierto; el resto se
+    ordena poniendo primero los cerrados y después por latencia p95. Los proveedores
+    con el circuito abierto se excluyen.
+
+    Args:
+        preferred: Proveedor solicitado por el usuario
+        providers: Proveedores configurados
+
+    Returns:
+        list: Proveedores en el orden en que deben probarse
+    """
+    candidates = [p for p in providers if get_provider_health(p).state != STATE_OPEN]
+
+    def sort_key(provider):
+        health = get_provider_health(provider)
+        p95 = health.p95_latency()
+        return (
+            0 if provider == preferred else 1,
+            0 if health.state == STATE_CLOSED else 1,
+            p95 if p95 is not None else 0.0
+        )
+
+    return sorted(candidates, key=sort_key)
+
+
+def allow_request(provider):
+    """Indica si se puede enviar una petición al proveedor (reserva la prueba en semiabierto)."""
+    return get_provider_health(provider).allow_request()
+
+
+def record_success(provider, latency):
+    """Registra una llamada correcta a un proveedor."""
+    get_provider_health(provider).record_success(latency)
+
+
+def record_failure(provider, error, latency):
+    """Registra una llamada fallida a un proveedor."""
+    get_provider_health(provider).record_failure(error, latency)
+
+
+def release_probe(provider):
+    """Libera la prueba en semiabierto de una llamada que se abandonó sin resultado."""
+    get_provider_health(provider).release_probe()
+
+
+def get_health_report():
+    """Devuelve el estado de salud de todos los proveedores conocidos."""
+    with _registry_lock:
+        providers = list(_registry.items())
+    return {name: health.snapshot() for name, health in providers}
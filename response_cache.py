@@ -0,0 +1,188 @@
+"""
+Caché de respuestas de los modelos de IA para Codestorm Assistant.
+Guarda las respuestas de llamadas deterministas (temperatura baja) indexadas por un hash
+de su contenido, con un nivel en memoria (LRU + TTL) y un nivel opcional en SQLite.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(provider, model_name, system_prompt, prompt, temperature, use_json):
+    """
+    Calcula la clave de caché para una llamada a un modelo.
+
+    Returns:
+        str: Hash SHA-256 de los parámetros de la llamada
+    """
+    payload = json.dumps(
+        [provider, model_name, system_prompt, prompt, round(float(temperature), 3), bool(use_json)],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Caché LRU con expiración y persistencia opcional en SQLite."""
+
+    def __init__(self, max_entries=512, ttl=3600, db_path=None):
+        """
+        Inicializa la caché.
+
+        Args:
+            max_entries: Número máximo de respuestas en memoria
+            ttl: Tiempo de vida de cada entrada en segundos
+            db_path: Ruta del fichero SQLite para el nivel persistente (opcional)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                with closing(self._connect()) as conn, conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS responses ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                    )
+            except Exception as e:
+                logger.error(f"No se pudo inicializar la caché en disco ({self.db_path}): {str(e)}")
+                self.db_path = None
+
+    def _connect(self):
+        """
+        Abre una conexión al fichero SQLite.
+
+        Se usa como closing(self._connect()) junto con "with conn:", porque el gestor de
+        contexto de sqlite3 solo confirma la transacción y no cierra la conexión.
+        """
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def get(self, key):
+        """
+        Obtiene una respuesta de la caché.
+
+        Returns:
+            str o None: La respuesta guardada, o None si no existe o ha expirado
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.db_path:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    row = conn.execute(
+                        "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                if row and row[1] > now:
+                    with self._lock:
+                        self.disk_hits += 1
+                        self._store_memory(key, row[0], row[1])
+                    return row[0]
+            except Exception as e:
+                logger.warning(f"Error al leer la caché en disco: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Guarda una respuesta en la caché."""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store_memory(key, value, expires_at)
+
+        if self.db_path:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at)
+                    )
+                    conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            except Exception as e:
+                logger.warning(f"Error al escribir en la caché en disco: {str(e)}")
+
+    def _store_memory(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Vacía la caché en memoria y en disco."""
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute("DELETE FROM responses")
+            except Exception as e:
+                logger.warning(f"Error al vaciar la caché en disco: {str(e)}")
+
+    def stats(self):
+        """Devuelve los contadores de uso de la caché."""
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'persistent': bool(self.db_path),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / total, 3) if total else 0.0
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Obtiene la caché de respuestas compartida por el proceso.
+
+    Se configura con las variables de entorno AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL
+    y AI_CACHE_DB (ruta del fichero SQLite; sin ella la caché solo vive en memoria).
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_entries=int(os.environ.get('AI_CACHE_MAX_ENTRIES', 512)),
+                ttl=int(os.environ.get('AI_CACHE_TTL', 3600)),
+                db_path=os.environ.get('AI_CACHE_DB') or None
+            )
+        return _response_cache
+
+
+def get_max_cacheable_temperature():
+    """Temperatura máxima para la que se cachean respuestas (AI_CACHE_MAX_TEMPERATURE)."""
+    try:
+        return float(os.environ.get('AI_CACHE_MAX_TEMPERATURE', 0.3))
+    except ValueError:
+        return 0.3
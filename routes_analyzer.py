@@ -8,6 +8,7 @@ import json
 import logging
 from flask import jsonify, request
 import project_analyzer
+import workspace_index
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +64,7 @@ def register_analyzer_routes(app, get_workspace_fn):
                 }), 404
             
             # Analizar el proyecto
+            workspace_index.get_workspace_index(workspace)
             analysis = project_analyzer.analyze_project_structure(target_path)
             next_steps = project_analyzer.get_next_steps(target_path)
             
@@ -0,0 +1,321 @@
+"""
+Límites de recursos para los comandos del workspace en Codestorm Assistant.
+Cada comando se ejecuta con límites de tiempo de CPU, memoria, procesos, tamaño de archivo
+y prioridad. Si SANDBOX_CGROUP_ROOT apunta a un cgroup v2 delegado (con los controladores
+memory, pids y cpu habilitados), cada comando tiene su propio cgroup y los límites cubren
+a todos sus procesos; si no, se aplican rlimits por proceso. Al terminar se informa del
+uso de recursos del comando.
+"""
+import os
+import time
+import signal
+import logging
+import subprocess
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Límites por defecto (se pueden cambiar con las variables de entorno SANDBOX_*)
+DEFAULT_LIMITS = {
+    'cpu_seconds': 300,        # Tiempo de CPU de cada proceso
+    'memory_mb': 2048,         # Memoria del cgroup, o memoria de datos por proceso (rlimit)
+    'max_processes': 256,      # Procesos e hilos simultáneos (solo con cgroup)
+    'cpu_percent': 100,        # Cuota de CPU del cgroup (100 = un núcleo)
+    'file_size_mb': 1024,      # Tamaño máximo de un archivo escrito
+    'output_mb': 16,           # Salida total (stdout + stderr) que se acepta
+    'nice': 10                 # Prioridad más baja que la del servidor
+}
+
+LIMIT_ENV_VARS = {
+    'cpu_seconds': 'SANDBOX_CPU_SECONDS',
+    'memory_mb': 'SANDBOX_MEMORY_MB',
+    'max_processes': 'SANDBOX_MAX_PROCESSES',
+    'cpu_percent': 'SANDBOX_CPU_PERCENT',
+    'file_size_mb': 'SANDBOX_FILE_SIZE_MB',
+    'output_mb': 'SANDBOX_OUTPUT_MB',
+    'nice': 'SANDBOX_NICE'
+}
+
+LIMIT_CPU = "cpu"
+LIMIT_MEMORY = "memory"
+LIMIT_OUTPUT = "output"
+LIMIT_TIME = "time"
+
+CGROUP_PERIOD_USEC = 100000
+# Intervalo con el que se comprueba si el proceso ha terminado
+POLL_INTERVAL = 0.05
+
+_cgroup_warning_logged = False
+
+
+def get_limits(overrides=None):
+    """
+    Devuelve los límites efectivos: valores por defecto, variables de entorno y, por
+    último, los valores indicados (solo pueden endurecer los límites configurados).
+
+    Args:
+        overrides: Diccionario opcional con límites más estrictos para un comando
+
+    Returns:
+        dict: Límites con las claves de DEFAULT_LIMITS
+    """
+    limits = {}
+    for key, default in DEFAULT_LIMITS.items():
+        try:
+            limits[key] = max(0, int(os.environ.get(LIMIT_ENV_VARS[key], default)))
+        except ValueError:
+            limits[key] = default
+    for key, value in (overrides or {}).items():
+        if key not in limits or value is None:
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            continue
+        if key == 'nice':
+            limits[key] = max(limits[key], value)
+        elif value > 0:
+            limits[key] = min(limits[key], value) if limits[key] else value
+    return limits
+
+
+def _cgroup_root():
+    """Devuelve el cgroup v2 delegado para los comandos, o None si no está disponible."""
+    global _cgroup_warning_logged
+    root = os.environ.get('SANDBOX_CGROUP_ROOT')
+    if not root:
+        return None
+    try:
+        with open(os.path.join(root, 'cgroup.subtree_control')) as f:
+            controllers = f.read().split()
+        if os.access(root, os.W_OK) and {'memory', 'pids'} <= set(controllers):
+            return root
+        problem = f"controladores habilitados: {controllers}"
+    except OSError as e:
+        problem = str(e)
+    if not _cgroup_warning_logged:
+        _cgroup_warning_logged = True
+        logger.warning(f"SANDBOX_CGROUP_ROOT={root} no es un cgroup v2 utilizable ({problem}); "
+                       "se usarán rlimits por proceso")
+    return None
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(str(value))
+
+
+def _read_int(path, key=None):
+    """Lee un valor numérico de un archivo del cgroup (o una clave de un archivo 'clave valor')."""
+    try:
+        with open(path) as f:
+            if key is None:
+                value = f.read().strip()
+                return None if value == 'max' else int(value)
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _set_rlimit(kind, soft, hard):
+    """Aplica un rlimit sin pasar del límite duro que ya tenga el proceso."""
+    _, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        hard = min(hard, current_hard)
+        soft = min(soft, hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+class Sandbox:
+    """Límites y medición de recursos de un comando."""
+
+    def __init__(self, name, limits=None):
+        """
+        Args:
+            name: Nombre único del comando (se usa para su cgroup)
+            limits: Límites a aplicar (por defecto get_limits())
+        """
+        self.limits = limits or get_limits()
+        self.cgroup = None
+        self.rusage = None
+        self.exit_status = None
+        self._started_at = None
+        root = _cgroup_root()
+        if root is not None:
+            path = os.path.join(root, f"cmd-{name}")
+            try:
+                os.mkdir(path)
+                self._configure_cgroup(path)
+                self.cgroup = path
+            except OSError as e:
+                logger.warning(f"No se pudo crear el cgroup {path}, se usarán rlimits: {str(e)}")
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+
+    def _configure_cgroup(self, path):
+        limits = self.limits
+        if limits['memory_mb']:
+            _write(os.path.join(path, 'memory.max'), limits['memory_mb'] * 1024 * 1024)
+            # Sin swap, para que el límite de memoria sea efectivo
+            if os.path.exists(os.path.join(path, 'memory.swap.max')):
+                _write(os.path.join(path, 'memory.swap.max'), 0)
+        if limits['max_processes']:
+            _write(os.path.join(path, 'pids.max'), limits['max_processes'])
+        if limits['cpu_percent'] and os.path.exists(os.path.join(path, 'cpu.max')):
+            quota = CGROUP_PERIOD_USEC * limits['cpu_percent'] // 100
+            _write(os.path.join(path, 'cpu.max'), f"{quota} {CGROUP_PERIOD_USEC}")
+
+    def preexec(self):
+        """
+        Se ejecuta en el proceso hijo antes del comando (preexec_fn de Popen).
+
+        Solo hace llamadas al sistema, sin tomar bloqueos de Python.
+        """
+        if self.cgroup is not None:
+            # Entrar en el cgroup antes del exec para que todos los descendientes queden dentro
+            fd = os.open(os.path.join(self.cgroup, 'cgroup.procs'), os.O_WRONLY)
+            try:
+                os.write(fd, str(os.getpid()).encode())
+            finally:
+                os.close(fd)
+        if resource is not None:
+            limits = self.limits
+            if limits['cpu_seconds']:
+                # SIGXCPU al llegar al límite blando y SIGKILL poco después
+                _set_rlimit(resource.RLIMIT_CPU, limits['cpu_seconds'], limits['cpu_seconds'] + 5)
+            if limits['memory_mb'] and self.cgroup is None:
+                # RLIMIT_DATA y no RLIMIT_AS: Node y la JVM reservan mucho espacio de
+                # direcciones que no llegan a usar
+                data_bytes = limits['memory_mb'] * 1024 * 1024
+                _set_rlimit(resource.RLIMIT_DATA, data_bytes, data_bytes)
+            if limits['file_size_mb']:
+                file_bytes = limits['file_size_mb'] * 1024 * 1024
+                _set_rlimit(resource.RLIMIT_FSIZE, file_bytes, file_bytes)
+            _set_rlimit(resource.RLIMIT_CORE, 0, 0)
+        if self.limits['nice']:
+            os.nice(self.limits['nice'])
+
+    def started(self):
+        """Marca el inicio del comando (para el tiempo real transcurrido)."""
+        self._started_at = time.time()
+
+    def poll(self, process, timeout=0.0):
+        """
+        Espera como mucho timeout segundos a que termine el proceso y lo recoge con wait4
+        para obtener su uso de recursos (y el de los descendientes que haya esperado).
+
+        Returns:
+            bool: True si el proceso ha terminado
+        """
+        if process.returncode is not None:
+            return True
+        if not hasattr(os, 'wait4'):
+            try:
+                process.wait(timeout=timeout)
+                return True
+            except subprocess.TimeoutExpired:
+                return False
+        deadline = time.time() + timeout
+        while True:
+            try:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Ya recogido por otra vía; Popen conoce el código de salida
+                process.poll()
+                return process.returncode is not None
+            if pid:
+                self.rusage = rusage
+                self.exit_status = status
+                process.returncode = os.waitstatus_to_exitcode(status)
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def kill(self, process, sig=getattr(signal, 'SIGKILL', signal.SIGTERM)):
+        """Envía una señal a todos los procesos del comando."""
+        if sig == getattr(signal, 'SIGKILL', None) and self.cgroup is not None and os.path.exists(os.path.join(self.cgroup, 'cgroup.kill')):
+            try:
+                _write(os.path.join(self.cgroup, 'cgroup.kill'), 1)
+                return
+            except OSError:
+                pass
+        try:
+            if hasattr(os, 'killpg'):
+                # El comando se lanza en su propia sesión: se señala a todo el grupo
+                # para no dejar procesos hijos (npm, servidores...) huérfanos
+                os.killpg(process.pid, sig)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def limit_exceeded(self):
+        """Devuelve el límite que detuvo el comando (LIMIT_CPU o LIMIT_MEMORY), o None."""
+        sigxcpu = getattr(signal, 'SIGXCPU', None)
+        if self.exit_status is not None and sigxcpu is not None:
+            # El shell devuelve 128 + señal cuando la recibe el comando que ejecuta
+            if os.WIFSIGNALED(self.exit_status) and os.WTERMSIG(self.exit_status) == sigxcpu:
+                return LIMIT_CPU
+            if os.WIFEXITED(self.exit_status) and os.WEXITSTATUS(self.exit_status) == 128 + sigxcpu:
+                return LIMIT_CPU
+        if self.cgroup is not None and _read_int(os.path.join(self.cgroup, 'memory.events'), 'oom_kill'):
+            return LIMIT_MEMORY
+        return None
+
+    def usage(self):
+        """
+        Devuelve el uso de recursos del comando.
+
+        Returns:
+            dict: 'wall_seconds', 'cpu_user_seconds', 'cpu_system_seconds', 'max_rss_mb' y,
+            con cgroup, 'cpu_seconds', 'memory_peak_mb' y 'pids_peak'
+        """
+        usage = {
+            'wall_seconds': round(time.time() - self._started_at, 3) if self._started_at else None,
+            'cpu_user_seconds': None,
+            'cpu_system_seconds': None,
+            'max_rss_mb': None,
+            'sandbox': 'cgroup' if self.cgroup is not None else 'rlimit'
+        }
+        if self.rusage is not None:
+            usage['cpu_user_seconds'] = round(self.rusage.ru_utime, 3)
+            usage['cpu_system_seconds'] = round(self.rusage.ru_stime, 3)
+            # ru_maxrss está en KiB en Linux
+            usage['max_rss_mb'] = round(self.rusage.ru_maxrss / 1024, 1)
+        if self.cgroup is not None:
+            cpu_usec = _read_int(os.path.join(self.cgroup, 'cpu.stat'), 'usage_usec')
+            memory_peak = (_read_int(os.path.join(self.cgroup, 'memory.peak'))
+                           or _read_int(os.path.join(self.cgroup, 'memory.current')))
+            usage['cpu_seconds'] = round(cpu_usec / 1e6, 3) if cpu_usec is not None else None
+            usage['memory_peak_mb'] = round(memory_peak / (1024 * 1024), 1) if memory_peak is not None else None
+            usage['pids_peak'] = _read_int(os.path.join(self.cgroup, 'pids.peak'))
+        return usage
+
+    def cleanup(self):
+        """Elimina el cgroup del comando (los procesos que queden se matan antes)."""
+        if self.cgroup is None:
+            return
+        for _ in range(20):
+            try:
+                os.rmdir(self.cgroup)
+                return
+            except OSError:
+                if os.path.exists(os.path.join(self.cgroup, 'cgroup.kill')):
+                    try:
+                        _write(os.path.join(self.cgroup, 'cgroup.kill'), 1)
+                    except OSError:
+                        pass
+                time.sleep(0.05)
+        logger.warning(f"No se pudo eliminar el cgroup {self.cgroup}")
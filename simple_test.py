@@ -4,10 +4,13 @@ import json
 import logging
 import subprocess
 from pathlib import Path
-from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, url_for, flash
+from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, url_for, flash, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import requests  # Usamos requests en lugar de aiohttp
 import project_analyzer  # Importar el analizador de proyectos
+import workspace_index  # Índice en memoria de los archivos del workspace
+import command_runner  # Ejecución de comandos en segundo plano
+from command_routes import job_response_fields
 from agents_utils import explore_repository_files  # Importar función para explorar repositorios
 # Configurar logging
 logging.basicConfig(level=logging.INFO,
@@ -94,8 +97,14 @@ def list_files(directory='.', user_id='default', filter_system_files=True):
             logger.error(f"Error al cargar la lista de archivos del sistema: {e}")
     
     try:
+        # Consultar el índice del workspace; si aún no cubre el directorio, leer el disco
+        indexed_entries = workspace_index.get_workspace_index(workspace).list_directory(target_dir)
+
         entries = []
-        for entry in os.listdir(target_dir):
+        for entry in (indexed_entries if indexed_entries is not None else os.listdir(target_dir)):
+            if indexed_entries is not None:
+                entry, is_dir, indexed_size = entry
+
             # Saltamos el archivo de sistema que contiene los registros
             if entry == '.system_files.json':
                 continue
@@ -109,11 +118,14 @@ def list_files(directory='.', user_id='default', filter_system_files=True):
                 logger.warning(f"Saltando entrada potencialmente insegura: {rel_path}")
                 continue
                 
-            # Verificar que la entrada existe antes de intentar determinar su tipo
-            if not os.path.exists(entry_path):
-                continue
-                
-            entry_type = 'directory' if os.path.isdir(entry_path) else 'file'
+            if indexed_entries is not None:
+                entry_type = 'directory' if is_dir else 'file'
+            else:
+                # Verificar que la entrada existe antes de intentar determinar su tipo
+                if not os.path.exists(entry_path):
+                    continue
+
+                entry_type = 'directory' if os.path.isdir(entry_path) else 'file'
             
             # Verificar si este archivo o directorio debería ser filtrado
             should_filter = False
@@ -126,7 +138,7 @@ def list_files(directory='.', user_id='default', filter_system_files=True):
             if not should_filter:
                 if entry_type == 'file':
                     try:
-                        file_size = os.path.getsize(entry_path)
+                        file_size = indexed_size if indexed_entries is not None else os.path.getsize(entry_path)
                         file_extension = os.path.splitext(entry)[1].lower()[1:] if '.' in entry else ''
                         
                         entries.append({
@@ -644,6 +656,7 @@ def api_chat():
         agent_id = data.get('agent_id', 'general')
         model_choice = data.get('model', 'openai')
         context = data.get('context', [])
+        conversation_id = data.get('conversation_id')
         
         # Para depuración, verificamos si las claves API están configuradas
         openai_key = os.environ.get('OPENAI_API_KEY')
@@ -664,8 +677,41 @@ def api_chat():
                 'error': error_msg
             }), 400
         
-        # Filtrar mensajes de sistema del contexto (como "Conectando con el servidor...")
-        filtered_context = [msg for msg in context if msg.get('role') != 'system' and msg.get('content')]
+        # Con conversation_id el historial se lee del almacén del servidor; sin él se usa
+        # el contexto enviado por el cliente (sin mensajes de sistema como "Conectando...")
+        from conversation_store import load_history, record_exchange
+        filtered_context = load_history(conversation_id, context)
+        
+        # Si el cliente lo solicita, devolver la respuesta como Server-Sent Events
+        wants_stream = data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')
+        if wants_stream:
+            from agents_utils import generate_response_stream
+            
+            def event_stream():
+                chunks = []
+                try:
+                    for delta in generate_response_stream(
+                        user_message=message,
+                        agent_id=agent_id,
+                        context=filtered_context,
+                        model=model_choice,
+                        conversation_id=conversation_id
+                    ):
+                        chunks.append(delta)
+                        yield f"event: chunk\ndata: {json.dumps({'content': delta}, ensure_ascii=False)}\n\n"
+                    
+                    logger.info(f"Respuesta en streaming completada para '{message}'")
+                    record_exchange(conversation_id, message, ''.join(chunks), agent_id)
+                    yield f"event: done\ndata: {json.dumps({'success': True, 'response': ''.join(chunks), 'agent_id': agent_id}, ensure_ascii=False)}\n\n"
+                except Exception as stream_error:
+                    logger.error(f"Error en el streaming del chat: {str(stream_error)}")
+                    yield f"event: error\ndata: {json.dumps({'success': False, 'error': str(stream_error)}, ensure_ascii=False)}\n\n"
+            
+            return Response(
+                stream_with_context(event_stream()),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         
         # Importar aquí para evitar problemas de importación circular
         from agents_utils import generate_response
@@ -675,7 +721,8 @@ def api_chat():
             user_message=message,
             agent_id=agent_id,
             context=filtered_context,
-            model=model_choice
+            model=model_choice,
+            conversation_id=conversation_id
         )
         
         if not response_data.get('success'):
@@ -686,6 +733,7 @@ def api_chat():
         
         response = response_data.get('response', '')
         logger.info(f"Respuesta generada correctamente para '{message}'")
+        record_exchange(conversation_id, message, response, agent_id)
         
         return jsonify({
             'success': True,
@@ -713,10 +761,43 @@ def api_chat():
             'suggestion': "Por favor, verifica el formato de tu solicitud y que todos los campos requeridos estén presentes."
         }), 500
 
+@app.route('/api/chat/history/<conversation_id>', methods=['GET'])
+def api_chat_history(conversation_id):
+    """API para recuperar el historial de una conversación guardado en el servidor."""
+    try:
+        from conversation_store import get_conversation_store, is_valid_conversation_id
+
+        if not is_valid_conversation_id(conversation_id):
+            return jsonify({
+                'success': False,
+                'error': 'Identificador de conversación no válido'
+            }), 400
+
+        store = get_conversation_store()
+        summary = store.get_summary(conversation_id)
+        return jsonify({
+            'success': True,
+            'conversation_id': conversation_id,
+            'messages': store.get_messages(conversation_id),
+            'summary': summary['summary'] or None,
+            'summarized_count': summary['summarized_count']
+        })
+    except Exception as e:
+        logger.error(f"Error al obtener el historial de la conversación: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 # API para ejecución de comandos
 @app.route('/api/execute', methods=['POST'])
 def api_execute_command():
-    """API para ejecutar comandos directamente en el workspace del usuario."""
+    """
+    API para ejecutar comandos directamente en el workspace del usuario.
+    
+    Si el comando no termina en COMMAND_WAIT_SECONDS (o se pide background), se responde
+    con 202 y el trabajo; su salida se sigue en /api/commands/<job_id>/stream.
+    """
     # Definir command fuera del bloque try para que esté disponible en los bloques except
     command = None
     
@@ -738,50 +819,59 @@ def api_execute_command():
         # Agregar información de registro sobre el comando ejecutado
         logger.info(f"Ejecutando comando: '{command}' en workspace '{user_id}', agente: {agent_id}")
         
-        # Ejecutar el comando en un subproceso
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=workspace
+        # Ejecutar el comando como trabajo en segundo plano; si no termina enseguida se
+        # responde con el trabajo y el cliente sigue la salida en /api/commands/<id>/stream
+        job = command_runner.execute(
+            command, workspace,
+            timeout=data.get('timeout'),
+            wait_seconds=0 if data.get('background') else None
         )
         
-        # Esperar la respuesta con un tiempo límite de 30 segundos
-        stdout, stderr = process.communicate(timeout=30)
-        status = process.returncode
+        if job['status'] not in command_runner.FINISHED_STATUSES:
+            return jsonify({
+                'success': True,
+                'command': command,
+                'stdout': '',
+                'stderr': '',
+                'status': None,
+                'agent_id': agent_id,
+                **job_response_fields(job)
+            }), 202
+        
+        if job['status'] == command_runner.JOB_TIMEOUT:
+            logger.error(f"Timeout al ejecutar comando: '{command}'")
+            return jsonify({
+                'success': False,
+                'error': f"{job['error']} para el comando: {command}",
+                'stdout': job['stdout'],
+                'stderr': job['stderr']
+            }), 504
+        
+        if job['status'] == command_runner.JOB_ERROR:
+            return jsonify({
+                'success': False,
+                'error': job['error']
+            }), 500
         
-        # Preparar la respuesta con los resultados de la ejecución
-        stdout_text = stdout.decode('utf-8', errors='replace')
-        stderr_text = stderr.decode('utf-8', errors='replace')
+        status = job['exit_code']
         
         # Registrar el resultado del comando si hubo un error
         if status != 0:
-            logger.warning(f"Comando '{command}' terminó con código {status}. Stderr: {stderr_text}")
+            logger.warning(f"Comando '{command}' terminó con código {status}. Stderr: {job['stderr']}")
         
         result = {
             'success': True,
             'command': command,
-            'stdout': stdout_text,
-            'stderr': stderr_text,
+            'stdout': job['stdout'],
+            'stderr': job['stderr'],
             'status': status,
-            'agent_id': agent_id
+            'agent_id': agent_id,
+            'job_id': job['job_id'],
+            'job_status': job['status'],
+            'usage': job['usage']
         }
         
         return jsonify(result)
-    except subprocess.TimeoutExpired as e:
-        # Ahora command está disponible aquí
-        error_msg = f'Tiempo de ejecución agotado (30s)'
-        if command:
-            error_msg += f' para el comando: {command}'
-            logger.error(f"Timeout al ejecutar comando: '{command}'")
-        else:
-            logger.error("Timeout al ejecutar un comando desconocido")
-        
-        return jsonify({
-            'success': False,
-            'error': error_msg
-        }), 504
     except Exception as e:
         error_cmd = f" ejecutando '{command}'" if command else ""
         logger.error(f"Error al ejecutar comando{error_cmd}: {str(e)}")
@@ -982,30 +1072,39 @@ def process_instruction():
             # Registrar la acción
             logger.info(f"Procesando instrucción como comando directo: '{command}' con agente {agent_id}")
             
-            # Ejecutar el comando
-            process = subprocess.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=workspace
-            )
+            # Ejecutar el comando en segundo plano; si no termina enseguida se responde
+            # con el trabajo para seguir su salida en /api/commands/<id>/stream
+            job = command_runner.execute(command, workspace)
+            
+            if job['status'] not in command_runner.FINISHED_STATUSES:
+                return jsonify({
+                    'success': True,
+                    'command': command,
+                    'result': '',
+                    'error': '',
+                    'status': None,
+                    'agent_id': agent_id,
+                    'model': model,
+                    **job_response_fields(job)
+                }), 202
             
-            stdout, stderr = process.communicate(timeout=30)
-            status = process.returncode
+            if job['status'] == command_runner.JOB_TIMEOUT:
+                return jsonify({
+                    'success': False,
+                    'error': job['error']
+                }), 504
             
-            stdout_text = stdout.decode('utf-8', errors='replace')
-            stderr_text = stderr.decode('utf-8', errors='replace')
+            status = job['exit_code']
             
             # Registrar el resultado si hubo error
             if status != 0:
-                logger.warning(f"Comando '{command}' terminó con código {status}. Stderr: {stderr_text}")
+                logger.warning(f"Comando '{command}' terminó con código {status}. Stderr: {job['stderr']}")
             
             return jsonify({
                 'success': True,
                 'command': command,
-                'result': stdout_text,
-                'error': stderr_text,
+                'result': job['stdout'],
+                'error': job['stderr'] or job['error'] or '',
                 'status': status,
                 'agent_id': agent_id,
                 'model': model
@@ -1630,19 +1729,14 @@ module.exports = router;"""
             # Ejecutar cada comando creado
             for command in commands:
                 try:
-                    process = subprocess.Popen(
-                        command,
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        cwd=workspace
-                    )
-                    stdout, stderr = process.communicate(timeout=30)
-                    status = process.returncode
+                    job = command_runner.execute(command, workspace)
                     
-                    if status != 0:
-                        stderr_text = stderr.decode('utf-8', errors='replace')
-                        logger.warning(f"Comando '{command}' terminó con código {status}. Stderr: {stderr_text}")
+                    if job['status'] not in command_runner.FINISHED_STATUSES:
+                        # Sigue en segundo plano: no se bloquea la petición esperándolo
+                        result_messages.append(f"⏳ '{command}' sigue ejecutándose (trabajo {job['job_id']})")
+                    elif job['status'] != command_runner.JOB_DONE or job['exit_code'] != 0:
+                        stderr_text = job['stderr'] or job['error'] or ''
+                        logger.warning(f"Comando '{command}' terminó con código {job['exit_code']}. Stderr: {stderr_text}")
                         result_messages.append(f"⚠️ Advertencia al ejecutar '{command}': {stderr_text}")
                 except Exception as e:
                     logger.error(f"Error ejecutando comando '{command}': {e}")
@@ -1892,11 +1986,6 @@ module.exports = router;"""
                       "4) Para construir una aplicación: 'crea una aplicación [tipo]' (ej: Flask, Node, React).\n"
         })
             
-    except subprocess.TimeoutExpired:
-        return jsonify({
-            'success': False,
-            'error': 'Tiempo de ejecución agotado (30s)'
-        }), 504
     except Exception as e:
         logger.error(f"Error al procesar instrucción: {str(e)}")
         return jsonify({
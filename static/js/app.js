@@ -200,6 +200,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 return response.json();
             })
+            .then(data => data && data.running ? this.followCommand(data) : data)
             .then(data => {
                 if (!data) return;
                 
@@ -229,6 +230,45 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         },
         
+        // Sigue la salida de un comando que continúa en segundo plano, mostrándola
+        // a medida que llega, y resuelve con el resultado final
+        followCommand: function(data) {
+            const stdout = [];
+            const stderr = [];
+            let since = 0;
+            this.elements.outputDisplay.textContent = '';
+            
+            return new Promise((resolve, reject) => {
+                const poll = () => {
+                    fetch(`/api/commands/${data.job_id}?since=${since}`)
+                        .then(response => response.json())
+                        .then(result => {
+                            if (!result.success) {
+                                throw new Error(result.error || 'Comando no encontrado');
+                            }
+                            const job = result.job;
+                            job.output.forEach(line => {
+                                since = line.seq;
+                                (line.stream === 'stderr' ? stderr : stdout).push(line.text);
+                                this.elements.outputDisplay.textContent += line.text + '\n';
+                            });
+                            if (['queued', 'running'].includes(job.status)) {
+                                setTimeout(poll, 500);
+                                return;
+                            }
+                            resolve({
+                                stdout: stdout.join('\n'),
+                                stderr: [stderr.join('\n'), job.error || ''].filter(Boolean).join('\n'),
+                                exitCode: job.exit_code,
+                                workspace: data.workspace
+                            });
+                        })
+                        .catch(reject);
+                };
+                poll();
+            });
+        },
+        
         displayError: function(errorMessage) {
             const errorDiv = document.createElement('div');
             errorDiv.classList.add('alert', 'alert-danger', 'mt-2');
@@ -505,6 +545,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 return response.json();
             })
+            .then(data => data.running ? this.followCommand(data) : data)
             .then(data => {
                 if (data.error) {
                     this.displayError(data.error);
@@ -405,7 +405,11 @@ function initCreationCommandDetection() {
     lastInstructionType: '',
     pendingActions: [],
     creationInProgress: false,
-    messageHistory: []
+    messageHistory: [],
+    // Identificador de la conversación para que el servidor mantenga su resumen
+    conversationId: (window.crypto && window.crypto.randomUUID)
+      ? window.crypto.randomUUID()
+      : `conv-${Date.now()}-${Math.random().toString(36).slice(2, 10)}`
   };
 }
 
@@ -574,31 +578,10 @@ function sendMessage(message) {
   const modelSelect = document.getElementById('model-select');
   const selectedModel = modelSelect ? modelSelect.value : 'openai';
 
-  // Obtener el contexto de la conversación reciente (últimos 5 mensajes)
-  let conversationContext = [];
-  const chatMessages = document.querySelectorAll('.chat-message');
-  let contextCount = 0;
-
-  // Reunir los últimos mensajes como contexto, hasta un máximo de 5
-  for (let i = chatMessages.length - 2; i >= 0 && contextCount < 5; i--) { // -2 para ignorar el mensaje actual
-    const msg = chatMessages[i];
-    const role = msg.classList.contains('user-message') ? 'user' :
-      msg.classList.contains('system-message') ? 'system' : 'assistant';
-    const content = msg.querySelector('.message-content').textContent;
-
-    // Añadir al inicio para mantener el orden cronológico
-    conversationContext.unshift({
-      role: role,
-      content: content
-    });
-
-    contextCount++;
-  }
-
   console.log("Enviando mensaje al backend:", {
     message: message,
     agent_id: agentId,
-    context: conversationContext,
+    conversation_id: window.app.conversationState.conversationId,
     model: selectedModel,
     collaborative_mode: collaborativeMode
   });
@@ -607,7 +590,7 @@ function sendMessage(message) {
   console.log("Enviando datos al servidor:", {
     message,
     agent_id: agentId,
-    context: conversationContext,
+    conversation_id: window.app.conversationState.conversationId,
     model: selectedModel,
     collaborative_mode: collaborativeMode
   });
@@ -646,14 +629,18 @@ function sendMessage(message) {
   const documentSelector = document.getElementById('document-selector');
   const selectedDocument = documentSelector ? documentSelector.value : '';
 
+  // El historial se guarda en el servidor: solo se envía el mensaje nuevo y el estado
+  // sin messageHistory, que se queda en el cliente para detectar documentos ya procesados
+  const { messageHistory, ...conversationState } = window.app.conversationState;
+
   // Datos de la solicitud
   const requestData = {
     message,
     agent_id: agentId,
-    context: conversationContext,
     model: selectedModel,
     collaborative_mode: collaborativeMode,
-    conversation_state: window.app.conversationState
+    conversation_state: conversationState,
+    conversation_id: window.app.conversationState.conversationId
   };
 
   // Si hay un documento seleccionado, usar la API con contexto de documento
@@ -684,7 +671,7 @@ function sendMessage(message) {
       document_filename: selectedDocument,
       agent_id: agentId,
       document_already_processed: documentAlreadyProcessed,
-      context: conversationContext  // Incluir contexto de conversación para documentos procesados
+      conversation_id: window.app.conversationState.conversationId
     }
     : requestData;
 
@@ -0,0 +1,65 @@
+/**
+ * Seguimiento de comandos en segundo plano
+ * Cuando /api/execute o /api/process responden con un comando que sigue en ejecución
+ * (campo running), su salida se recibe en directo por Server-Sent Events.
+ */
+const CommandStream = (function() {
+    /**
+     * Sigue la salida de un comando hasta que termina.
+     *
+     * @param {Object} data - Respuesta con job_id y stream_url
+     * @param {Function} onLine - Se llama con cada línea ({seq, stream, text}) al llegar
+     * @returns {Promise<Object>} La respuesta original completada con stdout, stderr y status
+     */
+    function follow(data, onLine) {
+        const stdout = [];
+        const stderr = [];
+
+        return new Promise((resolve, reject) => {
+            // EventSource reconecta solo y envía Last-Event-ID, así que no se repiten líneas
+            const source = new EventSource(data.stream_url);
+
+            source.addEventListener('output', event => {
+                const line = JSON.parse(event.data);
+                (line.stream === 'stderr' ? stderr : stdout).push(line.text);
+                if (onLine) onLine(line);
+            });
+
+            source.addEventListener('done', event => {
+                const job = JSON.parse(event.data);
+                source.close();
+                resolve(Object.assign({}, data, {
+                    running: false,
+                    job_status: job.status,
+                    success: job.status !== 'error',
+                    stdout: stdout.join('\n'),
+                    stderr: stderr.join('\n'),
+                    status: job.exit_code,
+                    error: job.error
+                }));
+            });
+
+            source.addEventListener('error', () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    reject(new Error('Se perdió la conexión con el comando'));
+                }
+            });
+        });
+    }
+
+    /**
+     * Cancela un comando en ejecución.
+     *
+     * @param {string} jobId - ID del trabajo
+     * @returns {Promise<Object>} Respuesta del servidor
+     */
+    function cancel(jobId) {
+        return fetch(`/api/commands/${jobId}/cancel`, { method: 'POST' })
+            .then(response => response.json());
+    }
+
+    return {
+        follow: follow,
+        cancel: cancel
+    };
+})();
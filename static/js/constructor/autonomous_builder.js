@@ -35,6 +35,7 @@ class AutonomousProjectBuilder {
         this.isBuilding = false;
         this.isPaused = false;
         this.updateInterval = null;
+        this.eventSource = null;
         this.notificationsCount = 0;
         this.lastNotificationId = 0;
         this.errorCount = 0;
@@ -152,6 +153,9 @@ class AutonomousProjectBuilder {
                 let mensaje;
                 
                 switch (speedOption) {
+                    case 'turbo':
+                        mensaje = 'Modo turbo: El constructor no hará pausas entre pasos; el tiempo de construcción dependerá solo del trabajo real';
+                        break;
                     case 'fast':
                         mensaje = 'Modo rápido: El constructor priorizará la velocidad sobre la validación exhaustiva';
                         break;
@@ -437,9 +441,54 @@ class AutonomousProjectBuilder {
     }
     
     /**
-     * Comienza la monitorización periódica del progreso del proyecto.
+     * Comienza a seguir el progreso del proyecto.
+     * El servidor envía el progreso, los mensajes y las notificaciones por Server-Sent
+     * Events; si el navegador no lo admite o el servidor no tiene eventos del proyecto,
+     * se consulta su estado periódicamente.
      */
     startProgressMonitoring() {
+        this.stopProgressMonitoring();
+        
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        
+        // EventSource reconecta solo y envía Last-Event-ID, así que no se repiten eventos
+        const source = new EventSource(`/api/constructor/projects/${this.activeProjectId}/stream`);
+        this.eventSource = source;
+        
+        source.addEventListener('progress', event => {
+            this.updateProjectUI(JSON.parse(event.data));
+        });
+        
+        source.addEventListener('message', event => {
+            this.handleServerMessage(JSON.parse(event.data));
+        });
+        
+        source.addEventListener('notification', event => {
+            const notification = JSON.parse(event.data);
+            this.projectNotifications.push(notification);
+            this.addNotification(notification);
+        });
+        
+        source.addEventListener('end', () => {
+            this.finishBuild();
+        });
+        
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED && this.eventSource === source) {
+                // El servidor rechazó el seguimiento: consultar el estado periódicamente
+                this.eventSource = null;
+                this.startPolling();
+            }
+        });
+    }
+    
+    /**
+     * Comienza la consulta periódica del estado del proyecto.
+     */
+    startPolling() {
         // Limpiar cualquier intervalo existente
         if (this.updateInterval) {
             clearInterval(this.updateInterval);
@@ -473,11 +522,7 @@ class AutonomousProjectBuilder {
                     
                     // Si el proyecto se ha completado o ha fallado, detener la monitorización
                     if (['completed', 'error'].includes(project.status)) {
-                        this.stopProgressMonitoring();
-                        this.isBuilding = false;
-                        this.startButton.disabled = false;
-                        this.pauseButton.disabled = true;
-                        this.resumeButton.disabled = true;
+                        this.finishBuild();
                     }
                 } else {
                     console.error('Error al obtener estado del proyecto:', data.error);
@@ -488,6 +533,17 @@ class AutonomousProjectBuilder {
             });
     }
     
+    /**
+     * Detiene el seguimiento y restablece los controles al terminar la construcción.
+     */
+    finishBuild() {
+        this.stopProgressMonitoring();
+        this.isBuilding = false;
+        this.startButton.disabled = false;
+        this.pauseButton.disabled = true;
+        this.resumeButton.disabled = true;
+    }
+    
     /**
      * Actualiza la UI con la información del proyecto.
      */
@@ -498,6 +554,7 @@ class AutonomousProjectBuilder {
         
         // Actualizar estado
         const phases = {
+            'queued': 'En cola',
             'initial': 'Iniciando',
             'analysis': 'Analizando requisitos',
             'planning': 'Planificando estructura',
@@ -515,7 +572,10 @@ class AutonomousProjectBuilder {
             'general': 'General'
         };
         
-        const statusText = phases[project.phase] || project.phase;
+        let statusText = phases[project.phase] || project.phase;
+        if (project.status === 'queued' && project.queue && project.queue.position) {
+            statusText = `${statusText} (posición ${project.queue.position})`;
+        }
         
         // Si hay un agente activo, mostrarlo en el estado
         if (project.current_agent && agentNames[project.current_agent]) {
@@ -632,30 +692,35 @@ class AutonomousProjectBuilder {
             // Si hay más mensajes en el servidor que en la UI, añadir los nuevos
             if (project.messages.length > currentCount) {
                 const newMessages = project.messages.slice(currentCount);
-                newMessages.forEach(msg => {
-                    this.addMessage(msg.content, msg.role);
-                    
-                    // Si es un mensaje del sistema, también añadir como notificación
-                    if (msg.role === 'system') {
-                        // Extraer título del mensaje (primera línea)
-                        const lines = msg.content.split('\n');
-                        const title = lines[0].replace(/[*#]/g, '').trim();
-                        const message = lines.slice(1).join('\n').trim();
-                        
-                        this.addNotification({
-                            title: title || 'Notificación del sistema',
-                            message: message || msg.content,
-                            type: msg.content.includes('❌') ? 'error' : 
-                                  msg.content.includes('⚠️') ? 'warning' : 
-                                  msg.content.includes('✅') ? 'success' : 'info',
-                            timestamp: new Date().toISOString()
-                        });
-                    }
-                });
+                newMessages.forEach(msg => this.handleServerMessage(msg));
             }
         }
     }
     
+    /**
+     * Muestra un mensaje nuevo del constructor en el chat.
+     */
+    handleServerMessage(msg) {
+        this.addMessage(msg.content, msg.role);
+        
+        // Si es un mensaje del sistema, también añadir como notificación
+        if (msg.role === 'system') {
+            // Extraer título del mensaje (primera línea)
+            const lines = msg.content.split('\n');
+            const title = lines[0].replace(/[*#]/g, '').trim();
+            const message = lines.slice(1).join('\n').trim();
+            
+            this.addNotification({
+                title: title || 'Notificación del sistema',
+                message: message || msg.content,
+                type: msg.content.includes('❌') ? 'error' : 
+                      msg.content.includes('⚠️') ? 'warning' : 
+                      msg.content.includes('✅') ? 'success' : 'info',
+                timestamp: new Date().toISOString()
+            });
+        }
+    }
+    
     /**
      * Añade una notificación al panel de notificaciones.
      */
@@ -736,9 +801,13 @@ class AutonomousProjectBuilder {
     }
     
     /**
-     * Detiene la monitorización periódica.
+     * Detiene el seguimiento del progreso (eventos o consulta periódica).
      */
     stopProgressMonitoring() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         if (this.updateInterval) {
             clearInterval(this.updateInterval);
             this.updateInterval = null;
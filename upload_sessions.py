@@ -0,0 +1,429 @@
+"""
+Sesiones de subida reanudables para Codestorm Assistant.
+Cada subida grande tiene una sesión con un archivo preasignado de su tamaño final; los
+fragmentos se escriben directamente en su posición, la sesión registra los rangos ya
+recibidos para poder reanudar la subida y, al completarla, se verifica el SHA-256 del
+archivo antes de moverlo a su destino.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Tamaño de las lecturas del cuerpo de la petición y del archivo al calcular el hash
+IO_BLOCK_SIZE = 1024 * 1024
+
+# Los fragmentos con hash se verifican antes de escribirlos; hasta este tamaño se
+# guardan en memoria y, por encima, en un archivo temporal de la carpeta de sesiones
+VERIFY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Las sesiones sin actividad durante este tiempo se eliminan
+SESSION_TTL = 7 * 24 * 3600
+
+
+class UploadSessionError(Exception):
+    """Error de una sesión de subida, con el código HTTP que le corresponde."""
+
+    def __init__(self, message: str, status_code: int = 400, session: Optional[Dict] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.session = session
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+# Hash SHA-256 acumulado de los fragmentos recibidos en orden: upload_id -> (hasher, offset)
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+def _get_session_dir() -> str:
+    return os.environ.get('UPLOAD_SESSION_DIR', os.path.join('user_workspaces', '.upload_sessions'))
+
+
+def _paths(upload_id: str):
+    session_dir = _get_session_dir()
+    return (
+        os.path.join(session_dir, f"{upload_id}.json"),
+        os.path.join(session_dir, f"{upload_id}.part"),
+        os.path.join(session_dir, f"{upload_id}.lock")
+    )
+
+
+def _validate_id(upload_id: str):
+    try:
+        uuid.UUID(hex=upload_id)
+    except (ValueError, TypeError):
+        raise UploadSessionError("Sesión de subida no encontrada", 404)
+
+
+@contextmanager
+def _session_lock(upload_id: str):
+    """Bloquea la sesión frente a otros hilos y, si es posible, frente a otros procesos."""
+    with _locks_lock:
+        lock = _locks.setdefault(upload_id, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(_paths(upload_id)[2], 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load(upload_id: str) -> Dict:
+    _validate_id(upload_id)
+    meta_path = _paths(upload_id)[0]
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        raise UploadSessionError("Sesión de subida no encontrada", 404)
+
+
+def _save(session: Dict):
+    meta_path = _paths(session['upload_id'])[0]
+    session['updated_at'] = time.time()
+    temp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(session, file)
+    os.replace(temp_path, meta_path)
+
+
+def _remove_files(upload_id: str):
+    for path in _paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    with _locks_lock:
+        _locks.pop(upload_id, None)
+
+
+def _add_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Añade [start, end) a una lista ordenada de rangos, fusionando los contiguos."""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def _remove_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Quita [start, end) de una lista ordenada de rangos."""
+    remaining = []
+    for range_start, range_end in ranges:
+        if range_end <= start or range_start >= end:
+            remaining.append([range_start, range_end])
+            continue
+        if range_start < start:
+            remaining.append([range_start, start])
+        if range_end > end:
+            remaining.append([end, range_end])
+    return remaining
+
+
+def missing_ranges(session: Dict) -> List[List[int]]:
+    """Devuelve los rangos [inicio, fin) del archivo que aún no se han recibido."""
+    missing = []
+    position = 0
+    for start, end in session['received']:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < session['size']:
+        missing.append([position, session['size']])
+    return missing
+
+
+def describe(session: Dict) -> Dict:
+    """Estado público de una sesión para las respuestas de la API."""
+    received = sum(end - start for start, end in session['received'])
+    return {
+        'upload_id': session['upload_id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'received_bytes': received,
+        'missing': missing_ranges(session),
+        'complete': received >= session['size']
+    }
+
+
+def _prune_expired():
+    session_dir = _get_session_dir()
+    now = time.time()
+    try:
+        names = os.listdir(session_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            if now - os.path.getmtime(os.path.join(session_dir, name)) > SESSION_TTL:
+                _remove_files(name[:-len('.json')])
+                logger.info(f"Sesión de subida caducada eliminada: {name}")
+        except OSError:
+            continue
+
+
+def create_session(target_dir: str, filename: str, size: int, sha256: Optional[str] = None,
+                   chunk_size: Optional[int] = None) -> Dict:
+    """
+    Crea una sesión de subida y preasigna el archivo con su tamaño final.
+
+    Args:
+        target_dir: Directorio de destino del archivo
+        filename: Nombre (ya saneado) del archivo
+        size: Tamaño total en bytes
+        sha256: Hash SHA-256 esperado del archivo completo (opcional)
+        chunk_size: Tamaño de fragmento sugerido al cliente (opcional)
+
+    Returns:
+        dict: Estado público de la sesión
+    """
+    if size < 0:
+        raise UploadSessionError("El tamaño del archivo no es válido")
+    chunk_size = min(max(1, int(chunk_size or DEFAULT_CHUNK_SIZE)), MAX_CHUNK_SIZE)
+    if sha256 is not None:
+        sha256 = sha256.lower()
+        if len(sha256) != 64 or any(char not in '0123456789abcdef' for char in sha256):
+            raise UploadSessionError("El hash SHA-256 no es válido")
+
+    os.makedirs(_get_session_dir(), exist_ok=True)
+    _prune_expired()
+
+    upload_id = uuid.uuid4().hex
+    _, data_path, _ = _paths(upload_id)
+    fd = os.open(data_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                os.ftruncate(fd, size)
+        else:
+            os.ftruncate(fd, size)
+    except OSError:
+        os.close(fd)
+        os.remove(data_path)
+        raise UploadSessionError("No hay espacio suficiente para el archivo", 507)
+    os.close(fd)
+
+    session = {
+        'upload_id': upload_id,
+        'filename': filename,
+        'target_dir': os.path.abspath(target_dir),
+        'size': size,
+        'sha256': sha256,
+        'chunk_size': chunk_size,
+        'received': [],
+        'created_at': time.time()
+    }
+    with _session_lock(upload_id):
+        _save(session)
+    with _hashers_lock:
+        _hashers[upload_id] = (hashlib.sha256(), 0)
+    logger.info(f"Sesión de subida {upload_id} creada para {filename} ({size} bytes)")
+    return describe(session)
+
+
+def get_session(upload_id: str) -> Dict:
+    """Devuelve el estado público de una sesión (con los rangos que faltan para reanudarla)."""
+    return describe(_load(upload_id))
+
+
+def write_chunk(upload_id: str, offset: int, stream, length: Optional[int] = None,
+                chunk_sha256: Optional[str] = None) -> Dict:
+    """
+    Escribe un fragmento directamente en su posición del archivo preasignado.
+
+    Varias peticiones pueden escribir fragmentos distintos a la vez; solo la actualización
+    de los rangos recibidos se hace bajo el bloqueo de la sesión. Si se indica el hash del
+    fragmento, se verifica antes de escribir nada en el archivo. Si el fragmento llega
+    incompleto, su rango se marca como no recibido.
+
+    Args:
+        upload_id: ID de la sesión
+        offset: Posición del fragmento en el archivo
+        stream: Flujo con los datos del fragmento
+        length: Longitud del fragmento (Content-Length), si se conoce
+        chunk_sha256: Hash SHA-256 esperado del fragmento (opcional)
+
+    Returns:
+        dict: Estado público de la sesión
+    """
+    session = _load(upload_id)
+    size = session['size']
+    if offset < 0 or offset > size or (length is not None and offset + length > size):
+        raise UploadSessionError("El fragmento queda fuera del archivo", 416, describe(session))
+    if length is not None and length > MAX_CHUNK_SIZE:
+        raise UploadSessionError("El fragmento es demasiado grande", 413, describe(session))
+    expected = length if length is not None else min(size - offset, MAX_CHUNK_SIZE)
+
+    with _hashers_lock:
+        entry = _hashers.get(upload_id)
+        if entry is not None and offset < entry[1]:
+            # Se reescribe una parte ya incluida en el hash: habrá que releer el archivo
+            _hashers.pop(upload_id)
+            entry = None
+    running = entry[0].copy() if entry is not None and entry[1] == offset else None
+
+    if chunk_sha256:
+        # Verificar el fragmento antes de escribirlo: uno rechazado no debe pisar los
+        # bytes ya recibidos en su rango
+        with tempfile.SpooledTemporaryFile(max_size=VERIFY_BUFFER_SIZE, dir=_get_session_dir()) as scratch:
+            chunk_hasher = hashlib.sha256()
+            buffered = 0
+            while buffered < expected:
+                data = stream.read(min(IO_BLOCK_SIZE, expected - buffered))
+                if not data:
+                    break
+                scratch.write(data)
+                chunk_hasher.update(data)
+                buffered += len(data)
+            if length is not None and buffered < length:
+                raise UploadSessionError("El fragmento llegó incompleto; vuelve a enviarlo", 400, get_session(upload_id))
+            if chunk_hasher.hexdigest() != chunk_sha256.lower():
+                raise UploadSessionError("El hash del fragmento no coincide; vuelve a enviarlo", 422, get_session(upload_id))
+            scratch.seek(0)
+            written = _write_at(upload_id, scratch.read, offset, buffered, running)
+    else:
+        written = _write_at(upload_id, stream.read, offset, expected, running)
+        if length is not None and written < length:
+            # Lo escrito del fragmento incompleto ya no es fiable: su rango vuelve a faltar
+            _discard_span(upload_id, offset, offset + written)
+            raise UploadSessionError("El fragmento llegó incompleto; vuelve a enviarlo", 400, get_session(upload_id))
+
+    with _hashers_lock:
+        if running is not None and _hashers.get(upload_id) is entry:
+            _hashers[upload_id] = (running, offset + written)
+
+    with _session_lock(upload_id):
+        session = _load(upload_id)
+        if written:
+            session['received'] = _add_range(session['received'], offset, offset + written)
+        _save(session)
+    return describe(session)
+
+
+def _write_at(upload_id: str, read, offset: int, expected: int, running) -> int:
+    """Escribe en el archivo de datos, a partir de offset, lo que devuelve read (hasta expected bytes)."""
+    _, data_path, _ = _paths(upload_id)
+    written = 0
+    fd = os.open(data_path, os.O_WRONLY)
+    try:
+        while written < expected:
+            data = read(min(IO_BLOCK_SIZE, expected - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+            if running is not None:
+                running.update(data)
+    except Exception:
+        _discard_span(upload_id, offset, offset + expected)
+        raise
+    finally:
+        os.close(fd)
+    return written
+
+
+def _discard_span(upload_id: str, start: int, end: int):
+    """Marca [start, end) como no recibido e invalida el hash acumulado."""
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    if end <= start:
+        return
+    with _session_lock(upload_id):
+        session = _load(upload_id)
+        session['received'] = _remove_range(session['received'], start, end)
+        _save(session)
+
+
+def _compute_sha256(upload_id: str, data_path: str, size: int) -> str:
+    """Termina el hash del archivo, releyendo solo lo que no se recibió en orden."""
+    with _hashers_lock:
+        entry = _hashers.pop(upload_id, None)
+    hasher, position = entry if entry is not None else (hashlib.sha256(), 0)
+    with open(data_path, 'rb') as file:
+        file.seek(position)
+        while position < size:
+            data = file.read(min(IO_BLOCK_SIZE, size - position))
+            if not data:
+                break
+            hasher.update(data)
+            position += len(data)
+    return hasher.hexdigest()
+
+
+def complete_session(upload_id: str) -> Dict:
+    """
+    Verifica que se han recibido todos los bytes y el SHA-256, y mueve el archivo a su destino.
+
+    Si el hash no coincide, los rangos recibidos se descartan para que el cliente vuelva
+    a enviar el archivo.
+
+    Returns:
+        dict: {'path', 'filename', 'size', 'sha256'} del archivo final
+    """
+    with _session_lock(upload_id):
+        session = _load(upload_id)
+        if missing_ranges(session):
+            raise UploadSessionError("Faltan fragmentos por recibir", 409, describe(session))
+
+        _, data_path, _ = _paths(upload_id)
+        digest = _compute_sha256(upload_id, data_path, session['size'])
+        if session['sha256'] and digest != session['sha256']:
+            session['received'] = []
+            _save(session)
+            with _hashers_lock:
+                _hashers[upload_id] = (hashlib.sha256(), 0)
+            raise UploadSessionError("El hash SHA-256 del archivo no coincide; vuelve a subirlo",
+                                     422, describe(session))
+
+        os.makedirs(session['target_dir'], exist_ok=True)
+        final_path = os.path.join(session['target_dir'], session['filename'])
+        os.replace(data_path, final_path)
+        os.chmod(final_path, 0o644)
+
+    _remove_files(upload_id)
+    logger.info(f"Subida {upload_id} completada: {final_path} ({session['size']} bytes, sha256 {digest})")
+    return {
+        'path': final_path,
+        'filename': session['filename'],
+        'size': session['size'],
+        'sha256': digest
+    }
+
+
+def abort_session(upload_id: str):
+    """Cancela una sesión de subida y elimina sus datos."""
+    _load(upload_id)
+    with _session_lock(upload_id):
+        _remove_files(upload_id)
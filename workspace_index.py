@@ -0,0 +1,608 @@
+"""
+Índice en memoria de la estructura de archivos de los espacios de trabajo.
+Cada workspace tiene un árbol de nodos compactos (nombre, tamaño, hijos) que se construye
+una sola vez en segundo plano y se mantiene actualizado con inotify en Linux, o con un
+sondeo periódico si inotify no está disponible. Los listados y análisis de proyectos
+consultan este árbol en lugar de recorrer el disco en cada petición. Los índices de los
+workspaces que dejan de usarse se descartan, junto con su vigilancia.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import content_index
+
+logger = logging.getLogger(__name__)
+
+# Directorios que aparecen en los listados pero cuyo contenido no se indexa ni se vigila;
+# las consultas dentro de ellos leen el disco directamente
+UNINDEXED_DIRECTORIES = frozenset([
+    '.git', 'node_modules', '__pycache__', 'venv', '.venv', '.content_index', '.extraction_cache'
+])
+
+# En modo sondeo, cada cuánto se relee el árbol completo (para los tamaños de los
+# archivos, que no cambian la fecha de modificación de su directorio)
+FULL_SYNC_SECONDS = 600
+
+# Constantes de inotify (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _load_libc():
+    """Carga las funciones de inotify de la libc, o devuelve None si no están disponibles."""
+    if not sys.platform.startswith('linux') or os.environ.get('WORKSPACE_INDEX_POLLING') == '1':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError) as e:
+        logger.info(f"inotify no disponible, el índice de archivos usará sondeo: {str(e)}")
+        return None
+
+
+_libc = _load_libc()
+
+
+class _Node:
+    """
+    Entrada del árbol: archivo (children es None y size es su tamaño) o directorio
+    (size es None; children es un dict nombre -> _Node, o None si no se indexa su contenido).
+    """
+    __slots__ = ('name', 'parent', 'children', 'size', 'link', 'mtime')
+
+    def __init__(self, name, parent, children=None, size=None, link=False):
+        self.name = name
+        self.parent = parent
+        self.children = children
+        self.size = size
+        self.link = link
+        # Fecha de modificación (ns) del directorio en su última lectura
+        self.mtime = None
+
+    @property
+    def is_dir(self):
+        return self.size is None
+
+
+class WorkspaceIndex:
+    """Árbol de archivos de un directorio raíz, actualizado con inotify o por sondeo."""
+
+    def __init__(self, root: str):
+        """
+        Inicializa el índice (se construye en segundo plano con ensure_ready).
+
+        Args:
+            root: Directorio raíz a indexar
+        """
+        self.root = os.path.abspath(root)
+        self._lock = threading.RLock()
+        self._tree = _Node(os.path.basename(self.root), None, {})
+        self._ready = threading.Event()
+        self._thread = None
+        self._inotify_fd = None
+        self._watches = {}  # descriptor de vigilancia -> nodo de directorio
+        self._last_sync = 0.0
+        self._last_access = time.time()
+        self._retired = False
+
+    # -- Construcción y mantenimiento -------------------------------------------------
+
+    def ensure_ready(self):
+        """Arranca la construcción del índice y su vigilancia en segundo plano si no se ha hecho."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="workspace-index", daemon=True)
+                self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        self.ensure_ready()
+        return self._ready.wait(timeout)
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify_fd is not None else 'polling'
+
+    def _run(self):
+        start = time.time()
+        if _libc is not None:
+            fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._inotify_fd = fd
+            else:
+                logger.warning(f"inotify_init1 falló ({os.strerror(ctypes.get_errno())}), se usará sondeo")
+
+        self._sync()
+        self._ready.set()
+        with self._lock:
+            files, directories = self._count(self._tree)
+        logger.info(f"Índice de archivos de {self.root} construido ({self.mode}): "
+                    f"{files} archivos y {directories} directorios en {time.time() - start:.1f}s")
+
+        # Si inotify deja de estar disponible (p. ej. por el límite de vigilancias), se sondea
+        self._watch_loop()
+        if not self._retired:
+            self._poll_loop()
+
+    def _retire_if_idle(self) -> bool:
+        """
+        Descarta el índice si nadie lo ha consultado en WORKSPACE_INDEX_IDLE_SECONDS.
+
+        Se retira del registro y deja de vigilarse; la próxima consulta del workspace
+        crea un índice nuevo.
+        """
+        idle = max(60.0, _env_float('WORKSPACE_INDEX_IDLE_SECONDS', 1800))
+        with _indexes_lock:
+            if time.time() - self._last_access < idle:
+                return False
+            if _indexes.get(self.root) is self:
+                del _indexes[self.root]
+        logger.info(f"Índice de archivos de {self.root} descartado por inactividad")
+        self._retired = True
+        self._switch_to_polling()
+        return True
+
+    def _count(self, node: _Node) -> Tuple[int, int]:
+        files = directories = 0
+        for child in (node.children or {}).values():
+            if child.is_dir:
+                directories += 1
+                sub_files, sub_directories = self._count(child)
+                files += sub_files
+                directories += sub_directories
+            else:
+                files += 1
+        return files, directories
+
+    def _path_of(self, node: _Node) -> str:
+        parts = []
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return os.path.join(self.root, *reversed(parts))
+
+    def _sync(self):
+        """Sincroniza el árbol completo con el disco."""
+        self._add_watch(self._tree, self.root)
+        self._sync_directory(self._tree, self.root)
+        self._last_sync = time.time()
+
+    def _sync_directory(self, node: _Node, path: str, recursive: bool = True):
+        """Relee un directorio y (si recursive) sus subdirectorios indexados, reutilizando los nodos existentes."""
+        entries = []
+        try:
+            # La fecha se toma antes de leer: un cambio durante la lectura se verá en el siguiente sondeo
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    try:
+                        is_link = entry.is_symlink()
+                        if entry.is_dir():
+                            entries.append((entry.name, None, is_link))
+                        elif entry.is_file():
+                            entries.append((entry.name, entry.stat().st_size, is_link))
+                    except OSError:
+                        continue
+        except OSError:
+            entries = None
+
+        subdirectories = []
+        with self._lock:
+            if entries is None:
+                node.mtime = None
+                self._clear_children(node)
+                return
+            node.mtime = mtime
+            current = node.children if node.children is not None else {}
+            children = {}
+            for name, size, is_link in entries:
+                child = current.pop(name, None)
+                if child is None or child.is_dir != (size is None) or child.link != is_link:
+                    if child is not None:
+                        self._forget(child)
+                    child = _Node(name, node, link=is_link)
+                    if size is None and not is_link and name not in UNINDEXED_DIRECTORIES:
+                        child.children = {}
+                child.size = size
+                children[name] = child
+                if child.children is not None:
+                    subdirectories.append(child)
+            for stale in current.values():
+                self._forget(stale)
+            node.children = children
+
+        if not recursive:
+            return
+        for child in subdirectories:
+            child_path = os.path.join(path, child.name)
+            self._add_watch(child, child_path)
+            self._sync_directory(child, child_path)
+
+    def _clear_children(self, node: _Node):
+        for child in (node.children or {}).values():
+            self._forget(child)
+        if node.children is not None:
+            node.children = {}
+
+    def _forget(self, node: _Node):
+        """Deja de vigilar un subárbol que ya no está en el índice. Requiere el lock."""
+        if node.children is None or not self._watches:
+            return
+        forgotten = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.children is not None:
+                forgotten.add(id(current))
+                stack.extend(current.children.values())
+        # Un descriptor reutilizado por un nodo nuevo (directorio movido) se conserva
+        for wd in [wd for wd, watched in self._watches.items() if id(watched) in forgotten]:
+            del self._watches[wd]
+            _libc.inotify_rm_watch(self._inotify_fd, wd)
+
+    def _add_watch(self, node: _Node, path: str):
+        fd = self._inotify_fd
+        if fd is None:
+            return
+        wd = _libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning(f"Límite de vigilancias de inotify alcanzado en {path}; "
+                               "el índice de archivos pasará a sondeo")
+                self._switch_to_polling()
+            return
+        with self._lock:
+            self._watches[wd] = node
+
+    def _switch_to_polling(self):
+        with self._lock:
+            fd, self._inotify_fd = self._inotify_fd, None
+            self._watches = {}
+        if fd is not None:
+            os.close(fd)
+
+    def _poll_directory(self, node: _Node, path: str) -> bool:
+        """
+        Relee solo los directorios cuya fecha de modificación ha cambiado desde su última
+        lectura (se crearon, borraron o renombraron entradas en ellos).
+
+        Returns:
+            bool: True si algún directorio había cambiado
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        changed = mtime is None or mtime != node.mtime
+        if changed:
+            self._sync_directory(node, path, recursive=False)
+        with self._lock:
+            subdirectories = [child for child in (node.children or {}).values() if child.children is not None]
+        for child in subdirectories:
+            changed = self._poll_directory(child, os.path.join(path, child.name)) or changed
+        return changed
+
+    def _poll_loop(self):
+        """
+        Sondea el disco: solo se releen los directorios modificados, el intervalo se
+        duplica (hasta WORKSPACE_INDEX_POLL_MAX_SECONDS) mientras no hay cambios y el
+        árbol completo se relee cada FULL_SYNC_SECONDS.
+        """
+        base_interval = max(1.0, _env_float('WORKSPACE_INDEX_POLL_SECONDS', 5))
+        max_interval = max(base_interval, _env_float('WORKSPACE_INDEX_POLL_MAX_SECONDS', 60))
+        interval = base_interval
+        while True:
+            time.sleep(interval)
+            if self._retire_if_idle():
+                return
+            changed = False
+            try:
+                if time.time() - self._last_sync >= FULL_SYNC_SECONDS:
+                    self._sync()
+                else:
+                    changed = self._poll_directory(self._tree, self.root)
+            except Exception as e:
+                logger.warning(f"Error al sincronizar el índice de archivos de {self.root}: {str(e)}")
+            interval = base_interval if changed else min(interval * 2, max_interval)
+
+    def _watch_loop(self):
+        while self._inotify_fd is not None:
+            try:
+                readable, _, _ = select.select([self._inotify_fd], [], [], 5.0)
+                if not readable:
+                    if self._retire_if_idle():
+                        break
+                    continue
+                data = os.read(self._inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except (OSError, ValueError, TypeError) as e:
+                if self._inotify_fd is not None:
+                    logger.warning(f"Error al leer eventos de inotify en {self.root}, se usará sondeo: {str(e)}")
+                    self._switch_to_polling()
+                break
+
+            changes = {}
+            overflow = False
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & IN_IGNORED:
+                    with self._lock:
+                        self._watches.pop(wd, None)
+                elif name:
+                    # Agrupar los eventos repetidos (p. ej. IN_MODIFY durante una escritura)
+                    changes.setdefault((wd, os.fsdecode(name)), None)
+
+            if overflow:
+                logger.info(f"Cola de inotify desbordada en {self.root}; se resincroniza el índice")
+                try:
+                    self._sync()
+                except Exception as e:
+                    logger.warning(f"Error al resincronizar el índice de archivos de {self.root}: {str(e)}")
+                continue
+            # Cada cambio por separado: un error en uno no debe descartar el resto del lote
+            for wd, name in changes:
+                try:
+                    with self._lock:
+                        parent = self._watches.get(wd)
+                    if parent is not None:
+                        content_index.notify_path_changed(self._refresh_entry(parent, name))
+                except Exception as e:
+                    logger.warning(f"Error al aplicar el cambio de {name} al índice de archivos de {self.root}: {str(e)}")
+
+    def _refresh_entry(self, parent: _Node, name: str, rescan: bool = False) -> str:
+        """
+        Actualiza una entrada de un directorio indexado según su estado actual en disco.
+
+        Args:
+            parent: Nodo del directorio que contiene la entrada
+            name: Nombre de la entrada
+            rescan: Si es True, relee también el contenido de un directorio ya conocido
+
+        Returns:
+            str: Ruta absoluta de la entrada
+        """
+        path = os.path.join(self._path_of(parent), name)
+        try:
+            stat = os.stat(path)
+            is_link = os.path.islink(path)
+        except OSError:
+            stat = None
+
+        with self._lock:
+            if parent.children is None:
+                return path
+            current = parent.children.get(name)
+            if stat is None or not (os.path.isdir(path) or os.path.isfile(path)):
+                if current is not None:
+                    self._forget(parent.children.pop(name))
+                changed_dir = None
+            else:
+                is_dir = os.path.isdir(path)
+                if current is not None and (current.is_dir != is_dir or current.link != is_link):
+                    self._forget(parent.children.pop(name))
+                    current = None
+                is_new = current is None
+                if is_new:
+                    current = _Node(name, parent, link=is_link)
+                    if is_dir and not is_link and name not in UNINDEXED_DIRECTORIES:
+                        current.children = {}
+                    parent.children[name] = current
+                current.size = None if is_dir else stat.st_size
+                changed_dir = current if current.children is not None and (is_new or rescan) else None
+
+        if changed_dir is not None:
+            # Directorio nuevo o movido: vigilarlo y leer su contenido
+            self._add_watch(changed_dir, path)
+            self._sync_directory(changed_dir, path)
+        return path
+
+    def update_path(self, path: str):
+        """
+        Actualiza el índice tras un cambio en un archivo o directorio.
+
+        Args:
+            path: Ruta absoluta que ha cambiado
+        """
+        relative_path = os.path.relpath(path, self.root)
+        if relative_path == os.curdir:
+            self._sync_directory(self._tree, self.root)
+            return
+        if relative_path.startswith(os.pardir):
+            return
+        # Buscar el antepasado indexado más cercano (los directorios intermedios pueden ser nuevos)
+        parts = relative_path.split(os.sep)
+        with self._lock:
+            parent = self._tree
+            depth = 0
+            while depth < len(parts) - 1 and parent.children is not None and parts[depth] in parent.children:
+                parent = parent.children[parts[depth]]
+                depth += 1
+        if parent.children is not None:
+            self._refresh_entry(parent, parts[depth], rescan=True)
+
+    # -- Consultas -------------------------------------------------------------------
+
+    def _find(self, path: str) -> Optional[_Node]:
+        """Devuelve el nodo de una ruta absoluta, o None si no está en el índice. Requiere el lock."""
+        relative_path = os.path.relpath(path, self.root)
+        if relative_path == os.curdir:
+            return self._tree
+        if relative_path.startswith(os.pardir):
+            return None
+        node = self._tree
+        for part in relative_path.split(os.sep):
+            if node.children is None:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def list_directory(self, path: str) -> Optional[List[Tuple[str, bool, Optional[int]]]]:
+        """
+        Lista el contenido de un directorio desde el índice.
+
+        Args:
+            path: Ruta absoluta del directorio
+
+        Returns:
+            list o None: Entradas (nombre, es_directorio, tamaño), o None si el índice no
+            cubre el directorio y hay que consultar el disco
+        """
+        if not self.ready:
+            return None
+        self._last_access = time.time()
+        with self._lock:
+            node = self._find(os.path.abspath(path))
+            if node is None or node.children is None:
+                return None
+            return [(child.name, child.is_dir, child.size) for child in node.children.values()]
+
+    def walk(self, path: str) -> Optional[Iterator[Tuple[str, List[str], List[str]]]]:
+        """
+        Equivalente a os.walk (de arriba abajo, sin seguir enlaces) servido desde el índice.
+
+        Como en os.walk, se puede modificar la lista de directorios para podar el recorrido.
+        Los directorios que no se indexan se recorren en disco.
+
+        Returns:
+            iterador o None: (directorio, subdirectorios, archivos), o None si el índice no
+            cubre la ruta
+        """
+        absolute = os.path.abspath(path)
+        if self.list_directory(absolute) is None:
+            return None
+        return self._walk(path, absolute)
+
+    def _walk(self, top: str, absolute: str):
+        with self._lock:
+            node = self._find(absolute)
+            if node is None:
+                return
+            if node.children is None:
+                snapshot = None
+            else:
+                snapshot = [(child.name, child.is_dir) for child in node.children.values()]
+        if snapshot is None:
+            if not node.link:
+                yield from os.walk(top)
+            return
+
+        dirnames = [name for name, is_dir in snapshot if is_dir]
+        filenames = [name for name, is_dir in snapshot if not is_dir]
+        yield top, dirnames, filenames
+        for name in dirnames:
+            with self._lock:
+                child = node.children.get(name) if node.children is not None else None
+            if child is not None and not child.link:
+                yield from self._walk(os.path.join(top, name), os.path.join(absolute, name))
+
+    def stats(self) -> Dict:
+        """Devuelve el tamaño y el estado del índice."""
+        with self._lock:
+            files, directories = self._count(self._tree)
+            return {
+                'root': self.root,
+                'ready': self.ready,
+                'mode': self.mode,
+                'files': files,
+                'directories': directories,
+                'watches': len(self._watches),
+                'last_full_sync': self._last_sync
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_workspace_index(root: str) -> WorkspaceIndex:
+    """Obtiene (o crea) el índice de archivos de un workspace y arranca su construcción."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = WorkspaceIndex(root)
+            _indexes[root] = index
+        index._last_access = time.time()
+    index.ensure_ready()
+    return index
+
+
+def find_workspace_index(path: str) -> Optional[WorkspaceIndex]:
+    """Devuelve el índice existente que cubre una ruta, o None si no hay ninguno."""
+    absolute = os.path.abspath(path)
+    with _indexes_lock:
+        for root, index in _indexes.items():
+            if absolute == root or absolute.startswith(root + os.sep):
+                index._last_access = time.time()
+                return index
+    return None
+
+
+def notify_path_changed(path: str):
+    """
+    Informa de que un archivo o directorio se ha creado, modificado o eliminado.
+
+    Actualiza en el momento los índices de archivos y de contenido que cubren la ruta,
+    sin esperar al evento de inotify o al siguiente sondeo.
+    """
+    absolute = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = [
+            index for root, index in _indexes.items()
+            if absolute == root or absolute.startswith(root + os.sep)
+        ]
+    for index in indexes:
+        if not index.ready:
+            continue
+        try:
+            index.update_path(absolute)
+        except Exception as e:
+            logger.warning(f"Error al actualizar el índice de archivos para {path}: {str(e)}")
+    content_index.notify_path_changed(absolute)